@@ -0,0 +1,147 @@
+'''Cache of /search_answer/ responses, so repeated questions skip search and the LLM call.
+
+The key is the normalized query + the user + the version of the user's document set (index.py),
+so an upload that adds a document makes the old answers unreachable instead of serving stale ones.
+Entries also expire after ANSWER_CACHE_TTL_SECONDS.
+
+Backends, picked with ANSWER_CACHE_BACKEND:
+memory - per process LRU bounded by ANSWER_CACHE_MAX_ENTRIES (default)
+redis  - shared by all workers, REDIS_URL; size is bounded by the server's maxmemory + allkeys-lru policy
+off    - no caching
+A failing backend is treated as a miss, the answer is then just generated as before.'''
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    # "What is the total of invoice 12?" and "what is the total of invoice 12" share an entry
+    return _SPACE_RE.sub(" ", query).strip().rstrip("?.! ").lower()
+
+
+def cache_key(query: str, email: str, doc_version) -> str:
+    raw = f"{email.strip().lower()}\n{doc_version}\n{normalize_query(query)}"
+    return "answer:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()  #key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: dict, ttl: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        import redis  #only needed with ANSWER_CACHE_BACKEND=redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key: str):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: dict, ttl: int):
+        self.client.setex(key, ttl, json.dumps(value, default=str))
+
+    def size(self):
+        return None  #shared keyspace, not counted per cache
+
+
+BACKENDS = {
+    "memory": lambda: MemoryBackend(ANSWER_CACHE_MAX_ENTRIES),
+    "redis": lambda: RedisBackend(REDIS_URL),
+    "off": lambda: None,
+}
+
+
+class AnswerCache:
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, stat: str):
+        with self._stats_lock:
+            self._stats[stat] += 1
+
+    def get(self, query: str, email: str, doc_version):
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(cache_key(query, email, doc_version))
+        except Exception as e:
+            print(f"[AnswerCache] Lookup failed: {e}")
+            self._record("errors")
+            return None
+        self._record("hits" if value is not None else "misses")
+        return value
+
+    def put(self, query: str, email: str, doc_version, value: dict):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(cache_key(query, email, doc_version), value, self.ttl)
+            self._record("stores")
+        except Exception as e:
+            print(f"[AnswerCache] Store failed: {e}")
+            self._record("errors")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["backend"] = ANSWER_CACHE_BACKEND
+        stats["ttl_seconds"] = self.ttl
+        stats["entries"] = self.backend.size() if self.backend is not None else 0
+        return stats
+
+
+def _make_backend(name: str):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown ANSWER_CACHE_BACKEND '{name}', expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+answer_cache = AnswerCache(_make_backend(ANSWER_CACHE_BACKEND), ANSWER_CACHE_TTL_SECONDS)
+
+
+def get_answer_cache_stats():
+    return answer_cache.stats()
@@ -0,0 +1,224 @@
+'''Shared Anthropic Messages API client, used by generate_answer, the classifier fallback and the
+extraction calls instead of each building headers and calling a bare requests.post.
+
+- one pooled requests.Session, so connections (and TLS sessions) are reused across calls
+- a deadline per call covering retries and waiting for a slot
+- retries on 429/529/5xx and connection errors with jittered exponential backoff, honouring retry-after
+- a process-wide cap on in-flight calls (semaphore) plus a token bucket sized to our requests/minute limit
+- per-call latency and token usage stats
+
+ANTHROPIC_BASE_URL can point it at a local fake server for tests and benchmarks.
+Errors are raised as requests exceptions (HTTPError, Timeout, ConnectionError) so existing
+`except requests.exceptions.RequestException` handlers keep working.'''
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from app.metrics import Histogram, timed
+
+load_dotenv()
+
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+ANTHROPIC_VERSION = "2023-06-01"
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-opus-20240229")
+ANTHROPIC_TIMEOUT = float(os.getenv("ANTHROPIC_TIMEOUT", "60"))              #seconds per call, retries included
+ANTHROPIC_CONNECT_TIMEOUT = float(os.getenv("ANTHROPIC_CONNECT_TIMEOUT", "5"))
+ANTHROPIC_MAX_RETRIES = int(os.getenv("ANTHROPIC_MAX_RETRIES", "4"))
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "8"))  #in-flight calls per process
+ANTHROPIC_REQUESTS_PER_MINUTE = float(os.getenv("ANTHROPIC_REQUESTS_PER_MINUTE", "50"))
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+BACKOFF_BASE = 0.5   #seconds
+BACKOFF_MAX = 20.0
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> bool:
+        # Blocks until a token is available, False if that would be after the deadline
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class AnthropicClient:
+    def __init__(self, api_key: str = ANTHROPIC_API_KEY, base_url: str = ANTHROPIC_BASE_URL,
+                 max_concurrency: int = ANTHROPIC_MAX_CONCURRENCY,
+                 requests_per_minute: float = ANTHROPIC_REQUESTS_PER_MINUTE,
+                 max_retries: int = ANTHROPIC_MAX_RETRIES, timeout: float = ANTHROPIC_TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "x-api-key": api_key or "",
+            "anthropic-version": ANTHROPIC_VERSION,
+            "content-type": "application/json",
+        })
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60, max_concurrency)
+
+        self.latency_histogram = Histogram("anthropic_call_seconds", "Latency of one Anthropic HTTP call",
+                                           [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60])
+        self._stats = {"calls": 0, "errors": 0, "retries": 0, "input_tokens": 0, "output_tokens": 0}
+        self._stats_lock = threading.Lock()
+
+    def _record(self, **amounts):
+        with self._stats_lock:
+            for key, amount in amounts.items():
+                self._stats[key] += amount
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        # Server hint first, otherwise full jitter exponential backoff
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return max(0.0, float(retry_after))
+                except ValueError:
+                    pass
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    def messages(self, messages: list, system: str = None, max_tokens: int = 1000, temperature: float = 0.2,
+                 model: str = ANTHROPIC_MODEL, timeout: float = None) -> dict:
+        """
+        Calls POST /v1/messages and returns the parsed JSON response.
+        timeout is the deadline for the whole call, including waiting for a slot and retries.
+        """
+        body = {"model": model, "max_tokens": max_tokens, "temperature": temperature, "messages": messages}
+        if system:
+            body["system"] = system
+        with timed("llm_call"):  #the whole call: rate limit, free slot and retries included
+            return self._post("/v1/messages", body, timeout or self.timeout)
+
+    def stream_messages(self, messages: list, system: str = None, max_tokens: int = 1000, temperature: float = 0.2,
+                        model: str = ANTHROPIC_MODEL, timeout: float = None, usage: dict = None):
+        """
+        Calls POST /v1/messages with stream=true and yields the answer text as it is generated.
+        Retries only happen before the first byte, a stream that breaks halfway raises.
+        usage, when given, receives the token counts of the stream once it ends.
+        """
+        body = {"model": model, "max_tokens": max_tokens, "temperature": temperature, "messages": messages, "stream": True}
+        if system:
+            body["system"] = system
+        with timed("llm_call"):  #until the stream starts, the time to read it is the caller's
+            response = self._post("/v1/messages", body, timeout or self.timeout, stream=True)
+
+        usage = {} if usage is None else usage
+        try:
+            for line in response.iter_lines():
+                # Server-sent events, only the data lines carry the payload (always UTF-8)
+                if not line or not line.startswith(b"data:"):
+                    continue
+                event = json.loads(line[5:].decode("utf-8"))
+                kind = event.get("type")
+                if kind == "content_block_delta" and event["delta"].get("type") == "text_delta":
+                    yield event["delta"]["text"]
+                elif kind == "message_start":
+                    usage.update(event["message"].get("usage") or {})
+                elif kind == "message_delta":
+                    usage.update(event.get("usage") or {})
+                elif kind == "error":
+                    self._record(errors=1)
+                    raise requests.exceptions.HTTPError(f"Anthropic stream error: {event.get('error')}")
+        finally:
+            response.close()
+            self._slots.release()
+            self._record(input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+
+    def _post(self, path: str, body: dict, timeout: float, stream: bool = False):
+        deadline = time.monotonic() + timeout
+        url = f"{self.base_url}{path}"
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._bucket.acquire(deadline):
+                self._record(errors=1)
+                raise requests.exceptions.Timeout(f"Anthropic call to {path} ran out of time waiting for the rate limit")
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                self._record(errors=1)
+                raise requests.exceptions.Timeout(f"Anthropic call to {path} ran out of time waiting for a free slot")
+
+            started = time.perf_counter()
+            response = None
+            error = None
+            holding_slot = True
+            try:
+                try:
+                    remaining = max(0.001, deadline - time.monotonic())
+                    response = self.session.post(url, json=body, stream=stream,
+                                                 timeout=(min(ANTHROPIC_CONNECT_TIMEOUT, remaining), remaining))
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+                self.latency_histogram.observe(time.perf_counter() - started)  #time to headers for streams
+                self._record(calls=1)
+
+                retryable = error is not None or response.status_code in RETRY_STATUSES
+                if not retryable:
+                    if response.status_code >= 400:
+                        self._record(errors=1)
+                        response.close()  #a stream's connection goes back to the pool, raise_for_status doesn't need the body
+                    response.raise_for_status()
+                    if stream:
+                        holding_slot = False  #the stream keeps its slot until it is consumed, see stream_messages
+                        return response
+                    result = response.json()
+                    usage = result.get("usage") or {}
+                    self._record(input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+                    return result
+            finally:
+                if holding_slot:
+                    self._slots.release()
+
+            delay = self._backoff(attempt, response)
+            if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                self._record(errors=1)
+                if error is not None:
+                    raise error
+                response.close()
+                response.raise_for_status()
+            if response is not None:
+                response.close()
+            print(f"[Anthropic] Retrying {path} in {delay:.2f}s (attempt {attempt + 1}, "
+                  f"{'error: ' + str(error) if error else 'status ' + str(response.status_code)})")
+            self._record(retries=1)
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["latency_seconds"] = self.latency_histogram.snapshot()
+        return stats
+
+
+anthropic_client = AnthropicClient()
@@ -0,0 +1,95 @@
+'''Micro-batching scheduler for model inference.
+
+Callers submit single items, a background thread collects them for up to max_batch_size items
+or max_wait_ms after the first one arrived, runs one batched call and resolves every caller's
+future with its own result. Under concurrent uploads this turns many single item forward passes
+into a few batched ones, at the cost of at most max_wait_ms extra latency for a lone request.'''
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.metrics import Histogram
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch_size: int, max_wait_ms: float, name: str):
+        # batch_fn takes a list of items and returns a list of results in the same order
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        size_buckets = [1, 2, 4, 8, 16, 32, 64, 128]
+        self.batch_size_histogram = Histogram(
+            f"{name}_batch_size", "Items per batched call", [b for b in size_buckets if b < self.max_batch_size] + [self.max_batch_size])
+        self.queue_time_histogram = Histogram(
+            f"{name}_queue_seconds", "Time an item waited before its batch started", [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5])
+        self.batch_time_histogram = Histogram(
+            f"{name}_batch_seconds", "Duration of one batched call", [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30])
+
+    def submit(self, item) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def infer(self, item, timeout: float = None):
+        return self.submit(item).result(timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize(),
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "queue_seconds": self.queue_time_histogram.snapshot(),
+            "batch_seconds": self.batch_time_histogram.snapshot(),
+        }
+
+    def _ensure_started(self):
+        # Started on first use so forked worker processes get their own thread
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())  #still take whatever is already waiting
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            for _, _, enqueued in batch:
+                self.queue_time_histogram.observe(started - enqueued)
+            self.batch_size_histogram.observe(len(batch))
+
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: got {len(results)} results for a batch of {len(batch)}")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                self.batch_time_histogram.observe(time.monotonic() - started)
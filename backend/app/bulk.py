@@ -0,0 +1,162 @@
+'''Bulk ingestion for onboarding: many PDFs, or ZIP/TAR archives of PDFs, in one request.
+
+Archive members are streamed out one at a time (never unpacked to disk), text extraction runs on a
+process pool sized to the cores, classification in this process through the classifier's micro-batcher
+(one model, batched across the files in flight), and the rest of the pipeline (S3 uploads, indexing,
+LLM extraction) runs on the ingest stage pools. Extracted rows are written in micro-batches through
+database.BatchWriter. Results are streamed back as NDJSON, one line per file as soon as it finishes
+(an unreadable archive gets an error line), then a summary line.'''
+import json
+import multiprocessing
+import os
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dotenv import load_dotenv
+from app.utils import extract_pages_from_pdf
+from app.classifier import classify_document
+from app.database import BatchWriter, get_content_record
+from app.ingest import store_document, reuse_document, content_hash, reusable_record
+
+load_dotenv()
+
+BULK_PROCESS_WORKERS = int(os.getenv("BULK_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", str(2 * BULK_PROCESS_WORKERS)))  #bounds memory held by pending files
+
+_process_pool = None
+_bulk_threads = ThreadPoolExecutor(max_workers=BULK_MAX_IN_FLIGHT, thread_name_prefix="bulk")
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # Spawned, not forked: this process already runs threads (uvicorn, stage pools, the batcher)
+        _process_pool = ProcessPoolExecutor(max_workers=BULK_PROCESS_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def _extract_pages(file_content: bytes) -> list:
+    # Runs in a worker process: the CPU heavy part of ingestion (worker processes can't start their own pool)
+    return extract_pages_from_pdf(file_content, parallel=False)
+
+
+def detach_upload_file(upload):
+    """
+    FastAPI closes form files as soon as the endpoint returns, before a streamed response is sent.
+    Keeps the spooled file for the stream and gives the UploadFile an empty one to close instead.
+    """
+    spooled = upload.file
+    upload.file = tempfile.SpooledTemporaryFile()
+    return upload.filename, spooled
+
+
+def iter_members(uploads):
+    """
+    Yields (filename, bytes, None) for every file in the request, reading archive members one by one,
+    and (filename, None, error) for an archive that can't be read (the members before the error are kept).
+    uploads is a list of (filename, file object).
+    """
+    for filename, fileobj in uploads:
+        name = (filename or "").lower()
+        try:
+            if name.endswith(".zip"):
+                with zipfile.ZipFile(fileobj) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir():
+                            continue
+                        with archive.open(info) as member:
+                            yield info.filename.replace("/", "_"), member.read(), None
+            elif name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+                # "r|*" reads the archive as a stream, no seeking and no temp files
+                with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+                    for member in archive:
+                        if not member.isfile():
+                            continue
+                        yield member.name.replace("/", "_"), archive.extractfile(member).read(), None
+            else:
+                yield filename, fileobj.read(), None
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError, zlib.error, RuntimeError) as e:
+            #RuntimeError: encrypted zip members
+            print(f"[Bulk] Can't read {filename}: {e}")
+            yield filename, None, f"Unreadable archive: {e}"
+        finally:
+            fileobj.close()
+
+
+def _process_member(filename: str, file_content: bytes, email: str, writer):
+    # Files seen before (in this archive or any earlier upload) skip the process pool entirely
+    record = get_content_record(content_hash(file_content))
+    if reusable_record(record):
+        return reuse_document(record, filename, email, writer=writer, size=len(file_content))
+    pages = _get_process_pool().submit(_extract_pages, file_content).result()
+    doc_type = classify_document("".join(pages))
+    return store_document(file_content, filename, email, pages, doc_type, writer=writer)
+
+
+def run_bulk_upload(uploads, email: str):
+    """
+    Generator of NDJSON lines for /upload_documents/bulk.
+    """
+    writer = BatchWriter()
+    pending = {}
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    def finished(done):
+        for future in done:
+            filename = pending.pop(future)
+            try:
+                result = future.result()
+                counts["ok"] += 1
+                line = {"filename": filename, "status": "ok", **result}
+            except Exception as e:
+                print(f"[Bulk] Failed to process {filename}: {e}")
+                counts["error"] += 1
+                line = {"filename": filename, "status": "error", "error": str(e)}
+            yield json.dumps(line, default=str) + "\n"
+
+    closed = False
+    try:
+        for filename, file_content, error in iter_members(uploads):
+            if error is not None:
+                counts["error"] += 1
+                yield json.dumps({"filename": filename, "status": "error", "error": error}) + "\n"
+                continue
+            if not filename.lower().endswith(".pdf"):
+                counts["skipped"] += 1
+                yield json.dumps({"filename": filename, "status": "skipped", "error": "Only PDF files are supported."}) + "\n"
+                continue
+
+            pending[_bulk_threads.submit(_process_member, filename, file_content, email, writer)] = filename
+
+            # Don't read further members until there is room, so memory stays bounded
+            while len(pending) >= BULK_MAX_IN_FLIGHT:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                yield from finished(done)
+
+    except GeneratorExit:
+        closed = True
+        raise
+
+    except Exception as e:
+        print(f"[Bulk] Bulk upload for {email} stopped: {e}")
+        counts["error"] += 1
+        yield json.dumps({"status": "error", "error": str(e)}) + "\n"
+
+    finally:
+        # Files already submitted always finish and their rows are written, even if the client went away
+        if closed:
+            wait(list(pending))
+            writer.flush()
+        else:
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                yield from finished(done)
+
+            writer.flush()
+            failed_rows = [result for result in writer.results if not result["ok"]]
+            yield json.dumps({"summary": {**counts, "rows_written": len(writer.results) - len(failed_rows),
+                                          "row_errors": failed_rows}}, default=str) + "\n"
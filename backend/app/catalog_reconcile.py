@@ -0,0 +1,100 @@
+'''One-shot reconciliation of the documents catalog with the bucket.
+
+Backfills catalog entries for documents uploaded before the catalog existed (or whose catalog write
+failed), fills in hash/type/page count from the dedup tables where they are known, and with --prune
+drops entries whose object was deleted from S3. Every listing is paginated, so it works on buckets
+with any number of keys. Entries written by uploads are never overwritten.
+
+The search index of every user who got new entries is rebuilt from the catalog, it may have been
+built (empty or partial) from the catalog before their older documents were backfilled.
+
+Usage (from backend/): python -m app.catalog_reconcile [--email user@example.com] [--prune] [--dry-run]'''
+import argparse
+import json
+
+from app.s3_utils import list_s3_objects, EXTRACTED_TEXTS_FOLDER
+from app.database import save_documents_bulk, backfill_document_details, list_catalog_keys, delete_documents, BULK_BATCH_SIZE
+from app.index import rebuild_index
+
+DOCUMENTS_FOLDER = "documents/"
+
+
+def split_document_key(s3_key: str):
+    """
+    "documents/{email}_{filename}" -> (email, filename), None if the key doesn't follow that pattern.
+    Emails can contain "_" before the "@", so the split is at the first "_" after it.
+    """
+    name = s3_key[len(DOCUMENTS_FOLDER):]
+    at = name.find("@")
+    split = name.find("_", at) if at != -1 else -1
+    if split == -1:
+        return None
+    return name[:split], name[split + 1:]
+
+
+def reconcile(email: str = None, prune: bool = False, dry_run: bool = False) -> dict:
+    prefix = f"{DOCUMENTS_FOLDER}{email}_" if email else DOCUMENTS_FOLDER
+    text_prefix = f"{EXTRACTED_TEXTS_FOLDER}{email}_" if email else EXTRACTED_TEXTS_FOLDER
+
+    # Which extracted texts exist, so entries only point at text keys that are really there
+    text_keys = {obj["Key"] for obj in list_s3_objects(text_prefix)}
+
+    stats = {"objects": 0, "skipped_keys": 0, "inserted": 0, "details_backfilled": 0, "pruned": 0, "indexes_rebuilt": 0}
+    seen = set()
+    batch = []
+    backfilled_users = set()
+
+    def flush():
+        if batch and not dry_run:
+            inserted = save_documents_bulk(batch)
+            stats["inserted"] += len(inserted)
+            backfilled_users.update(inserted)
+        batch.clear()
+
+    for obj in list_s3_objects(prefix):
+        stats["objects"] += 1
+        parsed = split_document_key(obj["Key"])
+        if parsed is None:
+            stats["skipped_keys"] += 1
+            continue
+        user_email, filename = parsed
+        seen.add(obj["Key"])
+        text_key = f"{EXTRACTED_TEXTS_FOLDER}{user_email}_{filename}.txt"
+        batch.append({
+            "doc_s3_key": obj["Key"],
+            "text_s3_key": text_key if text_key in text_keys else None,
+            "user_email": user_email,
+            "document_name": filename,
+            "size_bytes": obj["Size"],
+            "uploaded_at": obj["LastModified"],
+        })
+        if len(batch) >= BULK_BATCH_SIZE:
+            flush()
+    flush()
+
+    if not dry_run:
+        stats["details_backfilled"] = backfill_document_details()
+        for user_email in sorted(backfilled_users):
+            rebuild_index(user_email)
+        stats["indexes_rebuilt"] = len(backfilled_users)
+
+    if prune:
+        missing = list_catalog_keys(email) - seen
+        stats["pruned"] = len(missing) if dry_run else delete_documents(sorted(missing))
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", help="only reconcile this user's documents")
+    parser.add_argument("--prune", action="store_true", help="delete catalog entries whose S3 object is gone")
+    parser.add_argument("--dry-run", action="store_true", help="list and count, don't write")
+    args = parser.parse_args()
+
+    stats = reconcile(args.email, args.prune, args.dry_run)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
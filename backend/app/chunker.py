@@ -0,0 +1,78 @@
+'''Splits extracted text into overlapping sliding windows (passages) at ingest time.
+
+Windows are built from whole lines so a passage can be scored from the scores of its lines,
+and every passage keeps its character offsets and the pages it spans so answers can cite them.
+Texts backfilled from S3 have no page boundaries, their passages have page None.'''
+import bisect
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE_CHARS", "800"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP_CHARS", "200"))
+
+
+def page_offsets(pages: list) -> list:
+    """
+    Returns the character offset where each page starts in "".join(pages).
+    """
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page)
+    return offsets
+
+
+def page_for_offset(page_starts: list, offset: int):
+    #1-based page number containing the character offset
+    if not page_starts:
+        return None
+    return bisect.bisect_right(page_starts, offset)
+
+
+def chunk_text(text: str, page_starts: list = None, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list:
+    """
+    Returns a list of passages:
+    {"start", "end", "line_start", "line_end", "page_start", "page_end"}
+    start/end are character offsets into text, line_end is exclusive.
+    """
+    lines = text.split("\n")
+    line_starts = []
+    position = 0
+    for line in lines:
+        line_starts.append(position)
+        position += len(line) + 1  #+1 for the newline
+
+    chunks = []
+    first = 0
+    while first < len(lines):
+        # Grow the window line by line until it reaches the chunk size
+        last = first
+        while last < len(lines) and (line_starts[last] + len(lines[last]) - line_starts[first]) < size:
+            last += 1
+        last = min(max(last, first) + 1, len(lines))  #always take at least one line
+
+        start = line_starts[first]
+        end = line_starts[last - 1] + len(lines[last - 1])
+        chunks.append({
+            "start": start,
+            "end": end,
+            "line_start": first,
+            "line_end": last,
+            "page_start": page_for_offset(page_starts, start),
+            "page_end": page_for_offset(page_starts, max(start, end - 1)),
+        })
+
+        if last >= len(lines):
+            break
+
+        # Step back so the next window repeats roughly `overlap` characters of this one
+        next_first = last
+        while next_first - 1 > first and end - line_starts[next_first - 1] < overlap:
+            next_first -= 1
+        first = next_first
+
+    return chunks
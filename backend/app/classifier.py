@@ -3,34 +3,104 @@ but if contexual accuracy is very important would just go with an LLM
 (also using a classifier in house might lead us to outdated tech as LLMs these days are improving quick)
 Might consider using LLMs if cost dosen't really matter mmuch
 
-Also currently anthropic API calls are repeated across the codebase (generate_answer, classify_document).
-To improve that we would create `AnthropicClient` class. Single place to manage headers, model version,
-cleaner and easier to update and cache
+Anthropic API calls (generate_answer, classify_document, extraction) go through the shared
+`AnthropicClient` in anthropic_client.py: single place to manage headers, model version, retries and rate limits
 '''
-from transformers import pipeline
-import requests
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from app.batching import MicroBatcher
+from app.classifier_backends import load_zero_shot_pipeline, CLASSIFIER_MODEL, LLM_BACKEND
+from app.anthropic_client import anthropic_client, ANTHROPIC_API_KEY
+from app.metrics import timed
 
 load_dotenv()
 
-zero_shot_classifier = pipeline("zero-shot-classification")
 candidate_labels = ["invoice", "contract", "purchase order"]
+OTHER_LABEL = "other"  #what an Anthropic reply that names none of the candidate labels maps to
+# What anthropic_fallback_classification returns when it couldn't classify, these are not document types
+CLASSIFICATION_FAILURES = ("No API key found", "Unknown", "Error")
 
 CONFIDENCE_THRESHOLD = 0.7 #zero-shot
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "pytorch")  #pytorch, quantized, onnx or llm, see classifier_backends.py
+LLM_ONLY = CLASSIFIER_BACKEND == LLM_BACKEND  #no local model, every document is classified by Anthropic
+
+# Concurrent uploads are collected into one batched forward pass
+CLASSIFIER_MAX_BATCH_SIZE = int(os.getenv("CLASSIFIER_MAX_BATCH_SIZE", "8"))
+CLASSIFIER_MAX_WAIT_MS = float(os.getenv("CLASSIFIER_MAX_WAIT_MS", "20"))
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/complete"
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
+# The model is loaded lazily (or by the warm-up task at startup) instead of at import time,
+# so importing the app and serving non-classifier routes doesn't wait for transformers + the model
+_zero_shot_classifier = None
+_load_lock = threading.Lock()
+_load_state = {"status": "ready" if LLM_ONLY else "not_loaded", "error": None, "load_seconds": None,
+               "backend": CLASSIFIER_BACKEND, "model": None if LLM_ONLY else CLASSIFIER_MODEL}
+
+
+def get_zero_shot_classifier():
+    global _zero_shot_classifier
+    if _zero_shot_classifier is not None:
+        return _zero_shot_classifier
+
+    with _load_lock:
+        if _zero_shot_classifier is None:
+            _load_state["status"] = "loading"
+            started = time.perf_counter()
+            try:
+                #importing transformers alone takes seconds, the backends import it lazily
+                _zero_shot_classifier = load_zero_shot_pipeline(CLASSIFIER_BACKEND)
+            except Exception as e:
+                _load_state.update({"status": "error", "error": str(e)})
+                raise
+            _load_state.update({"status": "ready", "error": None, "load_seconds": round(time.perf_counter() - started, 3)})
+            print(f"[Zero-shot] {CLASSIFIER_BACKEND} classifier loaded in {_load_state['load_seconds']}s")
+    return _zero_shot_classifier
+
+
+def warm_up_classifier():
+    # Run in a background thread at startup, errors are reported through classifier_status()
+    if LLM_ONLY:
+        return
+    try:
+        get_zero_shot_classifier()
+    except Exception as e:
+        print(f"[Zero-shot] Warm-up failed: {e}")
+
+
+def classifier_status() -> dict:
+    return dict(_load_state)
+
+
+def _zero_shot_batch(texts: list) -> list:
+    # Every text is scored against every label, so the model sees len(texts) * len(labels) pairs
+    results = get_zero_shot_classifier()(texts, candidate_labels, batch_size=len(texts) * len(candidate_labels))
+    if isinstance(results, dict):
+        results = [results]
+    return results
+
+
+zero_shot_batcher = MicroBatcher(_zero_shot_batch, CLASSIFIER_MAX_BATCH_SIZE, CLASSIFIER_MAX_WAIT_MS, "zero_shot")
+
+
+def get_classifier_stats():
+    return zero_shot_batcher.stats()
+
+
+@timed("classify")
 def classify_document(text: str) -> str:
     """
     Primary classification function.
     Uses zero-shot pipeline first; if confidence is below the threshold, fall back to Anthropic.
     """
-    #Zero-shot classification
-    result = zero_shot_classifier(text, candidate_labels)
+    if LLM_ONLY:
+        return anthropic_fallback_classification(text)
+
+    #Zero-shot classification (micro-batched with other concurrent requests)
+    result = zero_shot_batcher.infer(text)
     top_label = result["labels"][0]       #top predicted label
     top_score = result["scores"][0]       # Confidence score for top label
 
@@ -48,6 +118,16 @@ def classify_document(text: str) -> str:
         return top_label
 
 
+def normalize_label(reply: str) -> str:
+    # The model answers "Invoice", "Purchase Order." or "purchase orders", the pipeline compares
+    # against the lowercase candidate labels
+    reply = " ".join(reply.lower().strip(" \t\n.\"'`*").split())
+    if reply in candidate_labels:
+        return reply
+    matches = [label for label in candidate_labels if label in reply]
+    return max(matches, key=len) if matches else OTHER_LABEL
+
+
 def anthropic_fallback_classification(text: str) -> str:
     if not ANTHROPIC_API_KEY:
         return "No API key found"
@@ -57,35 +137,21 @@ def anthropic_fallback_classification(text: str) -> str:
         f"You are a top-tier classification expert. The possible document types are: {categories_str}.\n"
         f"Classify the document content below into one of these categories based on its content.\n"
         f"Respond with ONLY the document type label. No explanation, no extra text — just one or two words.\n"
-        f"If the document doesn't fit the categories, return the best-guess type (still one or two words max)."
+        f"If the document doesn't fit the categories, respond with: {OTHER_LABEL}."
     )
 
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json",
-    }
-
-    data = {
-        "model": "claude-3-opus-20240229",
-        "max_tokens": 100,
-        "temperature": 0.2,
-        "system": system_prompt,
-        "messages": [
-            {"role": "user", "content": text}
-        ]
-    }
-
     try:
-        response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
+        result = anthropic_client.messages(
+            system=system_prompt,
+            messages=[{"role": "user", "content": text}],
+            max_tokens=100,
+            temperature=0.2,
+        )
 
         message = result.get("content", [])
         if message and isinstance(message, list) and "text" in message[0]:
-            classification = message[0]["text"].strip()
-            print("[Anthropic] Response:", classification)
-            return classification
+            print("[Anthropic] Response:", message[0]["text"])
+            return normalize_label(message[0]["text"])
         else:
             print("[Anthropic] Unexpected response format:", result)
             return "Unknown"
@@ -0,0 +1,69 @@
+'''Inference backends for the zero-shot classifier, picked per deployment with CLASSIFIER_BACKEND:
+
+pytorch   - the full precision NLI model (default, same as before)
+quantized - the same model with its Linear layers dynamically quantized to int8, smaller and faster on CPU
+onnx      - the model exported to ONNX and run with ONNX Runtime (needs `pip install optimum[onnxruntime]`),
+            CLASSIFIER_ONNX_PATH can point to an already exported (or quantized) model directory
+llm       - no local model: every document goes to the Anthropic classification that the other backends only
+            use below CONFIDENCE_THRESHOLD. No transformers/torch needed and nothing to load, but one LLM call
+            per upload (small deployments, or offline benchmarks against a fake API with --classifier-backend llm)
+
+The model backends return a transformers zero-shot-classification pipeline, so classify_document and
+CONFIDENCE_THRESHOLD work the same with any of them. benchmarks/classifier_compare.py compares
+accuracy and latency of the backends on a labeled sample set.'''
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "facebook/bart-large-mnli")  #the zero-shot pipeline's default model
+CLASSIFIER_ONNX_PATH = os.getenv("CLASSIFIER_ONNX_PATH")
+
+
+def load_pytorch(model_name: str):
+    from transformers import pipeline
+    return pipeline("zero-shot-classification", model=model_name)
+
+
+def load_quantized(model_name: str):
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+def load_onnx(model_name: str):
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as e:
+        raise RuntimeError("CLASSIFIER_BACKEND=onnx needs optimum with onnxruntime: pip install optimum[onnxruntime]") from e
+    from transformers import AutoTokenizer, pipeline
+
+    if CLASSIFIER_ONNX_PATH:
+        model = ORTModelForSequenceClassification.from_pretrained(CLASSIFIER_ONNX_PATH)
+        tokenizer = AutoTokenizer.from_pretrained(CLASSIFIER_ONNX_PATH)
+    else:
+        # Exports on the fly, save it once and set CLASSIFIER_ONNX_PATH to skip this on startup
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return pipeline("zero-shot-classification", model=model, tokenizer=tokenizer)
+
+
+BACKENDS = {
+    "pytorch": load_pytorch,
+    "quantized": load_quantized,
+    "onnx": load_onnx,
+}
+LLM_BACKEND = "llm"  #classify_document skips the pipeline altogether, there is nothing to load
+
+
+def load_zero_shot_pipeline(backend: str, model_name: str = CLASSIFIER_MODEL):
+    if backend == LLM_BACKEND:
+        raise ValueError(f"CLASSIFIER_BACKEND '{LLM_BACKEND}' has no zero-shot pipeline")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown CLASSIFIER_BACKEND '{backend}', expected one of {', '.join([*BACKENDS, LLM_BACKEND])}")
+    return BACKENDS[backend](model_name)
@@ -0,0 +1,190 @@
+'''Packs the passages found by search_documents into the answer prompt under a token budget.
+
+- Tokens are estimated locally (count_tokens), with no tokenizer dependency or extra API call. Digits and
+  punctuation count as separate tokens, so invoice-like text is estimated on the high side and the
+  budget is rarely overrun. The exact input tokens come back with the API usage and are reported next to it.
+- Passages are ranked by score across all documents, the document score breaks ties.
+- Chunks overlap (CHUNK_OVERLAP_CHARS), so passages of the same document that overlap on their character
+  offsets are merged into one span: the shared text is sent, and paid for, once.
+- Passages are added best first while they fit ANSWER_CONTEXT_MAX_TOKENS, the ones that don't are dropped.
+  Every packed span gets a source tag ([S1], [S2]...) the model is asked to cite.'''
+import os
+import re
+
+from dotenv import load_dotenv
+
+from app.metrics import Histogram, registry
+
+load_dotenv()
+
+ANSWER_CONTEXT_MAX_TOKENS = int(os.getenv("ANSWER_CONTEXT_MAX_TOKENS", "3000"))  #passage text + source tags
+
+#a run of letters, up to 3 digits, or one symbol; roughly how BPE tokenizers split invoice-like text
+_TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_")
+
+_prompt_tokens = Histogram("answer_prompt_tokens", "Input tokens of one answer prompt (API count when known)",
+                           [250, 500, 1000, 2000, 3000, 4000, 8000, 16000, 32000])
+_passages = {outcome: registry.counter("answer_context_passages_total", "Search passages by packing outcome",
+                                       outcome=outcome)
+             for outcome in ("packed", "merged", "duplicate", "dropped")}
+
+
+def count_tokens(text: str) -> int:
+    # Long words are several tokens, one per 8 letters past the first is close enough for English text
+    return sum(1 + len(piece) // 8 for piece in _TOKEN_PIECES.findall(text))
+
+
+def format_pages(span: dict) -> str:
+    if span["page_start"] is None:
+        return ""
+    if span["page_start"] == span["page_end"]:
+        return f" (page {span['page_start']})"
+    return f" (pages {span['page_start']}-{span['page_end']})"
+
+
+def _merged_text(pieces: list) -> str:
+    # pieces are (start, end, text) that overlap or touch, the result is the text of their union
+    parts, covered = [], None
+    for start, end, text in sorted(pieces):
+        if covered is None:
+            parts.append(text)
+            covered = end
+        elif end > covered:
+            parts.append(text[covered - start:])
+            covered = end
+    return "".join(parts)
+
+
+def _span_tokens(document_name: str, span: dict) -> int:
+    # The tag line is part of the cost, "[S00]" stands for any tag number
+    header = f"[S00] Document: {document_name}{format_pages(span)}\n"
+    return count_tokens(header) + count_tokens(span["text"])
+
+
+def _truncate(span: dict, document_name: str, budget: int):
+    # Only for a best passage that alone exceeds the budget, so the prompt is never empty
+    text = span["text"]
+    while text and _span_tokens(document_name, {**span, "text": text}) > budget:
+        text = text[:int(len(text) * 0.9)]
+    span["text"] = text
+    span["end"] = span["start"] + len(text)
+    span["pieces"] = [(span["start"], span["end"], text)]
+    span["tokens"] = _span_tokens(document_name, span)
+
+
+def pack_passages(search_results: list, budget: int = None):
+    """
+    Returns (spans, usage): the passages that fit the token budget, merged where they overlap,
+    and counters of what happened to every passage.
+    Each span: {"document_name", "start", "end", "page_start", "page_end", "score", "text", "tokens", "pieces"}.
+    """
+    budget = ANSWER_CONTEXT_MAX_TOKENS if budget is None else budget
+    ranked = sorted(
+        ((passage, result) for result in search_results for passage in result["passages"]),
+        key=lambda item: (-item[0]["score"], -item[1]["score"], item[1]["document_name"], item[0]["start"]),
+    )
+
+    spans = {}  #document_name -> its packed spans
+    used = 0
+    usage = {"passages_available": len(ranked), "passages_packed": 0, "passages_merged": 0,
+             "passages_duplicate": 0, "passages_dropped": 0, "truncated": False}
+    for passage, result in ranked:
+        document_name = result["document_name"]
+        document_spans = spans.setdefault(document_name, [])
+        touching = [span for span in document_spans
+                    if passage["start"] <= span["end"] and span["start"] <= passage["end"]]
+        if any(span["start"] <= passage["start"] and passage["end"] <= span["end"] for span in touching):
+            usage["passages_duplicate"] += 1  #already sent as part of a better passage
+            continue
+
+        pieces = [(passage["start"], passage["end"], passage["text"])] + [piece for span in touching
+                                                                          for piece in span["pieces"]]
+        page_starts = [p for p in [passage["page_start"]] + [span["page_start"] for span in touching] if p is not None]
+        page_ends = [p for p in [passage["page_end"]] + [span["page_end"] for span in touching] if p is not None]
+        span = {
+            "document_name": document_name,
+            "start": min(piece[0] for piece in pieces),
+            "end": max(piece[1] for piece in pieces),
+            "page_start": min(page_starts) if page_starts else None,
+            "page_end": max(page_ends) if page_ends else None,
+            "score": max([passage["score"]] + [span["score"] for span in touching]),
+            "doc_score": result["score"],
+            "text": _merged_text(pieces),
+            "pieces": pieces,
+        }
+        span["tokens"] = _span_tokens(document_name, span)
+        cost = span["tokens"] - sum(old["tokens"] for old in touching)
+
+        if used + cost > budget:
+            if used == 0 and not touching:
+                _truncate(span, document_name, budget)
+                cost = span["tokens"]
+            if not span["text"] or used + cost > budget:
+                usage["passages_dropped"] += 1
+                continue
+
+        usage["truncated"] = usage["truncated"] or span["end"] < passage["end"]
+        for old in touching:
+            document_spans.remove(old)
+        document_spans.append(span)
+        used += cost
+        usage["passages_merged" if touching else "passages_packed"] += 1
+
+    usage["context_tokens"] = used
+    usage["budget_tokens"] = budget
+    packed = [span for document_spans in spans.values() for span in document_spans]
+    return packed, usage
+
+
+def build_answer_context(query: str, search_results: list, budget: int = None) -> dict:
+    """
+    Builds the answer prompt from the search results within the token budget.
+    Returns {"prompt", "sources", "usage"}: sources are the packed spans with their tags,
+    usage the packing counters and the estimated prompt tokens.
+    """
+    spans, usage = pack_passages(search_results, budget)
+
+    # Documents in order of their best span, spans in reading order, tags numbered as they appear
+    best = {}
+    for span in spans:
+        best[span["document_name"]] = max(best.get(span["document_name"], (0, 0)), (span["score"], span["doc_score"]))
+    spans.sort(key=lambda span: (-best[span["document_name"]][0], -best[span["document_name"]][1],
+                                 span["document_name"], span["start"]))
+
+    sources, blocks = [], []
+    for number, span in enumerate(spans, 1):
+        tag = f"S{number}"
+        blocks.append(f"[{tag}] Document: {span['document_name']}{format_pages(span)}\n"
+                      f"{span['text']}")
+        sources.append({
+            "tag": tag,
+            "document_name": span["document_name"],
+            "page_start": span["page_start"],
+            "page_end": span["page_end"],
+            "start": span["start"],
+            "end": span["end"],
+            "score": span["score"],
+            "tokens": span["tokens"],
+        })
+
+    context = "\n\n".join(blocks)
+    prompt = (f"Answer the following question based on the sources below. Cite the sources you use with "
+              f"their tags, like [S1].\n\n{context}\n\nQuestion: {query}\nAnswer:")
+    usage["prompt_tokens_estimated"] = count_tokens(prompt)
+
+    for outcome in ("packed", "merged", "duplicate", "dropped"):
+        _passages[outcome].inc(usage[f"passages_{outcome}"])
+    return {"prompt": prompt, "sources": sources, "usage": usage}
+
+
+def record_prompt_tokens(usage: dict, api_usage: dict = None) -> dict:
+    """
+    Adds the API's token counts (when the call returned them) to the context usage and observes
+    the prompt size. Returns the usage reported to the client.
+    """
+    usage = dict(usage)
+    if api_usage:
+        usage["prompt_tokens"] = api_usage.get("input_tokens")
+        usage["output_tokens"] = api_usage.get("output_tokens")
+    _prompt_tokens.observe(usage.get("prompt_tokens") or usage["prompt_tokens_estimated"])
+    return usage
@@ -4,12 +4,16 @@ better read speed, strong typing, and reduces edge case handling in extraction,
 Could implement union schema for flexibility if required
 
 Would use Pydantic model instead of raw dict parsing'''
-import psycopg2
+import json
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 import os
 from datetime import datetime
 import time
-from urllib.parse import urlparse
+import threading
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.models import engine, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT
+from app.metrics import VERBOSE, timed, record_error
 
 
 load_dotenv()
@@ -20,6 +24,8 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")'''
 DATABASE_URL = os.getenv("DATABASE_URL")
+BULK_BATCH_SIZE = int(os.getenv("DB_BULK_BATCH_SIZE", "500"))      #rows per micro-batch flush
+BULK_FLUSH_SECONDS = float(os.getenv("DB_BULK_FLUSH_SECONDS", "2"))  #max age of the oldest pending row
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
@@ -40,27 +46,84 @@ AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
             time.sleep(10)  # wait for 5 seconds before retrying
     return None'''
 
+_pool_stats = {
+    "acquired": 0,
+    "timeouts": 0,
+    "errors": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+_pool_stats_lock = threading.Lock()
+
+
 def connect_db():
-    retries = 5
-    for i in range(retries):
-        try:
-            # Parsing the DATABASE_URL and establishing the connection
-            result = urlparse(DATABASE_URL)
-            print(f"Connecting to DB at {result.hostname}:{result.port} with database {result.path[1:]}")
-            conn = psycopg2.connect(
-                host=result.hostname,
-                port=result.port,
-                database=result.path[1:], 
-                user=result.username,
-                password=result.password
-            )
-            return conn
-        except Exception as e:
-            print(f"Error connecting to PostgreSQL: {e}")
-            time.sleep(3)  
-    return None
+    # Borrows a connection from the shared pool in models.py, conn.close() hands it back instead of disconnecting.
+    # Waits at most DB_POOL_TIMEOUT for a free connection instead of sleeping and retrying inside the request.
+    started = time.perf_counter()
+    try:
+        conn = engine.raw_connection()
+    except PoolTimeoutError:
+        with _pool_stats_lock:
+            _pool_stats["timeouts"] += 1
+        print(f"Error: no free DB connection after {DB_POOL_TIMEOUT}s, pool is exhausted")
+        return None
+    except Exception as e:
+        with _pool_stats_lock:
+            _pool_stats["errors"] += 1
+        print(f"Error connecting to PostgreSQL: {e}")
+        return None
+
+    waited = time.perf_counter() - started
+    with _pool_stats_lock:
+        _pool_stats["acquired"] += 1
+        _pool_stats["wait_seconds_total"] += waited
+        _pool_stats["wait_seconds_max"] = max(_pool_stats["wait_seconds_max"], waited)
+    return conn
+
+
+def warm_pool():
+    # Opens the minimum number of connections up front so the first requests don't pay for connection setup
+    conns = [conn for conn in (connect_db() for _ in range(DB_POOL_MIN_SIZE)) if conn is not None]
+    for conn in conns:
+        conn.close()
+    print(f"DB pool warmed with {len(conns)} connections")
+
+
+def check_database() -> dict:
+    # Readiness check: borrow a pooled connection and run a trivial query
+    conn = connect_db()
+    if conn is None:
+        return {"ready": False, "error": "Unable to connect to the database"}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        return {"ready": True}
+    except Exception as e:
+        return {"ready": False, "error": str(e)}
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_pool_stats():
+    pool = engine.pool
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    checked_out = pool.checkedout()
+    stats.update({
+        "pool_size": pool.size(),
+        "max_size": DB_POOL_MAX_SIZE,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "utilization": round(checked_out / DB_POOL_MAX_SIZE, 4) if DB_POOL_MAX_SIZE else 0.0,
+        "wait_seconds_avg": round(stats["wait_seconds_total"] / stats["acquired"], 6) if stats["acquired"] else 0.0,
+    })
+    return stats
 
 #insert data into the invoices table
+@timed("db_insert")
 def insert_invoice_data(data: dict):
     conn = connect_db()
     if conn is None:
@@ -77,13 +140,14 @@ def insert_invoice_data(data: dict):
         total_amount = data.get("total_amount")  
         vendor_name = data.get("vendor_name")  
 
-        print("Data to be inserted into invoices:")
-        print(f"Email: {user_email}")
-        print(f"Document Name: {document_name}")
-        print(f"Invoice Number: {invoice_number}")
-        print(f"Invoice Date: {invoice_date}")
-        print(f"Total Amount: {total_amount}")
-        print(f"Vendor Name: {vendor_name}")
+        if VERBOSE:
+            print("Data to be inserted into invoices:")
+            print(f"Email: {user_email}")
+            print(f"Document Name: {document_name}")
+            print(f"Invoice Number: {invoice_number}")
+            print(f"Invoice Date: {invoice_date}")
+            print(f"Total Amount: {total_amount}")
+            print(f"Vendor Name: {vendor_name}")
 
         invoice_date = None if invoice_date == "None" or invoice_date == "" else invoice_date
         total_amount = None if total_amount == "None" or total_amount == "" else total_amount
@@ -95,9 +159,10 @@ def insert_invoice_data(data: dict):
         """, (user_email, document_name, invoice_number, invoice_date, total_amount, vendor_name, datetime.now()))
 
         conn.commit()
-        print(f" All the data inserted: ", user_email, document_name, invoice_number, invoice_date, total_amount, vendor_name)
+        print(f"Invoice data inserted for {user_email}")
 
     except Exception as e:
+        record_error("db_insert")
         # More detailed debugging: log the error
         print(f"Error inserting invoice data: {e}")
         print(f"Full traceback: {e.__traceback__}")
@@ -114,6 +179,7 @@ def insert_invoice_data(data: dict):
         cursor.close()
         conn.close()
 
+@timed("db_insert")
 def insert_purchase_order_data(data: dict):
     conn = connect_db()
     if conn is None:
@@ -129,13 +195,14 @@ def insert_purchase_order_data(data: dict):
         total_amount = data.get("total_amount")  
         supplier_name = data.get("supplier_name") 
 
-        print("Data to be inserted into purchase_orders:")
-        print(f"Email: {user_email}")
-        print(f"Document Name: {document_name}")
-        print(f"Purchase Order Number: {purchase_order_number}")
-        print(f"Order Date: {order_date}")
-        print(f"Total Amount: {total_amount}")
-        print(f"Supplier Name: {supplier_name}")
+        if VERBOSE:
+            print("Data to be inserted into purchase_orders:")
+            print(f"Email: {user_email}")
+            print(f"Document Name: {document_name}")
+            print(f"Purchase Order Number: {purchase_order_number}")
+            print(f"Order Date: {order_date}")
+            print(f"Total Amount: {total_amount}")
+            print(f"Supplier Name: {supplier_name}")
 
         order_date = None if order_date == "None" or order_date == "" else order_date
         total_amount = None if total_amount == "None" or total_amount == "" else total_amount
@@ -149,6 +216,7 @@ def insert_purchase_order_data(data: dict):
         print(f" Purchase order data inserted for {user_email}")
 
     except Exception as e:
+        record_error("db_insert")
         #detailed Debugging
         print(f" Error inserting purchase order data: {e}")
         print(f"Full traceback: {e.__traceback__}")
@@ -165,6 +233,157 @@ def insert_purchase_order_data(data: dict):
         conn.close()
 
 
+# Bulk inserts: one connection, one transaction and one execute_values round trip per batch
+INVOICE_COLUMNS = ("user_email", "document_name", "invoice_number", "date", "total_amount", "vendor_name", "created_at")
+PURCHASE_ORDER_COLUMNS = ("user_email", "document_name", "purchase_order_number", "order_date", "total_amount", "supplier_name", "created_at")
+
+
+def _empty_to_none(value):
+    return None if value == "None" or value == "" else value
+
+
+def _invoice_row(data: dict):
+    return (
+        data.get("email"),
+        data.get("document_name"),
+        data.get("invoice_number"),
+        _empty_to_none(data.get("invoice_date")),
+        _empty_to_none(data.get("total_amount")),
+        data.get("vendor_name"),
+        datetime.now(),
+    )
+
+
+def _purchase_order_row(data: dict):
+    return (
+        data.get("email"),
+        data.get("document_name"),
+        data.get("purchase_order_number"),
+        _empty_to_none(data.get("order_date")),
+        _empty_to_none(data.get("total_amount")),
+        data.get("supplier_name"),
+        datetime.now(),
+    )
+
+
+@timed("db_insert")
+def _insert_bulk(table: str, columns: tuple, rows: list, records: list) -> list:
+    """
+    Inserts all rows in a single transaction and returns one result per record:
+    {"index", "document_name", "ok", "error"}.
+    If the batch fails, it is retried row by row inside the same transaction with a savepoint per row,
+    so only the bad records are rejected and their errors are reported.
+    """
+    def result(i, error=None):
+        return {"index": i, "document_name": records[i].get("document_name"), "ok": error is None, "error": error}
+
+    if not rows:
+        return []
+
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return [result(i, "Unable to connect to the database") for i in range(len(rows))]
+    cursor = conn.cursor()
+
+    column_list = ", ".join(columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    try:
+        try:
+            execute_values(cursor, f"INSERT INTO {table} ({column_list}) VALUES %s", rows, page_size=BULK_BATCH_SIZE)
+            conn.commit()
+            print(f"Bulk inserted {len(rows)} rows into {table}")
+            return [result(i) for i in range(len(rows))]
+        except Exception as e:
+            conn.rollback()
+            print(f"Bulk insert into {table} failed ({e}), retrying row by row to find the bad records")
+
+        results = []
+        for i, row in enumerate(rows):
+            cursor.execute("SAVEPOINT bulk_row")
+            try:
+                cursor.execute(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", row)
+                cursor.execute("RELEASE SAVEPOINT bulk_row")
+                results.append(result(i))
+            except Exception as row_error:
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_row")
+                results.append(result(i, str(row_error).strip()))
+        conn.commit()
+        print(f"Inserted {sum(r['ok'] for r in results)} of {len(rows)} rows into {table}")
+        return results
+
+    except Exception as e:
+        record_error("db_insert")
+        conn.rollback()
+        print(f"Error inserting into {table}: {e}")
+        return [result(i, str(e)) for i in range(len(rows))]
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def insert_invoices_bulk(records: list) -> list:
+    #records are dicts in the same shape insert_invoice_data takes
+    return _insert_bulk("invoices", INVOICE_COLUMNS, [_invoice_row(r) for r in records], records)
+
+
+def insert_purchase_orders_bulk(records: list) -> list:
+    #records are dicts in the same shape insert_purchase_order_data takes
+    return _insert_bulk("purchase_orders", PURCHASE_ORDER_COLUMNS, [_purchase_order_row(r) for r in records], records)
+
+
+class BatchWriter:
+    """
+    Collects extracted records during ingestion and writes them in micro-batches,
+    once BULK_BATCH_SIZE rows are pending or the oldest pending row is BULK_FLUSH_SECONDS old
+    (a timer flushes rows nothing else is added after). Call flush() when the ingestion run is done.
+    Per-record results pile up in .results.
+    """
+    def __init__(self, max_batch: int = BULK_BATCH_SIZE, max_wait: float = BULK_FLUSH_SECONDS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.results = []
+        self._pending = {"invoice": [], "purchase order": []}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, document_type: str, record: dict):
+        with self._lock:
+            self._pending[document_type].append(record)
+            if self._timer is None:  #first pending row, it is flushed max_wait from now at the latest
+                self._timer = threading.Timer(self.max_wait, self._flush_expired)
+                self._timer.daemon = True
+                self._timer.start()
+            due = sum(len(records) for records in self._pending.values()) >= self.max_batch
+        if due:
+            self.flush()
+
+    def _flush_expired(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing pending rows: {e}")
+
+    def flush(self) -> list:
+        with self._lock:
+            pending = self._pending
+            self._pending = {"invoice": [], "purchase order": []}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        results = []
+        if pending["invoice"]:
+            results += insert_invoices_bulk(pending["invoice"])
+        if pending["purchase order"]:
+            results += insert_purchase_orders_bulk(pending["purchase order"])
+        with self._lock:
+            self.results += results
+        return results
+
+
+@timed("db_query")
 def get_invoice_by_document(document_name: str, email: str):
     
     #Fetch invoice details by document name (or any identifier) and user email.
@@ -184,7 +403,8 @@ def get_invoice_by_document(document_name: str, email: str):
         """, (document_name, email))
 
         invoice = cursor.fetchone()
-        print(f"Fetched invoice: {invoice}")
+        if VERBOSE:
+            print(f"Fetched invoice: {invoice}")
 
         if not invoice:
             return None
@@ -200,6 +420,7 @@ def get_invoice_by_document(document_name: str, email: str):
         return invoice_data
 
     except Exception as e:
+        record_error("db_query")
         print(f"Error fetching invoice data: {e}")
         return None
 
@@ -209,29 +430,37 @@ def get_invoice_by_document(document_name: str, email: str):
 
 
 # Fetch invoices by email
-def get_invoices_by_email(email: str):
+@timed("db_query")
+def get_invoices_by_email(email: str, limit: int = None, after_id: int = None):
     
-    #Fetch all invoices associated with the user's email.
+    #Fetch the user's invoices in id order. limit/after_id page through them (keyset pagination:
+    #"id > last id seen" walks the (user_email, id) index instead of skipping rows like OFFSET)
     
     conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return []
     cursor = conn.cursor()
 
     try:
         cursor.execute("""
-            SELECT document_name, date, total_amount, vendor_name 
+            SELECT id, document_name, date, total_amount, vendor_name 
             FROM invoices 
-            WHERE user_email = %s
-        """, (email,))
+            WHERE user_email = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (email, after_id or 0, limit))
         
         invoices = cursor.fetchall()
         #print(f"Fetched invoices: {invoices}") 
         invoice_data = []
         for invoice in invoices:
             invoice_data.append({
-                "invoice_name": invoice[0],  
-                "invoice_date": invoice[1],  
-                "total_amount": invoice[2],  
-                "vendor_name": invoice[3]    
+                "id": invoice[0],
+                "invoice_name": invoice[1],  
+                "invoice_date": invoice[2],  
+                "total_amount": invoice[3],  
+                "vendor_name": invoice[4]    
             })
 
         #print(f"Invoice data: {invoice_data}")
@@ -239,6 +468,7 @@ def get_invoices_by_email(email: str):
         return invoice_data
 
     except Exception as e:
+        record_error("db_query")
         print(f"Error fetching invoices: {e}")
         return []
 
@@ -247,39 +477,403 @@ def get_invoices_by_email(email: str):
         conn.close()
 
 # Fetch purchase orders by email
-def get_purchase_orders_by_email(email: str):
+@timed("db_query")
+def get_purchase_orders_by_email(email: str, limit: int = None, after_id: int = None):
     
-    #Fetch all purchase orders associated with the user's email.
+    #Fetch the user's purchase orders in id order, paged like get_invoices_by_email
     
     conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return []
     cursor = conn.cursor()
 
     try:
         cursor.execute("""
-            SELECT document_name, order_date, total_amount, supplier_name 
+            SELECT id, document_name, order_date, total_amount, supplier_name 
             FROM purchase_orders 
-            WHERE user_email = %s
-        """, (email,))
+            WHERE user_email = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (email, after_id or 0, limit))
         
         purchase_orders = cursor.fetchall()
-        print(f"Fetched purchase orders: {purchase_orders}")
+        if VERBOSE:
+            print(f"Fetched purchase orders: {purchase_orders}")
         purchase_order_data = []
         for order in purchase_orders:
             purchase_order_data.append({
-                "purchase_order_name": order[0],
-                "order_date": order[1],
-                "total_amount": order[2],
-                "supplier_name": order[3]
+                "id": order[0],
+                "purchase_order_name": order[1],
+                "order_date": order[2],
+                "total_amount": order[3],
+                "supplier_name": order[4]
             })
 
-        print(f"Purchase order data: {purchase_order_data}")
+        if VERBOSE:
+            print(f"Purchase order data: {purchase_order_data}")
 
         return purchase_order_data
 
     except Exception as e:
+        record_error("db_query")
         print(f"Error fetching purchase orders: {e}")
         return []
 
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+# Content-hash deduplication
+@timed("db_query")
+def get_content_record(content_hash: str):
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return None
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            SELECT doc_s3_key, text_s3_key, document_type, extracted_data, page_starts
+            FROM content_records
+            WHERE content_hash = %s
+        """, (content_hash,))
+        record = cursor.fetchone()
+        if not record:
+            return None
+
+        return {
+            "content_hash": content_hash,
+            "doc_s3_key": record[0],
+            "text_s3_key": record[1],
+            "document_type": record[2],
+            "extracted_data": json.loads(record[3]) if record[3] else {},
+            "page_starts": json.loads(record[4]) if record[4] else None
+        }
+
+    except Exception as e:
+        record_error("db_query")
+        print(f"Error fetching content record: {e}")
+        return None
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db_insert")
+def save_content_record(content_hash: str, doc_s3_key: str, text_s3_key: str, document_type: str,
+                        extracted_data: dict, page_starts: list):
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return
+    cursor = conn.cursor()
+
+    try:
+        # Only saved when the stored record (if any) couldn't be reused, so it is replaced.
+        # Identical uploads racing each other write the same content keys, the last one wins
+        cursor.execute("""
+            INSERT INTO content_records (content_hash, doc_s3_key, text_s3_key, document_type, extracted_data, page_starts, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (content_hash) DO UPDATE SET
+                doc_s3_key = EXCLUDED.doc_s3_key,
+                text_s3_key = EXCLUDED.text_s3_key,
+                document_type = EXCLUDED.document_type,
+                extracted_data = EXCLUDED.extracted_data,
+                page_starts = EXCLUDED.page_starts,
+                created_at = EXCLUDED.created_at
+        """, (content_hash, doc_s3_key, text_s3_key, document_type,
+              json.dumps(extracted_data, default=str), json.dumps(page_starts), datetime.now()))
+        conn.commit()
+
+    except Exception as e:
+        record_error("db_insert")
+        print(f"Error saving content record: {e}")
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db_insert")
+def add_content_association(content_hash: str, email: str, document_name: str) -> bool:
+    #Returns True if this user/document pair is new for the content, False if it was already recorded
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return True
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            INSERT INTO content_associations (content_hash, user_email, document_name, created_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (content_hash, user_email, document_name) DO NOTHING
+            RETURNING id
+        """, (content_hash, email, document_name, datetime.now()))
+        inserted = cursor.fetchone() is not None
+        conn.commit()
+        return inserted
+
+    except Exception as e:
+        record_error("db_insert")
+        print(f"Error saving content association: {e}")
+        return True
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# Structured questions (query_router.py). Table and column names come from this map, never from the query
+STRUCTURED_TABLES = {
+    "invoices": {"date": "date", "party": "vendor_name", "number": "invoice_number"},
+    "purchase_orders": {"date": "order_date", "party": "supplier_name", "number": "purchase_order_number"},
+}
+#total_amount is free text from the LLM ("$1,234.50"), only values that clean up to a number are summed
+_AMOUNT_SQL = """CASE WHEN regexp_replace(total_amount, '[^0-9.-]', '', 'g') ~ '^-?[0-9]+(\\.[0-9]+)?$'
+                 THEN regexp_replace(total_amount, '[^0-9.-]', '', 'g')::numeric END"""
+
+
+@timed("db_query")
+def query_structured(table: str, aggregate: str, email: str, number: str = None, party: str = None,
+                     date_from=None, date_to=None, limit: int = 20):
+    """
+    aggregate "count" / "sum" return {"count", "total", "with_amount"},
+    "lookup" / "list" return a list of {"document_name", "number", "date", "party", "total_amount"}.
+    date_to is exclusive. Returns None on errors.
+    """
+    columns = STRUCTURED_TABLES[table]
+    conditions = ["user_email = %s"]
+    params = [email]
+    if number:
+        conditions.append(f"lower({columns['number']}) = lower(%s)")
+        params.append(number)
+    if party:
+        conditions.append(f"{columns['party']} ILIKE %s")
+        params.append(f"%{party}%")
+    if date_from:
+        conditions.append(f"{columns['date']} >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{columns['date']} < %s")
+        params.append(date_to)
+    where = " AND ".join(conditions)
+
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return None
+    cursor = conn.cursor()
+
+    try:
+        if aggregate in ("count", "sum"):
+            cursor.execute(f"""
+                SELECT COUNT(*), COALESCE(SUM({_AMOUNT_SQL}), 0), COUNT({_AMOUNT_SQL})
+                FROM {table}
+                WHERE {where}
+            """, params)
+            count, total, with_amount = cursor.fetchone()
+            return {"count": count, "total": float(total), "with_amount": with_amount}
+
+        cursor.execute(f"""
+            SELECT document_name, {columns['number']}, {columns['date']}, {columns['party']}, total_amount
+            FROM {table}
+            WHERE {where}
+            ORDER BY {columns['date']} DESC NULLS LAST
+            LIMIT %s
+        """, params + [limit])
+        return [
+            {"document_name": row[0], "number": row[1], "date": row[2], "party": row[3], "total_amount": row[4]}
+            for row in cursor.fetchall()
+        ]
+
+    except Exception as e:
+        record_error("db_query")
+        print(f"Error running structured query on {table}: {e}")
+        return None
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# Document catalog (documents table), written on upload and backfilled by catalog_reconcile.py
+DOCUMENT_COLUMNS = ("doc_s3_key", "text_s3_key", "user_email", "document_name", "size_bytes",
+                    "content_hash", "document_type", "page_count", "uploaded_at")
+
+
+@timed("db_insert")
+def save_document(record: dict):
+    #Adds or replaces (re-upload under the same name) the catalog entry of one document
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return
+    cursor = conn.cursor()
+
+    try:
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in DOCUMENT_COLUMNS[1:])
+        cursor.execute(f"""
+            INSERT INTO documents ({", ".join(DOCUMENT_COLUMNS)})
+            VALUES ({", ".join(["%s"] * len(DOCUMENT_COLUMNS))})
+            ON CONFLICT (doc_s3_key) DO UPDATE SET {updates}
+        """, tuple(record.get(column) for column in DOCUMENT_COLUMNS))
+        conn.commit()
+
+    except Exception as e:
+        record_error("db_insert")
+        print(f"Error saving document {record.get('doc_s3_key')} to the catalog: {e}")
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db_insert")
+def save_documents_bulk(records: list) -> list:
+    #Inserts catalog entries that don't exist yet (entries written by uploads are never overwritten),
+    #returns the user_email of every new entry
+    if not records:
+        return []
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return []
+    cursor = conn.cursor()
+
+    try:
+        inserted = execute_values(cursor, f"""
+            INSERT INTO documents ({", ".join(DOCUMENT_COLUMNS)}) VALUES %s
+            ON CONFLICT (doc_s3_key) DO NOTHING
+            RETURNING user_email
+        """, [tuple(record.get(column) for column in DOCUMENT_COLUMNS) for record in records],
+            page_size=BULK_BATCH_SIZE, fetch=True)
+        conn.commit()
+        return [row[0] for row in inserted]
+
+    except Exception as e:
+        record_error("db_insert")
+        conn.rollback()
+        print(f"Error saving documents to the catalog: {e}")
+        return []
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def backfill_document_details() -> int:
+    #Fills hash, type and page count of catalog entries from the content tables of earlier ingestions
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return 0
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            UPDATE documents d
+            SET content_hash = a.content_hash,
+                document_type = r.document_type,
+                page_count = json_array_length(r.page_starts::json)
+            FROM content_associations a
+            JOIN content_records r ON r.content_hash = a.content_hash
+            WHERE d.content_hash IS NULL
+              AND a.user_email = d.user_email
+              AND a.document_name = d.document_name
+        """)
+        updated = cursor.rowcount
+        conn.commit()
+        return updated
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error backfilling document details: {e}")
+        return 0
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db_query")
+def list_documents(email: str):
+    #Catalog entries of the user ordered by key (same order as an S3 listing), None if the catalog can't be read
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return None
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute(f"""
+            SELECT {", ".join(DOCUMENT_COLUMNS)}
+            FROM documents
+            WHERE user_email = %s
+            ORDER BY doc_s3_key
+        """, (email,))
+        return [dict(zip(DOCUMENT_COLUMNS, row)) for row in cursor.fetchall()]
+
+    except Exception as e:
+        record_error("db_query")
+        print(f"Error listing documents: {e}")
+        return None
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@timed("db_query")
+def list_catalog_keys(email: str = None) -> set:
+    #Every doc_s3_key in the catalog (of one user if email is given), used to find entries whose object is gone
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return set()
+    cursor = conn.cursor()
+
+    try:
+        if email:
+            cursor.execute("SELECT doc_s3_key FROM documents WHERE user_email = %s", (email,))
+        else:
+            cursor.execute("SELECT doc_s3_key FROM documents")
+        return {row[0] for row in cursor.fetchall()}
+
+    except Exception as e:
+        record_error("db_query")
+        print(f"Error listing catalog keys: {e}")
+        return set()
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def delete_documents(doc_s3_keys: list) -> int:
+    if not doc_s3_keys:
+        return 0
+    conn = connect_db()
+    if conn is None:
+        print("Error: Unable to connect to the database")
+        return 0
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("DELETE FROM documents WHERE doc_s3_key = ANY(%s)", (list(doc_s3_keys),))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error deleting documents from the catalog: {e}")
+        return 0
+
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,87 @@
+'''Offloading of blocking work from the async endpoints.
+
+boto3, psycopg2 and requests block the calling thread, and PyMuPDF/rapidfuzz/transformers hold a core,
+so calling them straight from an `async def` handler stalls every other request of the worker. The
+handlers await them through these helpers instead, each kind of work with its own bounded thread pool
+(anyio capacity limiters), so a burst of slow uploads can only use the "ingest" threads and /documents
+always finds a free "io" thread:
+    run_io       short blocking calls: S3, postgres, redis (EXECUTOR_IO_THREADS)
+    run_llm      requests waiting on the Anthropic API (EXECUTOR_LLM_THREADS)
+    run_cpu      CPU-bound work in native code that releases the GIL: search scoring, PDF parsing
+                 (EXECUTOR_CPU_THREADS, defaults to the core count)
+    run_ingest   a whole upload pipeline, which itself waits on the stage pools of ingest.py
+                 (EXECUTOR_INGEST_THREADS)
+Sync endpoints and sync streaming generators already run on Starlette's own threadpool.
+CPU work that must leave the process (large PDFs) goes to the process pool in utils.py.
+
+Would move to async clients (aioboto3, asyncpg, httpx) once the rest of the code is async.'''
+import os
+import time
+
+import anyio
+from anyio import to_thread
+from dotenv import load_dotenv
+
+from app.metrics import Histogram
+
+load_dotenv()
+
+EXECUTOR_THREADS = {
+    "io": int(os.getenv("EXECUTOR_IO_THREADS", "32")),
+    "llm": int(os.getenv("EXECUTOR_LLM_THREADS", "16")),  #the Anthropic client caps concurrent calls on its own
+    "cpu": int(os.getenv("EXECUTOR_CPU_THREADS", str(os.cpu_count() or 1))),
+    "ingest": int(os.getenv("EXECUTOR_INGEST_THREADS", "8")),
+}
+
+_limiters = {}
+_queue_seconds = {
+    name: Histogram(f"executor_{name}_queue_seconds", "Time a call waited for a free thread",
+                    [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5])
+    for name in EXECUTOR_THREADS
+}
+
+
+def _limiter(name: str) -> anyio.CapacityLimiter:
+    # Created lazily: a limiter belongs to the event loop that first uses it
+    if name not in _limiters:
+        _limiters[name] = anyio.CapacityLimiter(EXECUTOR_THREADS[name])
+    return _limiters[name]
+
+
+async def _run(name: str, fn, *args, **kwargs):
+    queued = time.perf_counter()
+
+    def run():
+        _queue_seconds[name].observe(time.perf_counter() - queued)
+        return fn(*args, **kwargs)
+
+    return await to_thread.run_sync(run, limiter=_limiter(name))
+
+
+async def run_io(fn, *args, **kwargs):
+    return await _run("io", fn, *args, **kwargs)
+
+
+async def run_llm(fn, *args, **kwargs):
+    return await _run("llm", fn, *args, **kwargs)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    return await _run("cpu", fn, *args, **kwargs)
+
+
+async def run_ingest(fn, *args, **kwargs):
+    return await _run("ingest", fn, *args, **kwargs)
+
+
+def get_executor_stats() -> dict:
+    stats = {}
+    for name, threads in EXECUTOR_THREADS.items():
+        limiter = _limiters.get(name)
+        stats[name] = {
+            "threads": threads,
+            "busy": limiter.borrowed_tokens if limiter else 0,
+            "waiting": limiter.statistics().tasks_waiting if limiter else 0,
+            "queue_seconds": _queue_seconds[name].snapshot(),
+        }
+    return stats
@@ -0,0 +1,356 @@
+'''Per-user inverted index over the extracted texts, so search dosen't have to list and download
+every S3 text on every query.
+
+Each document is indexed once at upload time and appended as one JSON line to the user's log file under
+SEARCH_INDEX_DIR, so it survives restarts and an upload only writes its own document (not the whole index).
+A re-uploaded document is appended again and its newest line wins; the log is compacted once it holds
+more superseded lines than live ones. Postings map a token trigram to the lines that contain it,
+which lets fuzzy (typo tolerant) queries pick candidate documents and lines without touching S3.
+
+Loaded indexes are immutable snapshots: an upload builds a new UserIndex and swaps it in under the
+user's lock, so searches running on the old one never see it change. A snapshot's postings are a few
+segments, the upload's document becomes a new one and the newest segments are merged like an LSM tree,
+so an upload costs about the size of its document, not of the user's corpus.
+Other workers' appends are picked up by reading the log's new tail.
+
+Would move this to OpenSearch (or a postgres trigram index) when running multiple replicas,
+a local file per user is only safe while one worker writes to it at a time.'''
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from dotenv import load_dotenv
+from app.s3_utils import get_s3_documents, get_s3_file_content, EXTRACTED_TEXTS_FOLDER
+from app.chunker import chunk_text
+
+load_dotenv()
+
+INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "search_index")
+MIN_TRIGRAM_OVERLAP = float(os.getenv("SEARCH_MIN_TRIGRAM_OVERLAP", "0.3"))  #share of query trigrams a line must contain
+COMPACT_MIN_LINES = 16  #logs shorter than this are never compacted
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_lock = threading.Lock()  #guards _loaded and _user_locks, never held while reading or writing files
+_user_locks = {}          #email -> lock serializing that user's log writes and refreshes
+_loaded = {}              #email -> (inode, offset, lines, UserIndex): the snapshot and how much of the log it covers
+
+
+def tokenize(text: str):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(text: str):
+    # Trigrams are taken per token (padded with spaces) so word boundaries count as well
+    grams = set()
+    for token in tokenize(text):
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def document_record(doc_name: str, text: str, page_starts: list = None) -> dict:
+    """
+    The log entry of one document: its lines, passage chunks and its own postings {trigram: [line_no, ...]}.
+    Built outside any lock, this is where the indexing CPU time goes.
+    """
+    lines = text.split("\n")
+    postings = {}
+    for line_no, line in enumerate(lines):
+        for gram in trigrams(line):
+            postings.setdefault(gram, []).append(line_no)
+    return {"doc": doc_name, "lines": lines, "chunks": chunk_text(text, page_starts), "postings": postings}
+
+
+class UserIndex:
+    def __init__(self, email: str, docs: dict = None, segments: tuple = (), version: int = 0):
+        self.email = email
+        self.docs = docs or {}      #doc_name -> {"lines": [...], "chunks": [...], "version": version it was indexed at}
+        self.segments = segments    #(postings, versions): {trigram: {doc_name: [line_no, ...]}}, {doc_name: version}
+        self.version = version      #bumped on every change to the document set, part of the answer cache key
+
+    def _live(self, doc_name: str, versions: dict) -> bool:
+        # A re-uploaded document stays in older segments until they are merged, only its newest entry counts
+        doc = self.docs.get(doc_name)
+        return doc is not None and doc["version"] == versions[doc_name]
+
+    def with_documents(self, records: list) -> "UserIndex":
+        """
+        Returns a new index with the documents of records (document_record + "version") added in one new
+        segment, replacing documents of the same name. Nothing reachable from this index is modified.
+        """
+        docs = dict(self.docs)
+        postings, versions = {}, {}
+        version = self.version
+        for record in {record["doc"]: record for record in records}.values():  #the newest record of each name
+            doc_name = record["doc"]
+            docs[doc_name] = {"lines": record["lines"], "chunks": record["chunks"], "version": record["version"]}
+            versions[doc_name] = record["version"]
+            for gram, line_nos in record["postings"].items():
+                postings.setdefault(gram, {})[doc_name] = line_nos
+            version = max(version, record["version"])
+
+        index = UserIndex(self.email, docs, self.segments, version)
+        if versions:
+            index.segments = index._merged(list(self.segments) + [(postings, versions)])
+        return index
+
+    def _merged(self, segments: list) -> tuple:
+        # Merges the newest segments while the older one isn't bigger (a binary counter), so there are
+        # O(log n) segments and every document is copied O(log n) times in total. Dead entries are dropped
+        while len(segments) > 1 and len(segments[-2][1]) <= len(segments[-1][1]):
+            newer, older = segments.pop(), segments.pop()
+            postings, versions = {}, {}
+            for segment_postings, segment_versions in (older, newer):
+                live = {doc_name for doc_name in segment_versions if self._live(doc_name, segment_versions)}
+                versions.update((doc_name, segment_versions[doc_name]) for doc_name in live)
+                for gram, docs in segment_postings.items():
+                    live_docs = {doc_name: line_nos for doc_name, line_nos in docs.items() if doc_name in live}
+                    if live_docs:
+                        postings.setdefault(gram, {}).update(live_docs)
+            segments.append((postings, versions))
+        return tuple(segments)
+
+    def records(self) -> list:
+        """
+        The live documents as log records, rebuilt from the segments (no trigram recomputation).
+        """
+        postings = {doc_name: {} for doc_name in self.docs}
+        for segment_postings, versions in self.segments:
+            for gram, docs in segment_postings.items():
+                for doc_name, line_nos in docs.items():
+                    if self._live(doc_name, versions):
+                        postings[doc_name][gram] = line_nos
+        return [{"doc": doc_name, "lines": doc["lines"], "chunks": doc["chunks"], "postings": postings[doc_name],
+                 "version": doc["version"]} for doc_name, doc in self.docs.items()]
+
+    def candidates(self, query: str) -> dict:
+        """
+        Returns {doc_name: [line_no, ...]} for lines sharing enough trigrams with the query.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return {}
+        min_overlap = max(1, math.ceil(len(query_grams) * MIN_TRIGRAM_OVERLAP))
+
+        hits = Counter()
+        for postings, versions in self.segments:
+            for gram in query_grams:
+                for doc_name, line_nos in postings.get(gram, {}).items():
+                    if self._live(doc_name, versions):
+                        for line_no in line_nos:
+                            hits[(doc_name, line_no)] += 1
+
+        result = {}
+        for (doc_name, line_no), count in hits.items():
+            if count >= min_overlap:
+                result.setdefault(doc_name, []).append(line_no)
+        for line_nos in result.values():
+            line_nos.sort()
+        return result
+
+    def get_lines(self, doc_name: str, line_nos=None):
+        lines = self.docs[doc_name]["lines"]
+        if line_nos is None:
+            return lines
+        return [lines[i] for i in line_nos]
+
+    def get_text(self, doc_name: str) -> str:
+        return "\n".join(self.docs[doc_name]["lines"])
+
+    def get_chunks(self, doc_name: str):
+        return self.docs[doc_name]["chunks"]
+
+
+def _user_path(email: str) -> str:
+    # Hash the email so it is always a safe file name
+    digest = hashlib.sha1(email.lower().encode("utf-8")).hexdigest()
+    return os.path.join(INDEX_DIR, digest)
+
+
+def _user_lock(email: str) -> threading.Lock:
+    with _lock:
+        return _user_locks.setdefault(email, threading.Lock())
+
+
+def _publish(email: str, inode: int, offset: int, lines: int, index: UserIndex):
+    with _lock:
+        _loaded[email] = (inode, offset, lines, index)
+
+
+def _write_log(index: UserIndex):
+    """
+    Rewrites the user's log with one line per live document (backfill and compaction).
+    Caller holds the user's lock.
+    """
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = f"{_user_path(index.email)}.jsonl"
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in index.records():
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)  #atomic, readers never see a half written log
+    stat = os.stat(path)
+    _publish(index.email, stat.st_ino, stat.st_size, len(index.docs), index)
+
+
+def _migrate_legacy(email: str) -> bool:
+    # Indexes saved before the log format were one JSON file with the postings of every document.
+    # Caller holds the user's lock
+    legacy_path = f"{_user_path(email)}.json"
+    try:
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except OSError:
+        return False
+    docs = data.get("docs") or {}
+    postings = {doc_name: {} for doc_name in docs}
+    for gram, docs_for_gram in (data.get("postings") or {}).items():
+        for doc_name, line_nos in docs_for_gram.items():
+            postings[doc_name][gram] = line_nos
+    # Indexes saved before versioning start at their document count, the newest document gets the version
+    version = data.get("version", len(docs))
+    records = [{"doc": doc_name, "lines": doc["lines"], "postings": postings[doc_name], "version": version - len(docs) + n,
+                #saved before passages existed, chunked now (no page info)
+                "chunks": doc.get("chunks") or chunk_text("\n".join(doc["lines"]))}
+               for n, (doc_name, doc) in enumerate(docs.items(), 1)]
+    _write_log(UserIndex(email).with_documents(records))
+    os.remove(legacy_path)
+    return True
+
+
+def _refresh(email: str):
+    """
+    Brings the user's snapshot up to date with the log: reads only the lines appended since it was
+    loaded, or the whole log when it was replaced (compacted) or never loaded.
+    Returns (index, lines in the log) or (None, 0) if the user has no index. Caller holds the user's lock.
+    """
+    path = f"{_user_path(email)}.jsonl"
+    try:
+        f = open(path, "rb")
+    except OSError:
+        if not _migrate_legacy(email):
+            return None, 0
+        f = open(path, "rb")
+
+    with f:
+        inode = os.fstat(f.fileno()).st_ino
+        with _lock:
+            cached = _loaded.get(email)
+        if cached and cached[0] == inode:
+            _, offset, lines, index = cached
+            f.seek(offset)
+        else:
+            offset, lines, index = 0, 0, UserIndex(email)
+        data = f.read()
+
+    # A line without its newline is still being written (or was cut by a crash), it is read next time
+    complete = data[:data.rfind(b"\n") + 1]
+    records = [json.loads(line) for line in complete.splitlines() if line.strip()]
+    if records or not cached or cached[0] != inode:
+        index = index.with_documents(records)
+        lines += len(records)
+        _publish(email, inode, offset + len(complete), lines, index)
+    return index, lines
+
+
+def load_index(email: str):
+    """
+    Returns the user's current index snapshot, or None if it was never built.
+    Snapshots are kept in memory and only the log lines added since are read.
+    """
+    try:
+        stat = os.stat(f"{_user_path(email)}.jsonl")
+    except OSError:
+        stat = None
+    if stat is not None:
+        with _lock:
+            cached = _loaded.get(email)
+        if cached and cached[0] == stat.st_ino and cached[1] == stat.st_size:
+            return cached[3]
+
+    with _user_lock(email):
+        return _refresh(email)[0]
+
+
+def build_index_from_s3(email: str) -> UserIndex:
+    """
+    One time backfill for users whose documents were uploaded before the index existed.
+    """
+    records = []
+    for doc_name in get_s3_documents(email):
+        content = get_s3_file_content(f"{EXTRACTED_TEXTS_FOLDER}{doc_name}")
+        if content.strip():
+            records.append({**document_record(doc_name, content), "version": len(records) + 1})
+    index = UserIndex(email).with_documents(records)
+    print(f"[Index] Built index for {email} from S3 with {len(index.docs)} documents")
+    return index
+
+
+def get_or_build_index(email: str) -> UserIndex:
+    index = load_index(email)
+    if index is not None:
+        return index
+
+    # The backfill reads S3 without holding the lock, if another thread saved an index meanwhile that one wins
+    built = build_index_from_s3(email)
+    with _user_lock(email):
+        index = _refresh(email)[0]
+        if index is None:
+            _write_log(built)
+            index = built
+    return index
+
+
+def rebuild_index(email: str) -> UserIndex:
+    """
+    Rebuilds the user's index from their catalogued texts (catalog_reconcile, once it backfilled entries the
+    index was built without). Documents indexed meanwhile are kept, and versions continue from the old index
+    so answers cached for it are not reused.
+    """
+    built = build_index_from_s3(email)
+    with _user_lock(email):
+        current = _refresh(email)[0] or UserIndex(email)
+        records = [{**record, "version": current.version + record["version"]} for record in built.records()]
+        records += [record for record in current.records() if record["doc"] not in built.docs]
+        index = UserIndex(email).with_documents(sorted(records, key=lambda record: record["version"]))
+        _write_log(index)
+    return index
+
+
+def index_document(email: str, doc_name: str, text: str, page_starts: list = None):
+    """
+    Called from /upload_document/ once the extracted text is in S3.
+    doc_name is the extracted text file name, e.g. "{email}_{filename}.txt".
+    page_starts are the character offsets of each page, used to cite pages in passages.
+    """
+    record = document_record(doc_name, text, page_starts)
+    get_or_build_index(email)
+
+    with _user_lock(email):
+        index, lines = _refresh(email)
+        record["version"] = index.version + 1
+        index = index.with_documents([record])
+
+        if lines + 1 > max(COMPACT_MIN_LINES, 2 * len(index.docs)):
+            _write_log(index)
+        else:
+            path = f"{_user_path(email)}.jsonl"
+            with open(path, "ab") as f:
+                f.write((json.dumps(record) + "\n").encode("utf-8"))
+                offset = f.tell()
+            _publish(email, os.stat(path).st_ino, offset, lines + 1, index)
+    print(f"[Index] Indexed {doc_name} for {email} ({len(index.docs)} documents)")
+
+
+def get_index_version(email: str) -> int:
+    """
+    Version of the user's document set, changes whenever a document is indexed.
+    Read from the index log, so every worker sees uploads handled by the others.
+    """
+    return get_or_build_index(email).version
@@ -0,0 +1,291 @@
+'''Staged ingestion pipeline used by /upload_document/ (both the blocking and the async job mode).
+
+Every stage runs on its own bounded thread pool, so a slow stage (like the LLM extraction) can only
+tie up its own workers, and independent stages overlap:
+    upload original to S3  ||  PDF text extraction
+    upload extracted text  ||  classification
+then LLM extraction + DB insert once the document type is known.
+
+Uploads are deduplicated by the SHA-256 of the file: if the same bytes were ingested before
+(retries, or several users forwarding the same invoice), the stored text, document type and
+extracted fields are reused and only the new user/document association is recorded. The original and the
+text are remembered as copies under content/{sha256}, a user's own keys are overwritten by the next upload
+of the same name. Uploads with no text, a failed classification or an empty LLM extraction are not
+remembered, so the next one retries.
+
+The uploaded file is never read into memory as a whole: hashing, the S3 upload and text extraction each
+read the spooled file on their own (see uploads.py).
+
+A failed upload cancels or waits for every stage it started before the file is closed, and deletes the S3
+objects those stages wrote. Only uploads that got through every stage are indexed and catalogued.
+
+For production would move the stages onto a real queue (Celery/Temporal) with retries per stage.'''
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from dotenv import load_dotenv
+from app.utils import extract_pages_from_pdf, extract_data_based_on_type, store_extracted_data
+from app.classifier import classify_document, CLASSIFICATION_FAILURES
+from app.uploads import UploadSource
+from app.s3_utils import (upload_file_to_s3, copy_s3_object, copy_extracted_text, store_extracted_text,
+                          get_s3_file_content, delete_s3_objects, BUCKET_NAME, CONTENT_FOLDER)
+from app.database import get_content_record, save_content_record, add_content_association, save_document
+from app.index import index_document
+from app.chunker import page_offsets
+from app.text_encoding import sidecar_key
+
+load_dotenv()
+
+# Max concurrent work per stage, shared by every upload in this process
+STAGE_WORKERS = {
+    "s3": int(os.getenv("INGEST_S3_WORKERS", "8")),
+    "extract_text": int(os.getenv("INGEST_EXTRACT_WORKERS", "2")),
+    "classify": int(os.getenv("INGEST_CLASSIFY_WORKERS", "8")),  #threads only wait on the classifier batcher, keep >= its batch size
+    "extract_data": int(os.getenv("INGEST_LLM_WORKERS", "4")),
+}
+
+_executors = {
+    name: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ingest-{name}")
+    for name, workers in STAGE_WORKERS.items()
+}
+
+
+def _run_stage(pool: str, stage: str, on_stage, fn, *args):
+    # Submits fn to the stage pool and reports start/finish through on_stage(stage, status)
+    def run():
+        if on_stage:
+            on_stage(stage, "running")
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            if on_stage:
+                on_stage(stage, "failed", time.perf_counter() - started)
+            raise
+        if on_stage:
+            on_stage(stage, "completed", time.perf_counter() - started)
+        return result
+
+    return _executors[pool].submit(run)
+
+
+def content_hash(file_content: bytes) -> str:
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def _extract_pages(source: UploadSource) -> list:
+    with source.buffer() as buffer:
+        return extract_pages_from_pdf(buffer, path=source.path())
+
+
+def _abandon(outputs: dict):
+    """
+    Cleans up after a failed upload. outputs maps each stage future started for it to the S3 keys it writes.
+    Queued stages are cancelled and running ones waited for (they may still be reading the uploaded file,
+    which the caller closes next), then the objects written by stages that completed are deleted.
+    """
+    for future in outputs:
+        future.cancel()
+    wait(outputs)
+    written = [key for future, keys in outputs.items()
+               if not future.cancelled() and future.exception() is None for key in keys]
+    try:
+        delete_s3_objects(written)
+    except Exception as e:
+        print(f"Error deleting the objects of a failed upload {written}: {e}")
+
+
+def _response(doc_type: str, doc_s3_key: str, text_s3_key: str, extracted_data, file_hash: str, cache_hit: bool) -> dict:
+    return {
+        "message": "Uploaded and processed successfully.",
+        "document_type": doc_type,
+        "document_url": f"s3://{BUCKET_NAME}/{doc_s3_key}",
+        "extracted_text_url": f"s3://{BUCKET_NAME}/{text_s3_key}",
+        "extracted_data": extracted_data,
+        "content_hash": file_hash,
+        "cache_hit": cache_hit
+    }
+
+
+def is_reusable(doc_type: str, extracted_data) -> bool:
+    # Only successful results are reused, a failed classification or LLM extraction is retried by the next upload
+    if doc_type in CLASSIFICATION_FAILURES:
+        return False
+    if doc_type in ("invoice", "purchase order"):
+        return isinstance(extracted_data, dict) and any(
+            value not in (None, "", "None") for key, value in extracted_data.items() if key not in ("email", "document_name"))
+    return True
+
+
+def content_keys(file_hash: str) -> tuple:
+    #S3 keys of the deduplicated original and text, only ever written with these exact bytes
+    return f"{CONTENT_FOLDER}{file_hash}", f"{CONTENT_FOLDER}{file_hash}.txt"
+
+
+def reusable_record(record) -> bool:
+    # Records saved before content keys existed point at the user's keys, which a later upload of the
+    # same name may have overwritten, those uploads run every stage again (and replace the record)
+    return (record is not None and record["doc_s3_key"].startswith(CONTENT_FOLDER)
+            and is_reusable(record["document_type"], record["extracted_data"]))
+
+
+def _remember(file_hash: str, doc_s3_key: str, text_s3_key: str, doc_type: str, extracted_data, pages: list,
+              email: str, filename: str):
+    # Store the results under the content hash so the next identical upload can skip every stage
+    if not any(page.strip() for page in pages) or not is_reusable(doc_type, extracted_data):
+        print(f"[Dedup] Not remembering {file_hash[:12]} ({filename}): no text, or classification/extraction failed")
+        return
+    content_doc_key, content_text_key = content_keys(file_hash)
+    try:
+        copy_s3_object(doc_s3_key, content_doc_key)
+        copy_extracted_text(text_s3_key, content_text_key)
+    except Exception as e:
+        print(f"[Dedup] Not remembering {file_hash[:12]} ({filename}): {e}")
+        return
+    fields = {key: value for key, value in (extracted_data or {}).items() if key not in ("email", "document_name")}
+    save_content_record(file_hash, content_doc_key, content_text_key, doc_type, fields, page_offsets(pages))
+    add_content_association(file_hash, email, filename)
+
+
+def _catalog(doc_s3_key: str, text_s3_key: str, email: str, filename: str, size: int, file_hash: str,
+             doc_type: str, page_count: int):
+    # Entry in the documents table, what /documents and the search index backfill list from
+    save_document({
+        "doc_s3_key": doc_s3_key,
+        "text_s3_key": text_s3_key,
+        "user_email": email,
+        "document_name": filename,
+        "size_bytes": size,
+        "content_hash": file_hash,
+        "document_type": doc_type,
+        "page_count": page_count,
+        "uploaded_at": datetime.now()
+    })
+
+
+def reuse_document(record: dict, filename: str, email: str, on_stage=None, writer=None, size: int = None) -> dict:
+    """
+    Handles an upload whose content was already ingested: no S3 upload of the bytes, no text extraction,
+    no classification and no LLM call. Only links the document to this user.
+    """
+    doc_s3_key = f"documents/{email}_{filename}"
+    text_s3_key = f"extractedtexts/{email}_{filename}.txt"
+    doc_type = record["document_type"]
+    extracted_data = {}
+    if doc_type in ("invoice", "purchase order"):
+        extracted_data = {**record["extracted_data"], "email": email, "document_name": filename}
+
+    if add_content_association(record["content_hash"], email, filename):
+        print(f"[Dedup] Known content {record['content_hash'][:12]}, linking {filename} to {email}")
+        # Server-side copies so the document shows up under this user's keys
+        copies = [
+            _run_stage("s3", stage, on_stage, copy, source, dest)
+            for stage, copy, source, dest in (("copy_original", copy_s3_object, record["doc_s3_key"], doc_s3_key),
+                                              ("copy_text", copy_extracted_text, record["text_s3_key"], text_s3_key))
+            if source != dest
+        ]
+        text = get_s3_file_content(record["text_s3_key"])
+        index_document(email, text_s3_key.split("/")[-1], text, record["page_starts"])
+        store_extracted_data(extracted_data, doc_type, writer)
+        for copy in copies:
+            copy.result()
+        _catalog(doc_s3_key, text_s3_key, email, filename, size, record["content_hash"], doc_type,
+                 len(record["page_starts"]) if record["page_starts"] else None)
+    else:
+        print(f"[Dedup] {filename} is already stored for {email}, nothing to do")
+
+    return _response(doc_type, doc_s3_key, text_s3_key, extracted_data, record["content_hash"], True)
+
+
+def process_document(file_data, filename: str, email: str, on_stage=None, writer=None) -> dict:
+    """
+    Runs the full ingestion for one uploaded PDF and returns the /upload_document/ response body.
+    file_data is an uploads.UploadSource (or the bytes of the file).
+    on_stage(stage, status, seconds=None) is called as stages start and finish.
+    writer is an optional database.BatchWriter to write the extracted row in a micro-batch.
+    """
+    source = file_data if isinstance(file_data, UploadSource) else UploadSource(file_data)
+    file_hash = source.sha256()
+    record = get_content_record(file_hash)
+    #records saved before failures were filtered out may hold one, those uploads run every stage again
+    if reusable_record(record):
+        return reuse_document(record, filename, email, on_stage, writer, size=source.size)
+
+    # Generate a unique S3 path for the uploaded document
+    doc_s3_key = f"documents/{email}_{filename}"
+    text_s3_key = f"extractedtexts/{email}_{filename}.txt"
+
+    # Upload the original to S3 while the text is being extracted, both read the same file
+    upload_original = _run_stage("s3", "upload_original", on_stage, upload_file_to_s3, source.reader(), doc_s3_key)
+    outputs = {upload_original: [doc_s3_key]}
+    try:
+        pages = _run_stage("extract_text", "extract_text", on_stage, _extract_pages, source).result()
+        text = "".join(pages)
+
+        # Upload the extracted text (compressed page by page, with its offset sidecar) while the document is being classified
+        upload_text = _run_stage("s3", "upload_text", on_stage, store_extracted_text, text_s3_key, pages)
+        classification = _run_stage("classify", "classify", on_stage, classify_document, text)
+        outputs.update({upload_text: [text_s3_key, sidecar_key(text_s3_key)], classification: []})
+
+        upload_text.result()
+        doc_type = classification.result()
+
+        # Extract the necessary data based on the document type (LLM call + DB insert)
+        extraction = _run_stage("extract_data", "extract_data", on_stage,
+                                extract_data_based_on_type, text, doc_type, email, filename, writer)
+        outputs[extraction] = []
+        extracted_data = extraction.result()
+        upload_original.result()
+    except Exception:
+        _abandon(outputs)
+        raise
+
+    # Add the text to the user's search index so search never re-reads it from S3
+    index_document(email, text_s3_key.split("/")[-1], text, page_offsets(pages))
+    _catalog(doc_s3_key, text_s3_key, email, filename, source.size, file_hash, doc_type, len(pages))
+    _remember(file_hash, doc_s3_key, text_s3_key, doc_type, extracted_data, pages, email, filename)
+
+    return _response(doc_type, doc_s3_key, text_s3_key, extracted_data, file_hash, False)
+
+
+def process_upload(source: UploadSource, filename: str, email: str, on_stage=None, writer=None) -> dict:
+    # process_document for a request's spooled file, which is deleted once ingestion is done
+    try:
+        return process_document(source, filename, email, on_stage, writer)
+    finally:
+        source.close()
+
+
+def store_document(file_content: bytes, filename: str, email: str, pages: list, doc_type: str,
+                   on_stage=None, writer=None) -> dict:
+    """
+    Finishes ingestion for a document whose text was already extracted and classified elsewhere
+    (the bulk endpoint does that part in worker processes): both S3 uploads and the LLM extraction + DB insert
+    in parallel, then search indexing.
+    """
+    file_hash = content_hash(file_content)
+    doc_s3_key = f"documents/{email}_{filename}"
+    text_s3_key = f"extractedtexts/{email}_{filename}.txt"
+    text = "".join(pages)
+
+    upload_original = _run_stage("s3", "upload_original", on_stage, upload_file_to_s3, io.BytesIO(file_content), doc_s3_key)
+    upload_text = _run_stage("s3", "upload_text", on_stage, store_extracted_text, text_s3_key, pages)
+    extraction = _run_stage("extract_data", "extract_data", on_stage,
+                            extract_data_based_on_type, text, doc_type, email, filename, writer)
+    try:
+        upload_text.result()
+        extracted_data = extraction.result()
+        upload_original.result()
+    except Exception:
+        _abandon({upload_original: [doc_s3_key], upload_text: [text_s3_key, sidecar_key(text_s3_key)], extraction: []})
+        raise
+
+    index_document(email, text_s3_key.split("/")[-1], text, page_offsets(pages))
+    _catalog(doc_s3_key, text_s3_key, email, filename, len(file_content), file_hash, doc_type, len(pages))
+    _remember(file_hash, doc_s3_key, text_s3_key, doc_type, extracted_data, pages, email, filename)
+
+    return _response(doc_type, doc_s3_key, text_s3_key, extracted_data, file_hash, False)
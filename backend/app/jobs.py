@@ -0,0 +1,94 @@
+'''In-process job queue for async uploads.
+
+/upload_document/ in async mode stores a job here and returns its ID right away, the staged
+pipeline in app.ingest then runs in the background and reports progress per stage.
+Jobs only live in this process's memory (lost on restart, not shared across replicas),
+would move to Redis/RQ or Celery for that.'''
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_RUNNING_JOBS = int(os.getenv("INGEST_MAX_RUNNING_JOBS", "8"))  #jobs past this wait in the queue
+JOB_HISTORY_LIMIT = int(os.getenv("INGEST_JOB_HISTORY_LIMIT", "1000"))  #finished jobs kept for /jobs/{id}
+
+_job_runner = ThreadPoolExecutor(max_workers=MAX_RUNNING_JOBS, thread_name_prefix="ingest-job")
+_jobs = OrderedDict()  #job_id -> job dict, oldest first
+_lock = threading.Lock()
+
+
+def _new_job(filename: str, email: str) -> dict:
+    return {
+        "job_id": uuid.uuid4().hex,
+        "status": "queued",
+        "filename": filename,
+        "email": email,
+        "stages": {},
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "finished_at": None,
+    }
+
+
+def _trim_history():
+    # Called with _lock held, drops the oldest finished jobs
+    finished = [job_id for job_id, job in _jobs.items() if job["status"] in ("completed", "failed")]
+    for job_id in finished[:max(0, len(finished) - JOB_HISTORY_LIMIT)]:
+        del _jobs[job_id]
+
+
+def submit_job(process, file_data, filename: str, email: str) -> str:
+    """
+    Queues process(file_data, filename, email, on_stage=...) and returns the job ID.
+    """
+    job = _new_job(filename, email)
+    job_id = job["job_id"]
+    with _lock:
+        _jobs[job_id] = job
+        _trim_history()
+
+    def on_stage(stage, status, seconds=None):
+        with _lock:
+            info = job["stages"].setdefault(stage, {})
+            info["status"] = status
+            if seconds is not None:
+                info["seconds"] = round(seconds, 3)
+
+    def run():
+        with _lock:
+            job["status"] = "running"
+        try:
+            result = process(file_data, filename, email, on_stage=on_stage)
+            with _lock:
+                job["status"] = "completed"
+                job["result"] = result
+        except Exception as e:
+            print(f"[Jobs] Job {job_id} failed: {e}")
+            with _lock:
+                job["status"] = "failed"
+                job["error"] = str(e)
+        finally:
+            with _lock:
+                job["finished_at"] = time.time()
+
+    _job_runner.submit(run)
+    print(f"[Jobs] Queued job {job_id} for {email}: {filename}")
+    return job_id
+
+
+def get_job(job_id: str):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        # Copy so the caller never sees a half updated job
+        snapshot = dict(job)
+        snapshot["stages"] = {stage: dict(info) for stage, info in job["stages"].items()}
+        return snapshot
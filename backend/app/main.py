@@ -3,21 +3,35 @@
 Would add unit tests if had more time. automate CI/CD like GitHub actions
 Would add structured logging (like structlog)
 would add request tracing for better observability and debugging.'''
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from typing import List
 import os
+import json
+import threading
+import time
 from .models import create_tables
+from app.migrations import run_migrations
 from dotenv import load_dotenv
-from app.utils import extract_text_from_pdf
-from app.utils import extract_text_from_pdf, extract_data_based_on_type
-from app.classifier import classify_document
-from app.s3_utils import upload_file_to_s3
-from app.s3_utils import get_documents_for_user
-from app.database import get_invoices_by_email, get_purchase_orders_by_email
+from app.s3_utils import get_documents_for_user, get_text_cache_stats, check_s3, get_s3_text_pages, get_s3_file_content
+from app.text_encoding import get_text_storage_stats
+from app.database import get_invoices_by_email, get_purchase_orders_by_email, get_pool_stats, warm_pool, check_database
 from app.search import search_documents
-from app.search import generate_answer
+from app.search import generate_answer, stream_answer, NO_ANSWER
+from app.context_builder import build_answer_context
+from app.index import get_index_version
+from app.answer_cache import answer_cache, get_answer_cache_stats
+from app.query_router import answer_with_sql, record_route, get_router_stats
+from app.ingest import process_upload
+from app.uploads import open_upload, UploadTooLarge
+from app.jobs import submit_job, get_job
+from app.bulk import run_bulk_upload, detach_upload_file
+from app.classifier import get_classifier_stats, warm_up_classifier, classifier_status
+from app.anthropic_client import anthropic_client
+from app.executors import run_io, run_llm, run_cpu, run_ingest, get_executor_stats
+from app.metrics import registry, get_stage_stats
 from pydantic import BaseModel
-import io  
 
 
 
@@ -27,6 +41,9 @@ BUCKET_NAME = "gentlyai"
 
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+CLASSIFIER_WARMUP = os.getenv("CLASSIFIER_WARMUP", "true").lower() == "true"  #false = load on first upload
+KEY_DETAILS_DEFAULT_LIMIT = int(os.getenv("KEY_DETAILS_DEFAULT_LIMIT", "100"))  #rows per list per /get_key_details page
+KEY_DETAILS_MAX_LIMIT = 1000
 
 '''In production, deploy with multiple FastAPI replicas behind a load balancer. Scale based on rpm and DB connection limits'''
 app = FastAPI()
@@ -34,6 +51,40 @@ app = FastAPI()
 @app.on_event("startup")
 def on_startup():
     create_tables()
+    run_migrations()
+    warm_pool()
+    # Load the classifier in the background so every other route serves right away, /ready reports when it's done
+    if CLASSIFIER_WARMUP:
+        threading.Thread(target=warm_up_classifier, name="classifier-warmup", daemon=True).start()
+
+#Existing stats as gauges on /metrics, read when it is scraped
+registry.add_stats("executor", "Threads of the executor pools", get_executor_stats, label="pool")
+registry.add_stats("db_pool", "Shared DB connection pool", get_pool_stats)
+registry.add_stats("text_cache", "Extracted text cache in front of S3", get_text_cache_stats)
+registry.add_stats("text_storage", "Stored extracted texts", get_text_storage_stats)
+registry.add_stats("answer_cache", "/search_answer/ cache", get_answer_cache_stats)
+registry.add_stats("router", "Routes that answered /search_answer/", get_router_stats)
+registry.add_stats("anthropic", "Shared Anthropic client", anthropic_client.stats)
+registry.add_stats("classifier_batcher", "Zero-shot classifier batcher", get_classifier_stats)
+
+HTTP_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        #route template, not the raw path, so /jobs/{job_id} is one series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        registry.histogram("http_request_seconds", "Time to the response headers, per route", HTTP_BUCKETS,
+                           method=request.method, route=route).observe(time.perf_counter() - started)
+        registry.counter("http_requests_total", "Requests per route and status",
+                         method=request.method, route=route, status=str(status)).inc()
 
 app.add_middleware(
     CORSMiddleware,
@@ -49,49 +100,65 @@ class SearchRequest(BaseModel):
 
 
 
-'''For production, would add a queuing system (like Celery or Temporal) to manage ingestion jobs reliably in FCFS manner and retry on failures
+'''For production, would swap the in-process job queue (app/jobs.py) for Celery or Temporal to manage ingestion jobs reliably and retry on failures
 Would add a proper auth system like OAuth2 or JWT.'''
 @app.post("/upload_document/") 
 async def upload_document(
     file: UploadFile = File(...),
-    email: str = Form(...)
+    email: str = Form(...),
+    async_mode: bool = Form(False)
 ):
     
     '''Would remove the local path here, and would directly upload to S3 and retrieve docs and texts from there for details extraction as well'''
+    # The spooled file is processed in place (never read into memory), keep it past the response for async mode
+    filename, spooled = detach_upload_file(file)
     try:
+        source = await run_io(open_upload, spooled)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-        file_content = await file.read()
-        # Generate a unique S3 path for the uploaded document
-        doc_s3_key = f"documents/{email}_{file.filename}"
-        text_s3_key = f"extractedtexts/{email}_{file.filename}.txt"
-        
-        # Upload the file to S3
-        upload_file_to_s3(io.BytesIO(file_content), doc_s3_key)
-        
-        # Extract the text from the uploaded PDF
-        text = extract_text_from_pdf(io.BytesIO(file_content))
-        
-        # Upload the extracted text to S3
-        text_file = io.BytesIO(text.encode('utf-8'))
-        upload_file_to_s3(text_file, text_s3_key)
+    try:
 
-        # Classify the document
-        doc_type = classify_document(text)
-        
-        # Extract the necessary data based on the document type
-        extracted_data = extract_data_based_on_type(text, doc_type, email, file.filename)
-        
-        # Return the document URL and extracted data
-        return {
-            "message": "Uploaded and processed successfully.",
-            "document_type": doc_type,
-            "document_url": f"s3://{BUCKET_NAME}/{doc_s3_key}",
-            "extracted_text_url": f"s3://{BUCKET_NAME}/{text_s3_key}",
-            "extracted_data": extracted_data  
-        }
+        # Async mode: queue the pipeline and return a job ID to poll on /jobs/{job_id}
+        if async_mode:
+            job_id = submit_job(process_upload, source, filename, email)
+            return {
+                "message": "Upload accepted, processing in the background.",
+                "job_id": job_id,
+                "status_url": f"/jobs/{job_id}"
+            }
+
+        # Upload, extract, classify and store the document (independent stages overlap)
+        # On the ingest threads, the event loop keeps serving other requests meanwhile
+        return await run_ingest(process_upload, source, filename, email)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/upload_documents/bulk")
+async def upload_documents_bulk(
+    files: List[UploadFile] = File(...),
+    email: str = Form(...)
+):
+    
+    #Upload many PDFs, or ZIP/TAR archives of PDFs, in one request.
+    #Streams back one NDJSON line per file as it finishes, then a summary line.
+
+    uploads = [detach_upload_file(file) for file in files]
+    return StreamingResponse(run_bulk_upload(uploads, email), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    
+    #Status of an async upload, per stage, with the upload response once it has completed.
+
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
     
 '''Would add flexible doc search using DocType and DocParams as a dict to allow specific retrievals'''
 @app.get("/documents")
@@ -101,7 +168,7 @@ async def get_documents(email: str):
 
     try:
         # get all documents for the user from S3(based on email ID)
-        documents = get_documents_for_user(email)
+        documents = await run_io(get_documents_for_user, email)
         
         if not documents:
             raise HTTPException(status_code=404, detail="No documents found for this user.")
@@ -112,24 +179,70 @@ async def get_documents(email: str):
         raise HTTPException(status_code=500, detail=str(e))
     
     
+def parse_pages(pages: str) -> list:
+    # "1,3-5" -> [1, 3, 4, 5]
+    numbers = []
+    for part in pages.split(","):
+        first, _, last = part.strip().partition("-")
+        first, last = int(first), int(last or first)
+        if first < 1 or last < first or last - first > 1000:
+            raise ValueError(part)
+        numbers.extend(range(first, last + 1))
+    return numbers
+
+
+@app.get("/documents/pages")
+async def get_document_pages(email: str, document_name: str, pages: str):
+    
+    #Text of some pages of one document (pages=1,3-5), read with S3 range GETs instead of downloading the whole text.
+    #Texts stored before page offsets existed come back whole in "text", with "pages" null.
+
+    try:
+        page_numbers = parse_pages(pages)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="pages must look like 1,3-5")
+
+    text_s3_key = f"extractedtexts/{email}_{document_name}.txt"
+    page_texts = await run_io(get_s3_text_pages, text_s3_key, page_numbers)
+    if page_texts is None:
+        text = await run_io(get_s3_file_content, text_s3_key)
+        if not text:
+            raise HTTPException(status_code=404, detail="Document not found.")
+        return {"document_name": document_name, "pages": None, "text": text}
+    if not page_texts:
+        raise HTTPException(status_code=404, detail="None of these pages exist in the document.")
+    return {"document_name": document_name, "pages": page_texts}
+
+
 '''Would let user search by document type and other params as well, also would allow querying'''
 @app.get("/get_key_details")
-async def get_key_details(email: str):
+async def get_key_details(email: str, limit: int = Query(KEY_DETAILS_DEFAULT_LIMIT, ge=1, le=KEY_DETAILS_MAX_LIMIT),
+                          invoices_after: int = None, purchase_orders_after: int = None):
     
-    #Fetch all documents (invoices and purchase orders) associated with the user's email from PostgreSQL.
+    #Fetch the documents (invoices and purchase orders) associated with the user's email from PostgreSQL.
+    #Up to `limit` of each per call, pass back next_cursor's ids as invoices_after / purchase_orders_after for the next page
 
     try:
-        # Fetch all invoices and purchase orders for the user from PostgreSQL
-        invoices = get_invoices_by_email(email)
-        purchase_orders = get_purchase_orders_by_email(email)
+        # Fetch a page of invoices and purchase orders for the user from PostgreSQL
+        invoices = await run_io(get_invoices_by_email, email, limit=limit, after_id=invoices_after)
+        purchase_orders = await run_io(get_purchase_orders_by_email, email, limit=limit, after_id=purchase_orders_after)
 
-        if not invoices and not purchase_orders:
+        if not invoices and not purchase_orders and invoices_after is None and purchase_orders_after is None:
             raise HTTPException(status_code=404, detail="No documents found for this email.")
 
         # combine both invoices and purchase orders
         document_details = {
             "invoices": invoices,
-            "purchase_orders": purchase_orders
+            "purchase_orders": purchase_orders,
+            # Last id seen per list, keep paging while either has_more is true
+            "next_cursor": {
+                "invoices_after": invoices[-1]["id"] if invoices else invoices_after,
+                "purchase_orders_after": purchase_orders[-1]["id"] if purchase_orders else purchase_orders_after,
+            },
+            "has_more": {
+                "invoices": len(invoices) == limit,
+                "purchase_orders": len(purchase_orders) == limit,
+            }
         }
 
         return document_details
@@ -144,14 +257,46 @@ Math: max_parallel_requests = total_allowed_db_connections / connections_per_req
 Claude API limits and DB throughput should be considered when load testing'''
 
 ''' For scaling search, consider OpenSearch with indexing and a reranker. For highest accuracy, a full RAG pipeline could be used (higher infra cost)'''
+def source_fields(context: dict) -> dict:
+    #What the answer was built from: the passages packed into the prompt, with the tags the answer cites
+    return {
+        "source_documents": list(dict.fromkeys(source["document_name"] for source in context["sources"])),
+        "source_passages": [
+            {
+                "tag": source["tag"],
+                "document_name": source["document_name"],
+                "page_start": source["page_start"],
+                "page_end": source["page_end"],
+                "start": source["start"],
+                "end": source["end"],
+                "score": source["score"]
+            }
+            for source in context["sources"]
+        ]
+    }
+
+
 @app.post("/search_answer/")
 async def search_answer(payload: SearchRequest):
     try:
         query = payload.query
         email = payload.email
 
+        #same question on the same document set was answered before
+        doc_version = await run_io(get_index_version, email)  #may load the index from disk
+        cached = await run_io(answer_cache.get, query, email, doc_version)
+        if cached is not None:
+            record_route("cache")
+            return {**cached, "cached": True, "route": "cache"}
+
+        #lookups and aggregates over the extracted fields are answered straight from postgres
+        sql_answer = await run_io(answer_with_sql, query, email)
+        if sql_answer is not None:
+            record_route("sql")
+            return {**sql_answer, "cached": False, "route": "sql"}
+
         #fuzzy search
-        search_results = search_documents(query, email)
+        search_results = await run_cpu(search_documents, query, email)
 
         if not search_results:
             raise HTTPException(status_code=404, detail="No relevant documents found for this query.")
@@ -159,19 +304,21 @@ async def search_answer(payload: SearchRequest):
         print(f"[DEBUG] Found {len(search_results)} relevant documents.")
 
         
-        #Extract text
-        relevant_text = " ".join([result["relevant_text"] for result in search_results])
+        #Best passages across the documents, overlaps merged, packed into the token budget (context_builder.py)
+        context = await run_cpu(build_answer_context, query, search_results)
 
         # Generate answer
-        answer = generate_answer(relevant_text, query, search_results)
+        answer, usage = await run_llm(generate_answer, context)
 
         if not answer:
             raise HTTPException(status_code=500, detail="Error generating an answer.")
 
-        return {
-            "answer": answer,
-            "source_documents": [result["document_name"] for result in search_results]
-        }
+        response = {"answer": answer, **source_fields(context)}
+        if answer != NO_ANSWER:  #don't keep failed LLM calls around
+            await run_io(answer_cache.put, query, email, doc_version, response)
+        record_route("llm")
+        #usage (prompt tokens, passages packed/dropped) is per request, never cached
+        return {**response, "usage": usage, "cached": False, "route": "llm"}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -180,6 +327,139 @@ async def search_answer(payload: SearchRequest):
 
 
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/search_answer/stream")
+def search_answer_stream(payload: SearchRequest):
+    
+    #Server-sent events version of /search_answer/: a "sources" event right after search, then "delta" events
+    #with the answer text as the model writes it, then "done" (or "error" if the LLM call fails midway)
+
+    query = payload.query
+    email = payload.email
+
+    doc_version = get_index_version(email)
+    cached = answer_cache.get(query, email, doc_version)
+    route = "cache"
+    if cached is None:
+        cached = answer_with_sql(query, email)
+        route = "sql"
+    if cached is None:
+        route = "llm"
+        search_results = search_documents(query, email)
+        if not search_results:
+            raise HTTPException(status_code=404, detail="No relevant documents found for this query.")
+    record_route(route)
+
+    def events():
+        if cached is not None:
+            yield sse_event("sources", {key: cached[key] for key in ("source_documents", "source_passages")})
+            yield sse_event("delta", {"text": cached["answer"]})
+            yield sse_event("done", {"cached": route == "cache", "route": route})
+            return
+
+        context = build_answer_context(query, search_results)
+        sources = source_fields(context)
+        yield sse_event("sources", sources)
+
+        parts = []
+        usage = {}
+        try:
+            for text in stream_answer(context, usage):
+                parts.append(text)
+                yield sse_event("delta", {"text": text})
+        except Exception as e:
+            print(f"Error streaming answer: {e}")
+            yield sse_event("error", {"detail": NO_ANSWER})
+            return
+
+        answer = "".join(parts).strip()
+        if answer:
+            answer_cache.put(query, email, doc_version, {"answer": answer, **sources})
+        yield sse_event("done", {"cached": False, "route": route, "usage": usage})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    #Hit/miss counters of the extracted text cache in front of S3
+    return get_text_cache_stats()
+
+
+@app.get("/texts/stats")
+async def text_storage_stats():
+    #Compression of stored extracted texts and bytes saved on reads (compression and page range GETs)
+    return get_text_storage_stats()
+
+
+@app.get("/cache/answers/stats")
+async def answer_cache_stats():
+    #Hit/miss counters of the /search_answer/ cache
+    return get_answer_cache_stats()
+
+
+@app.get("/router/stats")
+async def router_stats():
+    #Which path answered /search_answer/ (sql, cache, llm) and the share that skipped the LLM
+    return get_router_stats()
+
+
+@app.get("/db/pool_stats")
+async def db_pool_stats():
+    #Utilization of the shared DB connection pool
+    return get_pool_stats()
+
+
+@app.get("/ready")
+async def ready():
+    
+    #Readiness per component, 503 until all of them are ready (uploads wait on the classifier, reads don't)
+
+    classifier = classifier_status()
+    components = {
+        "classifier": {"ready": classifier["status"] == "ready", **classifier},
+        "database": await run_io(check_database),
+        "s3": await run_io(check_s3),
+    }
+    all_ready = all(component["ready"] for component in components.values())
+    return JSONResponse(status_code=200 if all_ready else 503, content={"ready": all_ready, "components": components})
+
+
+@app.get("/classifier/stats")
+async def classifier_stats():
+    #Batch size and queue time histograms of the zero-shot classifier batcher
+    return get_classifier_stats()
+
+
+@app.get("/executors/stats")
+async def executor_stats():
+    #Busy/waiting threads and queue time of the pools the async endpoints offload blocking work to
+    return get_executor_stats()
+
+
+@app.get("/anthropic/stats")
+async def anthropic_stats():
+    #Calls, retries, errors, token usage and call latency of the shared Anthropic client
+    return anthropic_client.stats()
+
+
+@app.get("/metrics")
+def metrics():
+    #Prometheus text format: per-stage timings (S3, PDF extraction, classification, LLM, search, DB),
+    #HTTP requests per route, Anthropic/executor/batcher histograms and the stats above as gauges
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/metrics/stages")
+async def stage_stats():
+    #Per-stage latency histograms and error counts as JSON
+    return get_stage_stats()
+
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Data Extraction API"}
\ No newline at end of file
@@ -0,0 +1,207 @@
+'''Small in-process metrics (histograms, counters) for the parts of the pipeline we tune, exported on
+GET /metrics in the Prometheus text format (no client library needed).
+
+Buckets are cumulative like Prometheus ("le" = less than or equal), so they can be exported as is.
+Every Histogram/Counter registers itself in `registry` under its name and labels; the stats dicts the
+app already keeps (executors, DB pool, caches...) are added as gauges with registry.add_stats.
+
+Pipeline stages are timed with `timed(stage)`, as a context manager or a decorator:
+    with timed("s3_get"): ...
+    @timed("db_query")
+into stage_seconds{stage="..."}, and stage_errors_total{stage="..."} counts the ones that raised.
+
+Payload dumps (raw S3 responses, whole prompts, extracted texts, fetched rows) only print with
+LOG_LEVEL=DEBUG. Call sites check VERBOSE before building the message, so with it off they cost nothing.'''
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+VERBOSE = LOG_LEVEL == "DEBUG"
+
+STAGE_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+STAGES = ["s3_put", "s3_get", "s3_list", "s3_copy", "s3_delete", "pdf_extract", "classify", "llm_call", "search",
+          "db_insert", "db_query"]
+
+
+def _label_text(labels: dict, extra: dict = None) -> str:
+    merged = {**(labels or {}), **(extra or {})}
+    if not merged:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in merged.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(merged, escaped)) + "}"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}  #(name, labels) -> metric, a metric created again replaces the old one
+        self._stats = []    #(prefix, description, fn, label)
+        self._lock = threading.RLock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[(metric.name, tuple(sorted(metric.labels.items())))] = metric
+        return metric
+
+    def histogram(self, name: str, description: str, buckets: list, **labels):
+        # Get or create, for metrics with labels only known at runtime (route, status...)
+        with self._lock:
+            metric = self._metrics.get((name, tuple(sorted(labels.items()))))
+            return metric or Histogram(name, description, buckets, labels, registry=self)
+
+    def counter(self, name: str, description: str, **labels):
+        with self._lock:
+            metric = self._metrics.get((name, tuple(sorted(labels.items()))))
+            return metric or Counter(name, description, labels, registry=self)
+
+    def add_stats(self, prefix: str, description: str, fn, label: str = None):
+        # fn() returns a dict, every top-level number in it is exported as the gauge {prefix}_{key}.
+        # With label, fn() returns {label value: dict} instead, e.g. executor_busy{pool="io"}
+        with self._lock:
+            self._stats.append((prefix, description, fn, label))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+            stats = list(self._stats)
+
+        lines, described = [], set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+
+        for prefix, description, fn, label in stats:
+            try:
+                groups = fn() if label else {None: fn()}
+            except Exception as e:
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            gauges = {}  #name -> [sample lines], so each gauge is described once
+            for group, values in groups.items():
+                labels = {label: group} if label else None
+                for key, value in values.items():
+                    #histograms in the stats (dicts) are exported on their own, strings aren't metrics
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    gauges.setdefault(f"{prefix}_{key}", []).append(f"{prefix}_{key}{_label_text(labels)} {_number(value)}")
+            for name, samples in gauges.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: list, labels: dict = None, registry: Registry = registry):
+        self.name = name
+        self.description = description
+        self.labels = dict(labels or {})
+        self.buckets = sorted(buckets)
+        self._counts = [0] * len(self.buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def observe(self, value: float):
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": {str(bound): count for bound, count in zip(self.buckets, self._counts)},
+                "count": self._count,
+                "sum": round(self._sum, 6),
+                "avg": round(self._sum / self._count, 6) if self._count else 0.0,
+            }
+
+    def samples(self) -> list:
+        with self._lock:
+            counts, count, total = list(self._counts), self._count, self._sum
+        lines = [f"{self.name}_bucket{_label_text(self.labels, {'le': _number(bound)})} {n}"
+                 for bound, n in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{_label_text(self.labels, {'le': '+Inf'})} {count}")
+        lines.append(f"{self.name}_sum{_label_text(self.labels)} {_number(float(total))}")
+        lines.append(f"{self.name}_count{_label_text(self.labels)} {count}")
+        return lines
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: dict = None, registry: Registry = registry):
+        self.name = name
+        self.description = description
+        self.labels = dict(labels or {})
+        self._value = 0
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self) -> list:
+        return [f"{self.name}{_label_text(self.labels)} {_number(self._value)}"]
+
+
+stage_seconds = {stage: Histogram("stage_seconds", "Duration of one pipeline stage call", STAGE_BUCKETS,
+                                  {"stage": stage}) for stage in STAGES}
+stage_errors = {stage: Counter("stage_errors_total", "Pipeline stage calls that raised", {"stage": stage})
+                for stage in STAGES}
+
+
+@contextmanager
+def timed(stage: str, expected=None):
+    # Also usable as a decorator (@timed("db_query")), contextmanager objects are ContextDecorators.
+    # expected(exception) -> True for exceptions that are answers rather than failures (S3 304/404...)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if expected is None or not expected(e):
+            stage_errors[stage].inc()
+        raise
+    finally:
+        stage_seconds[stage].observe(time.perf_counter() - started)
+
+
+def record_error(stage: str):
+    # For stages that catch their own errors (most DB helpers log and return a default)
+    stage_errors[stage].inc()
+
+
+def get_stage_stats() -> dict:
+    return {stage: histogram.snapshot() | {"errors": stage_errors[stage].value}
+            for stage, histogram in stage_seconds.items()}
@@ -0,0 +1,94 @@
+'''Versioned schema migrations, run at startup after create_tables().
+
+create_all only creates missing tables, it never changes existing ones, so anything added to a table
+that already holds data (indexes, columns) goes here as a new numbered migration. Applied versions are
+recorded in schema_migrations; an advisory lock makes sure only one worker migrates at a time.
+
+Index migrations use CREATE INDEX CONCURRENTLY so uploads keep writing while a big table is indexed,
+those statements can't run inside a transaction (transactional=False). Every statement must be safe
+to re-run (IF NOT EXISTS), a migration interrupted halfway is simply applied again on the next start.'''
+from datetime import datetime
+
+from app.models import engine
+
+MIGRATION_LOCK_ID = 72_410_001  #arbitrary, shared by every worker of this app
+
+# (version, description, statements, transactional)
+MIGRATIONS = [
+    (1, "Per-user and per-document indexes on invoices and purchase_orders", [
+        # (user_email, id) serves WHERE user_email = ... and keyset pagination by id with one index
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_invoices_user_email_id ON invoices (user_email, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_invoices_document_name_user_email ON invoices (document_name, user_email)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_purchase_orders_user_email_id ON purchase_orders (user_email, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_purchase_orders_document_name_user_email ON purchase_orders (document_name, user_email)",
+    ], False),
+]
+
+
+def _drop_invalid_indexes(cursor, statements):
+    # A concurrent build that was interrupted leaves an INVALID index behind, IF NOT EXISTS would then skip it
+    for statement in statements:
+        if "CREATE INDEX" not in statement:
+            continue
+        name = statement.split("IF NOT EXISTS", 1)[1].split()[0]
+        cursor.execute("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND NOT i.indisvalid
+        """, (name,))
+        if cursor.fetchone():
+            print(f"[Migrations] Dropping invalid index {name} left by an interrupted build")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def run_migrations():
+    """
+    Applies every migration newer than the recorded schema version, in order.
+    """
+    pooled = engine.raw_connection()
+    conn = pooled.dbapi_connection  #the psycopg2 connection, autocommit set on the pool's proxy wouldn't reach it
+    try:
+        conn.rollback()  #the pool's pre-ping may have opened a transaction, autocommit can't be switched inside one
+        conn.autocommit = True  #the advisory lock and concurrent index builds live outside transactions
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL
+                )
+            """)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+
+            for version, description, statements, transactional in MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"[Migrations] Applying {version}: {description}")
+                if transactional:
+                    conn.autocommit = False
+                    try:
+                        for statement in statements:
+                            cursor.execute(statement)
+                        cursor.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                                       (version, description, datetime.now()))
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        conn.autocommit = True
+                else:
+                    _drop_invalid_indexes(cursor, statements)
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                                   (version, description, datetime.now()))
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            cursor.close()
+    finally:
+        conn.autocommit = False  #back to the pool's default before other code gets this connection
+        pooled.close()
+
@@ -0,0 +1,233 @@
+'''SQL first routing for /search_answer/ (approach 3 in search.py).
+
+Questions about the fields we already extracted into postgres (vendor/supplier, dates, totals,
+invoice/PO numbers) are answered with one parameterized query instead of fuzzy search + an LLM call:
+
+lookup - "what is the total of invoice INV-0042?"
+count  - "how many invoices from Acme in 2024?"
+sum    - "total spent on purchase orders from Globex since March 2024"
+list   - "show invoices from Acme between 2024-01-01 and 2024-06-30", "PO number for supplier Globex"
+
+The rules are deliberately narrow, anything they don't fully understand (or that matches no rows)
+falls back to full text search + LLM. That includes any question with a qualifier the queries can't
+express (last, average, mentions, amounts over/under...) or about a field we don't extract (due date, tax...). Route counters give the share of questions that skipped the LLM.'''
+import calendar
+import os
+import re
+import threading
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+from app.database import query_structured
+
+load_dotenv()
+
+QUERY_ROUTER_ENABLED = os.getenv("QUERY_ROUTER_ENABLED", "true").lower() == "true"
+QUERY_ROUTER_LIST_LIMIT = int(os.getenv("QUERY_ROUTER_LIST_LIMIT", "20"))
+
+KINDS = {
+    "invoices": {"label": "invoice", "party": "vendor"},
+    "purchase_orders": {"label": "purchase order", "party": "supplier"},
+}
+
+_INVOICE_RE = re.compile(r"\b(invoices?|bills?|vendors?)\b", re.I)
+_PAID_RE = re.compile(r"\b(?:pay|paid)\b", re.I)  #money we paid out is invoices, unless POs are named
+_PO_RE = re.compile(r"\b(purchase orders?|pos|po|suppliers?)\b", re.I)
+_NUMBER_RE = re.compile(
+    r"\b(?:invoice|bill|po|purchase order|order)\s*(?:number|no\.?|num|#)?\s*[:#]?\s*([a-z0-9][a-z0-9\-/]*\d[a-z0-9\-/]*)", re.I)
+_COUNT_RE = re.compile(r"\b(?:how many|number of|count(?: of)?)\s+(?:\w+\s+)?(?:invoices|bills|purchase orders|pos|orders)\b", re.I)
+_SUM_RE = re.compile(r"\b(?:total|sum|how much|spent|spend|spending)\b", re.I)
+_LIST_RE = re.compile(r"\b(?:list|show|which|what (?:are|were)|all)\b", re.I)
+_NUMBERS_RE = re.compile(r"\b(?:invoice|bill|po|purchase order|order)\s+(?:numbers?|nos?\.?|#)", re.I)
+#the fields a lookup answers with (number, date, vendor/supplier, total)
+_FIELD_RE = re.compile(r"\b(?:total|amount|date|dated|when|vendor|supplier|who|how much)\b", re.I)
+#ordering, statistics, text conditions, amount comparisons, negations and fields we don't extract
+_UNSUPPORTED_RE = re.compile(
+    r"\b(?:last|latest|first|earliest|newest|oldest|recent|previous|next|most|least|top|average|avg|mean|median|"
+    r"max(?:imum)?|min(?:imum)?|highest|lowest|largest|biggest|smallest|mention(?:s|ed|ing)?|contain(?:s|ed|ing)?|"
+    r"about|regarding|say|says|over|under|above|below|exceed(?:s|ed|ing)?|more than|less than|greater than|"
+    r"at least|at most|per|each|not|without|except|excluding|due|overdue|unpaid|outstanding|tax(?:es)?|vat|"
+    r"discounts?|shipping|currency|items?|description|method|terms|status|cost)\b", re.I)
+
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_MONTH_PATTERN = "|".join(sorted(_MONTHS, key=len, reverse=True))
+_FULL_MONTH_PATTERN = "|".join(name.lower() for name in calendar.month_name if name)  #"may 2024", but not a bare "may"
+_DATE_TOKEN = rf"(\d{{4}}-\d{{2}}-\d{{2}}|(?:{_MONTH_PATTERN})\.?\s+\d{{4}}|\d{{4}}|(?:{_FULL_MONTH_PATTERN}))"
+_RANGE_RE = re.compile(rf"\b(?:between|from)\s+{_DATE_TOKEN}\s+(?:and|to|until|-)\s+{_DATE_TOKEN}\b", re.I)
+_SINCE_RE = re.compile(rf"\b(?:since|after|from)\s+{_DATE_TOKEN}\b", re.I)
+_BEFORE_RE = re.compile(rf"\b(?:before|until|up to)\s+{_DATE_TOKEN}\b", re.I)
+_IN_RE = re.compile(rf"\b(?:in|during|for|of)\s+{_DATE_TOKEN}\b", re.I)
+
+_PARTY_RE = re.compile(
+    r"\b(?:from|by|with|to|vendor|supplier|pay|paid)\s+(?:(?:the\s+)?(?:vendor|supplier)\s+)?(.+?)"
+    r"(?=\s+(?:in|during|between|since|before|after|until|on|for|from|dated)\b|[?.!,]|$)", re.I)
+_PARTY_STOPWORDS = {"me", "us", "my", "our", "them", "all", "each", "vendor", "vendors", "supplier", "suppliers", "date"}
+
+_stats = {"sql": 0, "cache": 0, "llm": 0, "sql_no_rows": 0}
+_stats_lock = threading.Lock()
+
+
+def _date_range(token: str):
+    # (first day, day after the last day) covered by an ISO date, "March 2024", "2024" or "March" (the latest one)
+    token = token.lower().rstrip(".")
+    if token in _MONTHS:
+        today = date.today()
+        month = _MONTHS[token]
+        token = f"{token} {today.year if month <= today.month else today.year - 1}"
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", token):
+        day = date.fromisoformat(token)
+        return day, day + timedelta(days=1)
+    if re.fullmatch(r"\d{4}", token):
+        year = int(token)
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    month_name, year = token.replace(".", "").split()
+    month, year = _MONTHS[month_name], int(year)
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+
+def _parse_dates(query: str):
+    """
+    Returns (date_from, date_to, query with the date phrase removed), date_to is exclusive.
+    """
+    try:
+        match = _RANGE_RE.search(query)
+        if match:
+            return _date_range(match.group(1))[0], _date_range(match.group(2))[1], query.replace(match.group(0), " ")
+        match = _SINCE_RE.search(query)
+        if match:
+            return _date_range(match.group(1))[0], None, query.replace(match.group(0), " ")
+        match = _BEFORE_RE.search(query)
+        if match:
+            return None, _date_range(match.group(1))[0], query.replace(match.group(0), " ")
+        match = _IN_RE.search(query)
+        if match:
+            start, end = _date_range(match.group(1))
+            return start, end, query.replace(match.group(0), " ")
+    except ValueError:
+        pass  #not a real date (e.g. month 13), leave it to full text search
+    return None, None, query
+
+
+def _parse_party(query: str):
+    # The first phrase that names a party, "paid on purchase orders from Globex" is Globex
+    for match in _PARTY_RE.finditer(query):
+        party = re.sub(r"^(?:the)\s+", "", match.group(1).strip(), flags=re.I)
+        party = re.sub(r"'s$", "", party).strip()
+        if party and party.lower() not in _PARTY_STOPWORDS and not _INVOICE_RE.search(party) and not _PO_RE.search(party):
+            return party
+    return None
+
+
+def parse_query(query: str):
+    """
+    Returns the structured intent of a question, or None if it should go to full text search:
+    {"table", "aggregate" (lookup/count/sum/list), "number", "party", "date_from", "date_to"}
+    """
+    if _UNSUPPORTED_RE.search(query):
+        return None
+    is_po = bool(_PO_RE.search(query))
+    is_invoice = bool(_INVOICE_RE.search(query)) or (not is_po and bool(_PAID_RE.search(query)))
+    if is_invoice == is_po:  #neither, or ambiguous
+        return None
+    table = "invoices" if is_invoice else "purchase_orders"
+
+    intent = {"table": table, "aggregate": None, "number": None, "party": None, "date_from": None, "date_to": None}
+
+    number = _NUMBER_RE.search(query)
+    if number and not re.fullmatch(r"(?:19|20)\d{2}", number.group(1)):
+        if not _FIELD_RE.search(query):  #asks about something we didn't extract
+            return None
+        intent.update(aggregate="lookup", number=number.group(1))
+        return intent
+
+    date_from, date_to, rest = _parse_dates(query)
+    intent.update(date_from=date_from, date_to=date_to, party=_parse_party(rest))
+    has_filter = bool(date_from or date_to or intent["party"])
+
+    if _COUNT_RE.search(query):
+        intent["aggregate"] = "count"
+    elif _SUM_RE.search(query):
+        intent["aggregate"] = "sum"
+    elif (_LIST_RE.search(query) or _NUMBERS_RE.search(query)) and has_filter:
+        intent["aggregate"] = "list"
+    else:
+        return None
+    return intent
+
+
+def _describe(intent: dict) -> str:
+    kind = KINDS[intent["table"]]
+    parts = []
+    if intent["party"]:
+        parts.append(f"from {kind['party']}s matching '{intent['party']}'")
+    if intent["date_from"] and intent["date_to"]:
+        parts.append(f"dated {intent['date_from']} to {intent['date_to'] - timedelta(days=1)}")
+    elif intent["date_from"]:
+        parts.append(f"dated {intent['date_from']} or later")
+    elif intent["date_to"]:
+        parts.append(f"dated before {intent['date_to']}")
+    return (" " + " ".join(parts)) if parts else ""
+
+
+def _format_row(intent: dict, row: dict) -> str:
+    kind = KINDS[intent["table"]]
+    return (f"{kind['label'].capitalize()} {row['number'] or '(no number)'} ({row['document_name']}): "
+            f"dated {row['date'] or 'unknown'}, {kind['party']} {row['party'] or 'unknown'}, total {row['total_amount'] or 'unknown'}")
+
+
+def answer_with_sql(query: str, email: str):
+    """
+    Returns a /search_answer/ style response when the question can be answered from postgres, else None.
+    """
+    if not QUERY_ROUTER_ENABLED:
+        return None
+    intent = parse_query(query)
+    if intent is None:
+        return None
+
+    result = query_structured(intent["table"], intent["aggregate"], email, number=intent["number"],
+                              party=intent["party"], date_from=intent["date_from"], date_to=intent["date_to"],
+                              limit=QUERY_ROUTER_LIST_LIMIT)
+    if not result or (isinstance(result, dict) and not result["count"]):
+        # No rows can also mean the data was never extracted, full text search may still find it
+        _record("sql_no_rows")
+        return None
+
+    label = KINDS[intent["table"]]["label"]
+    documents = []
+    if intent["aggregate"] == "count":
+        answer = f"You have {result['count']} {label}{'s' if result['count'] != 1 else ''}{_describe(intent)}."
+    elif intent["aggregate"] == "sum":
+        answer = f"The {result['count']} {label}{'s' if result['count'] != 1 else ''}{_describe(intent)} add up to {result['total']:,.2f}."
+        missing = result["count"] - result["with_amount"]
+        if missing:
+            answer += f" ({missing} without a readable total {'is' if missing == 1 else 'are'} not included.)"
+    elif intent["aggregate"] == "lookup":
+        answer = "\n".join(_format_row(intent, row) for row in result)
+        documents = [row["document_name"] for row in result]
+    else:
+        answer = f"Found {len(result)} {label}{'s' if len(result) != 1 else ''}{_describe(intent)}"
+        answer += f" (showing the latest {QUERY_ROUTER_LIST_LIMIT}):\n" if len(result) >= QUERY_ROUTER_LIST_LIMIT else ":\n"
+        answer += "\n".join(_format_row(intent, row) for row in result)
+        documents = [row["document_name"] for row in result]
+
+    return {"answer": answer, "source_documents": documents, "source_passages": [], "intent": intent["aggregate"]}
+
+
+def _record(stat: str):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def record_route(route: str):
+    #route is "sql", "cache" or "llm", whichever produced the answer
+    _record(route)
+
+
+def get_router_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    answered = stats["sql"] + stats["cache"] + stats["llm"]
+    stats["llm_avoidance_rate"] = round((stats["sql"] + stats["cache"]) / answered, 4) if answered else 0.0
+    return stats
@@ -1,14 +1,23 @@
 '''
-Using blocking I/O (boto3/psycopg2) currently, would move to ioboto3 and asyncpg to allow concurrent async requests
-Would cache S3 object listing using in-memory cache or index keys in Postgresql to reduce response time and cost
+Blocking I/O (boto3/psycopg2), the async endpoints call it through app/executors.py; would move to aioboto3 and asyncpg later
+Document listings are served from the postgres catalog (documents table), not S3 LIST calls
 
 code improvements:
 Would improve naming convention. like documents/{email}/{filename}.pdf to avoid collisions 
 and parallel uploads
 Would use presigned URLs for S3 uploads to upload multiple'''
 import boto3
+from botocore.exceptions import ClientError
+import io
+import json
 import os
 from dotenv import load_dotenv
+from app.text_cache import text_cache
+from app.database import list_documents
+from app.uploads import S3_TRANSFER_CONFIG
+from app.metrics import VERBOSE, timed
+from app.text_encoding import (encode_pages, decode_body, content_encoding_header, sidecar_key, page_ranges,
+                               split_range, record_skipped)
 
 load_dotenv()
 
@@ -18,23 +27,98 @@ AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = "us-east-2"  
 BUCKET_NAME = "gentlyai"  
 EXTRACTED_TEXTS_FOLDER = "extractedtexts/"
+CONTENT_FOLDER = "content/"  #deduplicated originals and texts, keyed by the SHA-256 of the file (see ingest.py)
 
 #initialize the S3 client(bucket has public access)
 s3_client = boto3.client("s3", region_name=AWS_REGION)
 
-def upload_file_to_s3(file_data, s3_key: str):
+
+def _error_code(e: ClientError):
+    return e.response.get("Error", {}).get("Code")
+
+
+def _not_modified_or_missing(e: Exception) -> bool:
+    return isinstance(e, ClientError) and _error_code(e) in ("304", "NotModified", "404", "NoSuchKey")
+
+
+def _get_object(**kwargs):
+    
+    #One GET with its body download, timed as one s3_get. Returns (response, body)
+    with timed("s3_get", expected=_not_modified_or_missing):
+        response = s3_client.get_object(Bucket=BUCKET_NAME, **kwargs)
+        return response, response["Body"].read()
+
+def upload_file_to_s3(file_data, s3_key: str, extra_args: dict = None):
     
     #Upload a file to S3. Email is used as a prefix in the filename, not as a folder. file_type is either "documents" or "extractedtexts".
+    #extra_args are passed to S3 as is (ContentType, ContentEncoding...)
     
     try:
         # Upload the content of the file to S3 using the provided s3_key (document or extracted text)
-        s3_client.upload_fileobj(file_data, BUCKET_NAME, s3_key)
+        # Large files go as a multipart upload, a few parts at a time, never the whole file in memory
+        with timed("s3_put"):
+            s3_client.upload_fileobj(file_data, BUCKET_NAME, s3_key, ExtraArgs=extra_args, Config=S3_TRANSFER_CONFIG)
+        text_cache.invalidate(s3_key)  #never serve the old version of an overwritten key
         print(f"Uploaded to S3: s3://{BUCKET_NAME}/{s3_key}")
         return s3_key
     except Exception as e:
         print(f"Error uploading file: {e}")
         raise e
 
+def copy_s3_object(source_key: str, dest_key: str):
+    
+    #Server-side copy inside the bucket, the bytes never pass through this server.
+    
+    try:
+        with timed("s3_copy"):
+            s3_client.copy({"Bucket": BUCKET_NAME, "Key": source_key}, BUCKET_NAME, dest_key)
+        text_cache.invalidate(dest_key)
+        print(f"Copied in S3: s3://{BUCKET_NAME}/{source_key} -> {dest_key}")
+        return dest_key
+    except Exception as e:
+        print(f"Error copying file: {e}")
+        raise e
+
+def delete_s3_objects(s3_keys: list):
+    
+    #Deletes keys in one request (up to 1000), keys that don't exist are not an error
+    if not s3_keys:
+        return
+    with timed("s3_delete"):
+        response = s3_client.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": key} for key in s3_keys],
+                                                                       "Quiet": True})
+    for key in s3_keys:
+        text_cache.invalidate(key)
+    for error in response.get("Errors", []):
+        print(f"Error deleting s3://{BUCKET_NAME}/{error.get('Key')}: {error.get('Message')}")
+    print(f"Deleted from S3: {len(s3_keys)} keys")
+
+def store_extracted_text(text_s3_key: str, pages: list) -> dict:
+    
+    #Stores the extracted text compressed page by page (see text_encoding.py), then its offset sidecar.
+    #Returns the sidecar.
+    body, sidecar = encode_pages(pages)
+    extra_args = {"ContentType": "text/plain; charset=utf-8"}
+    encoding = content_encoding_header(sidecar["encoding"])
+    if encoding:
+        extra_args["ContentEncoding"] = encoding
+    upload_file_to_s3(io.BytesIO(body), text_s3_key, extra_args)
+    upload_file_to_s3(io.BytesIO(json.dumps(sidecar).encode("utf-8")), sidecar_key(text_s3_key),
+                      {"ContentType": "application/json"})
+    return sidecar
+
+def copy_extracted_text(source_key: str, dest_key: str):
+    
+    #Copies an extracted text and its sidecar, texts stored before sidecars existed only have the text
+    copy_s3_object(source_key, dest_key)
+    try:
+        with timed("s3_copy", expected=_not_modified_or_missing):
+            s3_client.copy({"Bucket": BUCKET_NAME, "Key": sidecar_key(source_key)}, BUCKET_NAME, sidecar_key(dest_key))
+    except ClientError as e:
+        if _error_code(e) not in ("404", "NoSuchKey"):
+            raise
+    return dest_key
+
 def upload_document_and_text(file_data, email: str, doc_filename: str, extracted_text: str):
     """
     Uploads the original document and its extracted text to S3.
@@ -46,29 +130,54 @@ def upload_document_and_text(file_data, email: str, doc_filename: str, extracted
     
     # Upload the document and text directly to S3
     upload_file_to_s3(file_data, s3_doc_path)
-    upload_file_to_s3(extracted_text.encode(), s3_text_path)
+    store_extracted_text(s3_text_path, [extracted_text])
     
     return s3_doc_path, s3_text_path
 
 
+def list_s3_objects(prefix: str):
+    
+    #Yields every object under the prefix, following continuation tokens (one LIST call returns at most 1000 keys)
+    pages = iter(s3_client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix))
+    while True:
+        with timed("s3_list"):  #one LIST call per page, not the caller's time between pages
+            page = next(pages, None)
+        if page is None:
+            return
+        yield from page.get("Contents", [])
+
+
+def document_url(s3_key: str) -> str:
+    return f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
+
+
 def get_documents_for_user(email: str):
     
-    #Fetch the list of documents stored in the S3 bucket for the user. Uses email as a prefix to search documents in the S3 'documents' folder.
+    #Fetch the list of documents stored for the user. Served from the postgres catalog (documents table),
+    #an empty catalog means no documents (older uploads are backfilled once by catalog_reconcile).
+    #S3 is only listed (email prefix in the 'documents' folder) if the catalog can't be read
+    catalog = list_documents(email)
+    if catalog is not None:
+        return [
+            {
+                "document_name": entry["doc_s3_key"],
+                "document_url": document_url(entry["doc_s3_key"]),
+                "document_type": entry["document_type"],
+                "size_bytes": entry["size_bytes"],
+                "page_count": entry["page_count"],
+                "uploaded_at": entry["uploaded_at"]
+            }
+            for entry in catalog
+        ]
+
     try:
         # List all docs with email prefix
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=f"documents/{email}_")
-
-        if 'Contents' not in response:
-            return []
-
-        # extract doc names and urls
         documents = []
-        for obj in response['Contents']:
+        for obj in list_s3_objects(f"documents/{email}_"):
             s3_key = obj['Key']
-            document_url = f"https://{BUCKET_NAME}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
             documents.append({
                 "document_name": s3_key,
-                "document_url": document_url
+                "document_url": document_url(s3_key)
             })
 
         return documents
@@ -78,25 +187,97 @@ def get_documents_for_user(email: str):
     
 
 def get_s3_documents(email: str):
-    prefix = f"{EXTRACTED_TEXTS_FOLDER}{email}_"
-    print(f"\n S3 Search Prefix: {prefix}")
-    
-    response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix)
-    print(f"Raw S3 Response: {response}")
+    #Extracted text file names of the user, e.g. "{email}_{filename}.txt", from the catalog when it can be read
+    catalog = list_documents(email)
+    if catalog is not None:
+        return [entry["text_s3_key"].split("/")[-1] for entry in catalog if entry["text_s3_key"]]
 
-    if "Contents" not in response:
-        return []
+    prefix = f"{EXTRACTED_TEXTS_FOLDER}{email}_"
+    document_names = [obj["Key"].split("/")[-1] for obj in list_s3_objects(prefix)]
 
-    document_names = [obj["Key"].split("/")[-1] for obj in response["Contents"]]
-    print(f"Matched Documents: {document_names}")
+    print(f"S3 Search Prefix {prefix}: {len(document_names)} documents")
+    if VERBOSE:
+        print(f"Matched Documents: {document_names}")
     return document_names
 
 
 def get_s3_file_content(file_key: str):
+    
+    #Reads through the text cache. A cached copy is revalidated with a conditional GET on its ETag,
+    #so an unchanged object costs a 304 with no body instead of a full download.
     try:
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=file_key)
-        content = response["Body"].read().decode("utf-8")
+        cached, tier = text_cache.get(file_key)
+        if cached is not None:
+            try:
+                response, body = _get_object(Key=file_key, IfNoneMatch=cached.etag)
+            except ClientError as e:
+                if _error_code(e) in ("304", "NotModified"):
+                    text_cache.record("revalidations")
+                    text_cache.record(f"{tier}_hits")
+                    return cached.content
+                raise
+            text_cache.record("stale")
+        else:
+            text_cache.record("misses")
+            response, body = _get_object(Key=file_key)
+
+        data = decode_body(body, response.get("ContentEncoding"))  #plain for texts stored before compression
+        content = data.decode("utf-8")
+        text_cache.record("bytes_downloaded", len(body))
+        text_cache.put(file_key, content, response.get("ETag"), str(response.get("LastModified")), len(data))
         return content
     except Exception as e:
         print(f"Error fetching file content: {e}")
-        return ""
\ No newline at end of file
+        return ""
+
+
+def get_text_sidecar(text_s3_key: str):
+    
+    #Page/line offsets of a stored text, None for texts stored before sidecars existed
+    try:
+        _, body = _get_object(Key=sidecar_key(text_s3_key))
+    except ClientError as e:
+        if _error_code(e) in ("404", "NoSuchKey"):
+            return None
+        raise
+    return json.loads(body)
+
+
+def get_s3_text_pages(text_s3_key: str, page_numbers):
+    
+    #Reads only the requested pages (1-based) of an extracted text, one range GET per run of consecutive pages.
+    #Returns {page_number: text}, or None when the text has no sidecar (or it doesn't match the object),
+    #callers then fall back to get_s3_file_content.
+    sidecar = get_text_sidecar(text_s3_key)
+    if sidecar is None:
+        return None
+
+    pages = {}
+    downloaded = 0
+    for first, last, start, end in page_ranges(sidecar, page_numbers):
+        if end == start:
+            pages.update({page: "" for page in range(first, last + 1)})
+            continue
+        response, body = _get_object(Key=text_s3_key, Range=f"bytes={start}-{end - 1}")
+        # "bytes 0-99/1234": the object must be the one the sidecar describes (both are rewritten on re-upload)
+        total = response.get("ContentRange", "").rsplit("/", 1)[-1]
+        if total.isdigit() and int(total) != sidecar["stored_bytes"]:
+            print(f"Sidecar of {text_s3_key} doesn't match the object, reading the whole text")
+            return None
+        downloaded += len(body)
+        pages.update(split_range(sidecar, first, last, body))
+    record_skipped(sidecar["stored_bytes"] - downloaded)
+    return pages
+
+
+def check_s3() -> dict:
+    # Readiness check: the bucket is reachable with our credentials
+    try:
+        s3_client.head_bucket(Bucket=BUCKET_NAME)
+        return {"ready": True}
+    except Exception as e:
+        return {"ready": False, "error": str(e)}
+
+
+def get_text_cache_stats():
+    return text_cache.get_stats()
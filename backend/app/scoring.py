@@ -0,0 +1,35 @@
+'''Batched fuzzy scoring for search.
+
+Scores one query against a whole array of strings in a single rapidfuzz cdist call running in C++
+across all cores, instead of one Python level fuzz.partial_ratio call per line.
+Scores stay on the same 0-100 partial_ratio scale so the existing thresholds keep their meaning.
+rapidfuzz finds the optimal partial alignment, so a few lines score slightly higher than with
+fuzzywuzzy's SequenceMatcher heuristic.'''
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+from rapidfuzz import fuzz, process
+
+load_dotenv()
+
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "-1"))  #-1 uses every core
+
+
+def score_strings(query: str, choices: list, score_cutoff: int = 0) -> np.ndarray:
+    """
+    Returns a uint8 array of partial_ratio scores (rounded, 0-100), one per choice.
+    Scores under score_cutoff come back as 0, which lets rapidfuzz stop scoring a pair early
+    once the cutoff can no longer be reached.
+    """
+    if not choices:
+        return np.zeros(0, dtype=np.uint8)
+    scores = process.cdist(
+        [query],
+        choices,
+        scorer=fuzz.partial_ratio,
+        dtype=np.uint8,
+        workers=SCORING_WORKERS,
+        score_cutoff=score_cutoff,
+    )
+    return scores[0]
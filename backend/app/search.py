@@ -9,7 +9,7 @@ approach 2(searching the postgres): faster querying and could introduce filters
 well for contexual questions
 
 approach 3(hybrid): might go with this. first search sql if the answer is there, if not, then fallback to full
-search.
+search. (done in query_router.py for lookups/counts/totals over the extracted fields)
 
 For increased volume would batch N documents and send a bulk prompt
 
@@ -17,110 +17,163 @@ code optimzations:
 Woudl use smaller chunks (sliding window/top 3 results)
 Would use token truncation and summarization pre-step for large docs
 Would  add session cacheing to maintain chat context'''
-from fuzzywuzzy import fuzz
+import numpy as np
 from dotenv import load_dotenv
 import os
 import requests
-from app.s3_utils import get_s3_documents, get_s3_file_content
+from app.index import get_or_build_index
+from app.scoring import score_strings
+from app.anthropic_client import anthropic_client
+from app.metrics import VERBOSE, timed
+from app.context_builder import record_prompt_tokens
 import re
 
 load_dotenv()
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
-EXTRACTED_TEXTS_FOLDER = "extractedtexts/"
+TOP_K_PASSAGES = int(os.getenv("SEARCH_TOP_K_PASSAGES", "3"))  #passages returned per document
+TOP_DOCUMENTS = int(os.getenv("SEARCH_TOP_DOCUMENTS", "5"))     #documents returned, their passages compete for the prompt
+DOCUMENT_SCORE_THRESHOLD = 50
+PASSAGE_SCORE_THRESHOLD = 45
+NO_ANSWER = "Sorry, I couldn't generate an answer."
 
-#search documents in S3 using fuzzy matching
+#search documents using the per-user inverted index (no S3 calls at query time)
+@timed("search")
 def search_documents(query: str, email: str):
-    documents = get_s3_documents(email)
-    #print(f"\n Fetched {len(documents)} documents for {email}: {documents}")
+    index = get_or_build_index(email)
+    candidates = index.candidates(query)
+
+    # A document can also match on its name alone, its lines may share no trigrams with the query.
+    # Those are scored on all their lines, like before the index
+    doc_names = list(index.docs)
+    name_scores = score_strings(query, [re.sub(r"^.*?_", "", doc_name) for doc_name in doc_names],
+                                score_cutoff=DOCUMENT_SCORE_THRESHOLD + 1)
+    for doc_name, name_score in zip(doc_names, name_scores):
+        if name_score and doc_name not in candidates:
+            candidates[doc_name] = list(range(len(index.get_lines(doc_name))))
+    print(f"\nIndex candidates for {email}: {len(candidates)} of {len(index.docs)} documents")
 
     results = []
 
-    for doc_name in documents:
-        s3_key = f"{EXTRACTED_TEXTS_FOLDER}{doc_name}"
-        file_content = get_s3_file_content(s3_key)
-        print(f"\nReading file: {s3_key}")
-        print(f"Content size: {len(file_content)} characters")
-
-        if not file_content.strip():
-            print("Skipping empty file.")
-            continue
-
-        lines = file_content.split("\n")
-        top_score = 0
-
-        doc_name_without_email = re.sub(r"^.*?_", "", doc_name)
-        name_score = fuzz.partial_ratio(query, doc_name_without_email)
-        top_score = max(top_score, name_score)
-
-        for line in lines:
-            line_score = fuzz.partial_ratio(query, line)
-            if line_score > top_score:
-                top_score = line_score
-        print(f"Top score for {doc_name}: {top_score}")
-
-        if top_score > 50:
-            relevant_text = extract_relevant_text(file_content, query)
-            if relevant_text:
-                print(f"[DEBUG] Relevant text extracted for {doc_name}: {relevant_text[:100]}...")
+    # One batch for the whole query: each document's name followed by its candidate lines
+    batch = []
+    spans = []
+    for doc_name, line_nos in candidates.items():
+        start = len(batch)
+        batch.append(re.sub(r"^.*?_", "", doc_name))
+        batch.extend(index.get_lines(doc_name, line_nos))
+        spans.append((doc_name, line_nos, start, len(batch)))
+
+    #scores at or under the passage threshold never matter, so rapidfuzz can stop early on them
+    scores = score_strings(query, batch, score_cutoff=PASSAGE_SCORE_THRESHOLD + 1)
+
+    for doc_name, line_nos, start, end in spans:
+        doc_scores = scores[start:end]
+        top_score = int(doc_scores.max())
+        if VERBOSE:
+            print(f"Top score for {doc_name}: {top_score}")
+
+        if top_score > DOCUMENT_SCORE_THRESHOLD:
+            lines = index.get_lines(doc_name)
+            # Dense per-line scores reused by the passage pass instead of rescanning the lines
+            line_scores = np.zeros(len(lines), dtype=np.uint8)
+            line_scores[line_nos] = doc_scores[1:]
+
+            text = index.get_text(doc_name)
+            passages = extract_relevant_passages(text, index.get_chunks(doc_name), line_scores)
+            if passages:
+                relevant_text = "\n...\n".join(passage["text"] for passage in passages)
+                if VERBOSE:
+                    print(f"[DEBUG] {len(passages)} passages extracted for {doc_name}: {relevant_text[:100]}...")
                 results.append({
                     "document_name": doc_name,
                     "relevant_text": relevant_text,
+                    "passages": passages,
                     "score": top_score
                     })
 
     results.sort(key=lambda x: x["score"], reverse=True)
-    top_results = results[:5]
-    print(f"\nReturning {len(top_results)} matching documents.")
-    return results
-
-
-#Function to extract relevant text for the query
-def extract_relevant_text(doc_text: str, query: str) -> str:
-    lines = doc_text.split("\n")
-    for line in lines:
-        if fuzz.partial_ratio(query, line) > 45:
-            return doc_text  #Send full document if any match found
-    #return ""
-
-# function to generate an answer from the relevant document content
-def generate_answer(relevant_text: str, query: str, search_results: list):
-    context = ""
-    for result in search_results:
-        context += f"Document: {result['document_name']}\nText: {result['relevant_text'][:1000]}\n\n"
-
-    # Create the prompt for the LLM
-    prompt = f"Answer the following question based on the text below. The documents involved are:\n{context}\nQuestion: {query}\nAnswer:"
-    print(f"[DEBUG] LLM Prompt: {prompt}")
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json",
-    }
-
-    data = {
-        "model": "claude-3-opus-20240229",  
-        "max_tokens": 1000,
-        "temperature": 0.2,
-        "system": "You are a helpful assistant that answers questions based on text.",
-        "messages": [{"role": "user", "content": prompt}]
-    }
+    top_results = results[:TOP_DOCUMENTS]
+    print(f"\nReturning {len(top_results)} of {len(results)} matching documents.")
+    return top_results
+
+
+#Function to pick the top-k passages of a document for the query
+def extract_relevant_passages(doc_text: str, chunks: list, line_scores: np.ndarray, top_k: int = TOP_K_PASSAGES) -> list:
+    #A passage scores as its best line, reusing the line scores from the search pass instead of rescanning
+    scored = []
+    for chunk in chunks:
+        score = int(line_scores[chunk["line_start"]:chunk["line_end"]].max(initial=0))
+        if score > PASSAGE_SCORE_THRESHOLD:
+            scored.append((score, chunk))
+
+    # Best first, earlier passage wins a tie
+    scored.sort(key=lambda item: (-item[0], item[1]["start"]))
+
+    passages = []
+    for score, chunk in scored[:top_k]:
+        passages.append({
+            "text": doc_text[chunk["start"]:chunk["end"]],
+            "score": score,
+            "start": chunk["start"],
+            "end": chunk["end"],
+            "page_start": chunk["page_start"],
+            "page_end": chunk["page_end"],
+        })
+    return passages
+
+
+ANSWER_SYSTEM_PROMPT = "You are a helpful assistant that answers questions based on text."
+
+
+# function to generate an answer from the packed context (context_builder.build_answer_context)
+def generate_answer(context: dict):
+    """
+    Returns (answer, usage), usage is the context's packing counters plus the API's token counts.
+    """
+    prompt = context["prompt"]
+    if VERBOSE:
+        print(f"[DEBUG] LLM Prompt: {prompt}")
 
     try:
-        response = requests.post(ANTHROPIC_API_URL, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
+        result = anthropic_client.messages(
+            system=ANSWER_SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=1000,
+            temperature=0.2,
+        )
+        usage = record_prompt_tokens(context["usage"], result.get("usage"))
 
         if 'content' in result and isinstance(result['content'], list):
             answer = result['content'][0].get('text', '')
-            return answer.strip()
+            return answer.strip(), usage
         else:
             print("Error: Invalid response structure")
-            return "Sorry, I couldn't generate an answer."
+            return NO_ANSWER, usage
     except requests.exceptions.RequestException as e:
         print(f"Error generating answer: {e}")
-        return "Sorry, I couldn't generate an answer."
\ No newline at end of file
+        return NO_ANSWER, record_prompt_tokens(context["usage"])
+
+
+def stream_answer(context: dict, usage: dict = None):
+    """
+    Same answer as generate_answer, yielded piece by piece as the model writes it (for /search_answer/stream).
+    usage, when given, is filled like generate_answer's once the stream has finished.
+    """
+    prompt = context["prompt"]
+    if VERBOSE:
+        print(f"[DEBUG] LLM Prompt: {prompt}")
+    api_usage = {}
+    try:
+        yield from anthropic_client.stream_messages(
+            system=ANSWER_SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=1000,
+            temperature=0.2,
+            usage=api_usage,
+        )
+    finally:
+        if usage is not None:
+            usage.update(record_prompt_tokens(context["usage"], api_usage))
@@ -0,0 +1,188 @@
+'''Two-tier cache for extracted texts read from S3.
+
+Tier 1 is an in-memory LRU capped by bytes, tier 2 is an optional spill directory on local disk
+(S3_CACHE_DIR) that entries evicted from memory are written to. Entries keep the S3 ETag and
+LastModified they were fetched with, so s3_utils can revalidate them with a conditional GET
+instead of downloading the body again.
+
+For multiple replicas would put a shared cache (Redis/ElastiCache) in front of this instead.'''
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+S3_CACHE_MAX_BYTES = int(os.getenv("S3_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+S3_CACHE_DIR = os.getenv("S3_CACHE_DIR")  #disk tier is off unless this is set
+S3_CACHE_DISK_MAX_BYTES = int(os.getenv("S3_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class CacheEntry:
+    def __init__(self, content: str, etag: str, last_modified: str, size: int):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+
+
+class TextCache:
+    def __init__(self, max_bytes: int = S3_CACHE_MAX_BYTES, disk_dir: str = S3_CACHE_DIR,
+                 disk_max_bytes: int = S3_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()  #key -> CacheEntry, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "revalidations": 0,   #conditional GETs answered with 304 Not Modified
+            "stale": 0,           #cached entries replaced because the object changed
+            "evictions": 0,
+            "bytes_downloaded": 0,
+        }
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key: str):
+        """
+        Returns (entry, tier) looking in memory first, then disk, without checking freshness.
+        tier is "memory", "disk" or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, "memory"
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._put_memory(key, entry)
+            return entry, "disk"
+        return None, None
+
+    def put(self, key: str, content: str, etag: str, last_modified: str, size: int):
+        entry = CacheEntry(content, etag, last_modified, size)
+        self._put_memory(key, entry)
+        return entry
+
+    def invalidate(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        if self.disk_dir:
+            for path in self._disk_paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def record(self, stat: str, amount: int = 1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._entries)
+            stats["memory_bytes"] = self._bytes
+            stats["memory_max_bytes"] = self.max_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _put_memory(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            # Too big to keep in memory, keep it on disk only
+            self._write_disk(key, entry)
+            return
+
+        spilled = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+
+            while self._bytes > self.max_bytes:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._bytes -= old_entry.size
+                self.stats["evictions"] += 1
+                spilled.append((old_key, old_entry))
+
+        # Disk writes happen outside the lock
+        for old_key, old_entry in spilled:
+            self._write_disk(old_key, old_entry)
+
+    def _disk_paths(self, key: str):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.disk_dir, digest)
+        return f"{base}.txt", f"{base}.json"
+
+    def _write_disk(self, key: str, entry: CacheEntry):
+        if not self.disk_dir:
+            return
+        text_path, meta_path = self._disk_paths(key)
+        try:
+            with open(f"{text_path}.tmp", "w", encoding="utf-8") as f:
+                f.write(entry.content)
+            os.replace(f"{text_path}.tmp", text_path)
+            with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"key": key, "etag": entry.etag, "last_modified": entry.last_modified,
+                           "size": entry.size}, f)
+            os.replace(f"{meta_path}.tmp", meta_path)
+            self._trim_disk()
+        except OSError as e:
+            print(f"[S3 cache] Could not spill {key} to disk: {e}")
+
+    def _read_disk(self, key: str):
+        if not self.disk_dir:
+            return None
+        text_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(text_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("key") != key:
+            return None
+        return CacheEntry(content, meta["etag"], meta["last_modified"], meta["size"])
+
+    def _trim_disk(self):
+        # Drop the least recently written files once the spill directory is over its cap
+        files = []
+        total = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".txt"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+            total += stat.st_size
+
+        files.sort()
+        for _, path, size in files:
+            if total <= self.disk_max_bytes:
+                break
+            for victim in (path, f"{path[:-4]}.json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+
+
+text_cache = TextCache()
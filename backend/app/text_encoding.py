@@ -0,0 +1,181 @@
+'''Compressed storage format for extracted texts, with a page/line offset sidecar.
+
+The text object keeps its "extractedtexts/{email}_{filename}.txt" key and is stored with
+Content-Encoding gzip (or zstd), each page compressed as an independent gzip member / zstd frame.
+Concatenated members decompress to the whole text, so full reads only decode the body, and a single
+page is one S3 range GET of its member. The sidecar ("textoffsets/{name}.json") records where each
+page starts in the object, in the text and in its lines:
+    {"version": 1, "encoding": "gzip", "raw_bytes": ..., "stored_bytes": ...,
+     "byte_offsets": [...],   #start of each page's member in the object, plus the object size
+     "char_offsets": [...],   #start of each page in the text (chunker.page_offsets)
+     "line_offsets": [...]}   #line number each page starts on
+Objects written before this (plain UTF-8, no Content-Encoding, no sidecar) are read as they are.
+
+TEXT_COMPRESSION picks the encoding for new objects: gzip (default), zstd (needs the zstandard
+package) or none. Readers decode whatever Content-Encoding the object was stored with.'''
+import gzip
+import io
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TEXT_COMPRESSION = os.getenv("TEXT_COMPRESSION", "gzip").lower()
+TEXT_GZIP_LEVEL = int(os.getenv("TEXT_GZIP_LEVEL", "6"))
+TEXT_ZSTD_LEVEL = int(os.getenv("TEXT_ZSTD_LEVEL", "10"))
+TEXT_SIDECAR_FOLDER = "textoffsets/"
+SIDECAR_VERSION = 1
+
+_stats_lock = threading.Lock()
+_stats = {
+    "objects_written": 0,
+    "raw_bytes_written": 0,      #UTF-8 size of the texts
+    "stored_bytes_written": 0,   #size of the objects actually stored
+    "full_reads": 0,
+    "page_reads": 0,             #pages read on their own with a range GET
+    "bytes_downloaded": 0,       #bodies as transferred from S3 (compressed for new objects)
+    "bytes_decoded": 0,          #the same bodies once decompressed
+    "bytes_skipped_by_range": 0, #stored bytes of the other pages, not downloaded thanks to range GETs
+}
+
+
+def _zstd():
+    # Optional dependency, only needed to write or read zstd objects
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd text storage needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def storage_encoding(encoding: str = None) -> str:
+    # "none" is stored without a Content-Encoding
+    encoding = (encoding or TEXT_COMPRESSION).lower()
+    if encoding not in ("gzip", "zstd", "none"):
+        raise ValueError(f"Unknown TEXT_COMPRESSION {encoding!r}, expected gzip, zstd or none")
+    return encoding
+
+
+def sidecar_key(text_s3_key: str) -> str:
+    return f"{TEXT_SIDECAR_FOLDER}{text_s3_key.split('/')[-1]}.json"
+
+
+def _compress_page(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=TEXT_GZIP_LEVEL, mtime=0)  #mtime=0 keeps identical texts identical
+    if encoding == "zstd":
+        return _zstd().ZstdCompressor(level=TEXT_ZSTD_LEVEL).compress(data)
+    return data
+
+
+def encode_pages(pages: list, encoding: str = None):
+    """
+    Returns (body, sidecar) for the text "".join(pages), each page compressed on its own.
+    """
+    encoding = storage_encoding(encoding)
+    parts = []
+    byte_offsets, char_offsets, line_offsets = [], [], []
+    position = chars = lines = raw_bytes = 0
+    for page in pages:
+        data = page.encode("utf-8")
+        part = _compress_page(data, encoding)
+        byte_offsets.append(position)
+        char_offsets.append(chars)
+        line_offsets.append(lines)
+        parts.append(part)
+        position += len(part)
+        chars += len(page)
+        lines += page.count("\n")
+        raw_bytes += len(data)
+    byte_offsets.append(position)
+
+    body = b"".join(parts)
+    sidecar = {
+        "version": SIDECAR_VERSION,
+        "encoding": encoding,
+        "raw_bytes": raw_bytes,
+        "stored_bytes": len(body),
+        "byte_offsets": byte_offsets,
+        "char_offsets": char_offsets,
+        "line_offsets": line_offsets,
+    }
+    with _stats_lock:
+        _stats["objects_written"] += 1
+        _stats["raw_bytes_written"] += raw_bytes
+        _stats["stored_bytes_written"] += len(body)
+    return body, sidecar
+
+
+def content_encoding_header(encoding: str):
+    # Value for the S3 Content-Encoding of a stored text, None for plain objects
+    return None if encoding == "none" else encoding
+
+
+def decode_body(body: bytes, content_encoding: str = None, ranged: bool = False) -> bytes:
+    """
+    Decompresses an extracted text object (or a range of whole pages of it) by its Content-Encoding.
+    Objects without one are plain UTF-8 and returned as they are.
+    """
+    encoding = (content_encoding or "").lower()
+    if not body or encoding in ("", "identity"):
+        data = body
+    elif encoding == "gzip":
+        data = gzip.decompress(body)  #handles concatenated members
+    elif encoding == "zstd":
+        reader = _zstd().ZstdDecompressor().stream_reader(io.BytesIO(body), read_across_frames=True)
+        data = reader.read()
+    else:
+        raise ValueError(f"Unsupported Content-Encoding {content_encoding!r} on extracted text")
+
+    with _stats_lock:
+        _stats["page_reads" if ranged else "full_reads"] += 1
+        _stats["bytes_downloaded"] += len(body)
+        _stats["bytes_decoded"] += len(data)
+    return data
+
+
+def page_ranges(sidecar: dict, page_numbers) -> list:
+    """
+    Groups the requested 1-based page numbers into contiguous runs and returns
+    [(first_page, last_page, byte_start, byte_end)] with byte_end exclusive, one S3 range GET each.
+    Page numbers outside the document are ignored.
+    """
+    offsets = sidecar["byte_offsets"]
+    count = len(offsets) - 1
+    pages = sorted({page for page in page_numbers if 1 <= page <= count})
+    runs = []
+    for page in pages:
+        if runs and runs[-1][1] == page - 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [(first, last, offsets[first - 1], offsets[last]) for first, last in runs]
+
+
+def split_range(sidecar: dict, first_page: int, last_page: int, body: bytes) -> dict:
+    # Decodes the pages of one range GET body, each member on its own -> {page_number: text}
+    offsets = sidecar["byte_offsets"]
+    base = offsets[first_page - 1]
+    pages = {}
+    for page in range(first_page, last_page + 1):
+        part = body[offsets[page - 1] - base:offsets[page] - base]
+        pages[page] = decode_body(part, content_encoding_header(sidecar["encoding"]), ranged=True).decode("utf-8")
+    return pages
+
+
+def record_skipped(stored_bytes: int):
+    with _stats_lock:
+        _stats["bytes_skipped_by_range"] += stored_bytes
+
+
+def get_text_storage_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["compression_ratio"] = (round(stats["stored_bytes_written"] / stats["raw_bytes_written"], 4)
+                                  if stats["raw_bytes_written"] else None)
+    #share of the decoded bytes that didn't have to be transferred
+    stats["transfer_savings"] = (round(1 - stats["bytes_downloaded"] / stats["bytes_decoded"], 4)
+                                 if stats["bytes_decoded"] else None)
+    return stats
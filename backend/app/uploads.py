@@ -0,0 +1,163 @@
+'''Bounded-memory handling of uploaded files.
+
+Starlette spools every form file to a SpooledTemporaryFile (in memory up to 1 MB, on disk above), so the
+PDF is already on disk when /upload_document/ runs. Instead of reading it into one bytes object, every
+stage reads that same file independently:
+    sha256            1 MB chunks with os.pread
+    upload to S3      multipart upload (S3_TRANSFER_CONFIG) from a pread reader, at most
+                      S3_MULTIPART_CONCURRENCY parts of S3_MULTIPART_CHUNKSIZE in memory
+    text extraction   PyMuPDF opens a read-only mmap of the file, pages come from the page cache; large
+                      PDFs split across worker processes have each worker open the file by path
+None of them move the shared file position, so they can run at the same time on different threads.
+Peak memory per upload is then the multipart buffers (about 2 x S3_MULTIPART_CONCURRENCY parts, ~55 MB with
+the defaults, see benchmarks/upload_memory_bench.py) plus the extracted text, whatever the
+size of the PDF; UPLOAD_MAX_BYTES caps the size on disk.'''
+import hashlib
+import io
+import mmap
+import os
+from contextlib import contextmanager
+
+from boto3.s3.transfer import TransferConfig
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MB = 1024 * 1024
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "500")) * MB
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "16")) * MB  #smaller files go in one PUT
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8")) * MB   #part size, S3 minimum is 5 MB
+S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))        #parts in flight per upload
+
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+    max_concurrency=S3_MULTIPART_CONCURRENCY,
+    use_threads=True,
+)
+# Parts read from the file but not sent yet (s3transfer defaults to 10), the real cap on upload memory
+S3_TRANSFER_CONFIG.max_in_memory_upload_chunks = S3_MULTIPART_CONCURRENCY
+
+HASH_CHUNK_SIZE = MB
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class PreadFile(io.RawIOBase):
+    # Read-only view of a file descriptor with its own position, os.pread never touches the fd's offset
+    def __init__(self, fd: int, size: int):
+        self._fd = fd
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def readinto(self, buffer):
+        data = os.pread(self._fd, min(len(buffer), max(0, self._size - self._pos)), self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class UploadSource:
+    """
+    One uploaded file, read concurrently by the ingestion stages without copying it into memory.
+    file_data is the spooled file of an UploadFile (or any real file), or bytes for callers that
+    already hold the content (jobs re-run from memory, tests).
+    """
+
+    def __init__(self, file_data):
+        self._hash = None
+        if isinstance(file_data, (bytes, bytearray, memoryview)):
+            self._file = None
+            self._data = file_data
+            self.size = len(file_data)
+            return
+        self._data = None
+        self._file = file_data
+        self._fd = file_data.fileno()  #a SpooledTemporaryFile still in memory is written to disk here
+        file_data.flush()              #rollover leaves the bytes in the file's write buffer
+        self.size = os.fstat(self._fd).st_size
+
+    def reader(self):
+        # A new independent reader for each consumer (S3 upload, hashing)
+        if self._file is None:
+            return io.BytesIO(self._data)
+        return io.BufferedReader(PreadFile(self._fd, self.size), buffer_size=HASH_CHUNK_SIZE)
+
+    def sha256(self) -> str:
+        if self._hash is None:
+            digest = hashlib.sha256()
+            if self._file is None:
+                digest.update(self._data)
+            else:
+                reader = PreadFile(self._fd, self.size)
+                buffer = bytearray(HASH_CHUNK_SIZE)
+                view = memoryview(buffer)
+                while n := reader.readinto(view):
+                    digest.update(view[:n])
+            self._hash = digest.hexdigest()
+        return self._hash
+
+    def path(self):
+        """
+        A path other processes (the PDF extraction workers) can open this file by, without a copy:
+        /proc/<pid>/fd/<fd> on Linux, the spooled file has no name of its own. None elsewhere or for bytes.
+        """
+        if self._file is None:
+            return None
+        path = f"/proc/{os.getpid()}/fd/{self._fd}"
+        return path if os.path.exists(path) else None
+
+    @contextmanager
+    def buffer(self):
+        """
+        The whole file as a bytes-like object for PyMuPDF: a memoryview of a read-only mmap for files
+        on disk, so the pages are read lazily from the page cache instead of the Python heap.
+        """
+        if self._file is None or self.size == 0:
+            yield self._data if self._file is None else b""
+            return
+        mapped = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            try:
+                view.release()
+                mapped.close()
+            except BufferError:
+                pass  #still exported by a document that failed mid-way, unmapped when that is collected
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def open_upload(file_data) -> UploadSource:
+    """
+    Wraps an uploaded file and enforces UPLOAD_MAX_BYTES before any processing starts.
+    """
+    source = UploadSource(file_data)
+    if source.size > UPLOAD_MAX_BYTES:
+        source.close()
+        raise UploadTooLarge(f"File is {source.size // MB} MB, the limit is {UPLOAD_MAX_BYTES // MB} MB.")
+    return source
@@ -8,28 +8,129 @@ import requests
 from dotenv import load_dotenv
 import re
 from app.database import insert_invoice_data, insert_purchase_order_data
+from app.anthropic_client import anthropic_client
+from app.metrics import VERBOSE, timed
 import json
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 load_dotenv()
 
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
-def extract_text_from_pdf(file_data) -> str:
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "50"))  #smaller PDFs aren't worth the process hop
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "10"))
+
+_pdf_pool = None
+
+def _pdf_bytes(file_data) -> bytes:
+    # Accepts raw bytes, a memoryview (mmap of an uploaded file, see uploads.py) or a file-like object
+    if isinstance(file_data, (bytes, bytearray, memoryview)):
+        return file_data
+    if hasattr(file_data, "getvalue"):
+        return file_data.getvalue()
+    return file_data.read()
+
+
+def iter_pdf_pages(file_data, start: int = 0, stop: int = None):
     """
-    Extracts text from a PDF document.
+    Lazily yields (page_number, text) for the pages of a PDF, page_number is 1-based.
+    start/stop select a 0-based page range, like range(). file_data can also be a path.
     """
     # Use PyMuPDF (fitz) to extract text from the file-like object.
-    document = fitz.open(stream=file_data, filetype="pdf")
-    text = ""
+    if isinstance(file_data, str):
+        document = fitz.open(file_data, filetype="pdf")
+    else:
+        document = fitz.open(stream=file_data, filetype="pdf")
+    try:
+        stop = document.page_count if stop is None else min(stop, document.page_count)
+        for page_num in range(start, stop):
+            page = document.load_page(page_num)
+            yield page_num + 1, page.get_text()  # Extract text from each page
+    finally:
+        document.close()
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> list:
+    # Runs in a worker process, each worker opens the file itself and reads only its pages
+    return [text for _, text in iter_pdf_pages(path, start, stop)]
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        # Spawned, not forked: this process already runs threads (uvicorn, stage pools)
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+
+@contextmanager
+def _shared_path(file_content, path: str = None):
+    # Workers get a path instead of the bytes, so the PDF is never copied once per page range.
+    # Content without a file (bulk archive members) is written to a temp file once
+    if path is not None:
+        yield path
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(file_content)
+    try:
+        yield f.name
+    finally:
+        os.remove(f.name)
+
+
+def extract_pages_parallel(file_data, workers: int = None, path: str = None) -> list:
+    """
+    Splits the PDF into contiguous page ranges and extracts them across worker processes.
+    path is where the workers can open the same PDF (see uploads.UploadSource.path), if any.
+    Returns the page texts in page order.
+    """
+    file_content = _pdf_bytes(file_data)
+    with fitz.open(stream=file_content, filetype="pdf") as document:
+        page_count = document.page_count
+
+    workers = workers or PDF_EXTRACT_WORKERS
+    range_size = max(PDF_PAGES_PER_TASK, -(-page_count // workers))  #ceil division
+    ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
 
-    for page_num in range(document.page_count):
-        page = document.load_page(page_num)
-        text += page.get_text()  # Extract text from each page
+    pool = _get_pdf_pool()
+    with _shared_path(file_content, path) as shared_path:
+        futures = [pool.submit(_extract_page_range, shared_path, start, stop) for start, stop in ranges]
+        pages = []
+        for future in futures:
+            pages.extend(future.result())
+    return pages
+
+
+@timed("pdf_extract")
+def extract_pages_from_pdf(file_data, parallel: bool = True, path: str = None) -> list:
+    """
+    Extracts the text of each page of a PDF document, in page order.
+    Large PDFs (PDF_PARALLEL_MIN_PAGES or more) are split across worker processes when parallel is True,
+    path is a path of the same file the workers can open (else they get a temp file copy).
+    Pass parallel=False from code that already runs inside a worker process.
+    """
+    file_content = _pdf_bytes(file_data)
+    if parallel and PDF_EXTRACT_WORKERS > 1:
+        with fitz.open(stream=file_content, filetype="pdf") as document:
+            page_count = document.page_count
+        if page_count >= PDF_PARALLEL_MIN_PAGES:
+            return extract_pages_parallel(file_content, path=path)
+
+    return [text for _, text in iter_pdf_pages(file_content)]
+
+
+def extract_text_from_pdf(file_data) -> str:
+    """
+    Extracts text from a PDF document.
+    """
+    # Single join at the end instead of growing a string page by page
+    return "".join(extract_pages_from_pdf(file_data))
 
-    return text
 
 def extract_invoice_details_with_anthropic(text: str, document_type: str):
     """
@@ -89,7 +190,8 @@ def process_extracted_data(extracted_text: str, document_type: str):
     """
     # Clean up
     extracted_text = extracted_text.strip()
-    print(f"Stripped text: {extracted_text}")
+    if VERBOSE:
+        print(f"Stripped text: {extracted_text}")
     
     # convert to json
     extracted_data = {}
@@ -134,24 +236,13 @@ def process_extracted_data(extracted_text: str, document_type: str):
 
 def call_anthropic(prompt: str, document_type: str):
 
-    headers = {
-        "x-api-key": ANTHROPIC_API_KEY,
-        "anthropic-version": "2023-06-01",
-        "content-type": "application/json",
-    }
-
-    data = {
-        "model": "claude-3-opus-20240229",
-        "max_tokens": 1000,
-        "temperature": 0,
-        "system": "You are a document extraction expert.",
-        "messages": [{"role": "user", "content": prompt}]
-    }
-
     try:
-        response = requests.post(ANTHROPIC_API_URL, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
+        result = anthropic_client.messages(
+            system="You are a document extraction expert.",
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=1000,
+            temperature=0,
+        )
         #print(f"Anthropic Full API response: {result}")
 
         if 'content' in result and isinstance(result['content'], list):
@@ -166,22 +257,38 @@ def call_anthropic(prompt: str, document_type: str):
         print(f"Error calling Anthropic API: {e}")
         return None
 
-def extract_data_based_on_type(text: str, document_type: str, email: str, document_name: str):
+def store_extracted_data(extracted_data: dict, document_type: str, writer=None):
+    #writer is an optional database.BatchWriter, rows are then flushed in micro-batches instead of one insert each
+    if document_type == "invoice":
+        if writer is not None:
+            writer.add(document_type, extracted_data)
+        else:
+            insert_invoice_data(extracted_data)
+    elif document_type == "purchase order":
+        if writer is not None:
+            writer.add(document_type, extracted_data)
+        else:
+            insert_purchase_order_data(extracted_data)
+
+
+def extract_data_based_on_type(text: str, document_type: str, email: str, document_name: str, writer=None):
     print(f"Document type passed on: {document_type}")
     if document_type == "invoice":
         print(f"Extracting invoice details for {email} from {document_name}")
         extracted_data = extract_invoice_details_with_anthropic(text, document_type)
         extracted_data["email"] = email
         extracted_data["document_name"] = document_name
-        print(f"Extracted invoice data sent: {extracted_data}")
-        insert_invoice_data(extracted_data)
+        if VERBOSE:
+            print(f"Extracted invoice data sent: {extracted_data}")
+        store_extracted_data(extracted_data, document_type, writer)
     elif document_type == "purchase order":
         print(f"Extracting purchase order details for {email} from {document_name}")
         extracted_data = extract_purchase_order_details_with_anthropic(text, document_type)
         extracted_data["email"] = email
         extracted_data["document_name"] = document_name
-        print(f"Extracted purchase order data sent: {extracted_data}")
-        insert_purchase_order_data(extracted_data)
+        if VERBOSE:
+            print(f"Extracted purchase order data sent: {extracted_data}")
+        store_extracted_data(extracted_data, document_type, writer)
     else:
         extracted_data = {}
 
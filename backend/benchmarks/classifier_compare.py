@@ -0,0 +1,96 @@
+'''Accuracy vs latency of the classifier backends on a labeled sample set.
+
+For each backend: load time, per-document latency (p50/p95/mean) of the zero-shot call,
+zero-shot accuracy, and how many documents fall under CONFIDENCE_THRESHOLD (those would be
+sent to the Anthropic fallback in production, which costs an LLM call each).
+
+Usage (from backend/):
+  python -m benchmarks.classifier_compare --backends pytorch quantized onnx
+  python -m benchmarks.classifier_compare --samples my_samples.jsonl --output results.json
+Sample files are JSON lines: {"label": "invoice", "text": "..."}'''
+import argparse
+import json
+import os
+import statistics
+import time
+
+from app.classifier import candidate_labels, CONFIDENCE_THRESHOLD
+from app.classifier_backends import load_zero_shot_pipeline, BACKENDS, CLASSIFIER_MODEL
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(__file__), "data", "classifier_samples.jsonl")
+
+
+def load_samples(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def evaluate(backend: str, model_name: str, samples: list, repeats: int) -> dict:
+    started = time.perf_counter()
+    classifier = load_zero_shot_pipeline(backend, model_name)
+    load_seconds = time.perf_counter() - started
+
+    classifier(samples[0]["text"], candidate_labels)  #warm-up, not timed
+
+    latencies = []
+    correct = 0
+    correct_confident = 0
+    below_threshold = 0
+    for sample in samples:
+        for i in range(repeats):
+            t = time.perf_counter()
+            result = classifier(sample["text"], candidate_labels)
+            latencies.append(time.perf_counter() - t)
+        top_label, top_score = result["labels"][0], result["scores"][0]
+        correct += top_label == sample["label"]
+        if top_score < CONFIDENCE_THRESHOLD:
+            below_threshold += 1
+        elif top_label == sample["label"]:
+            correct_confident += 1
+
+    return {
+        "backend": backend,
+        "model": model_name,
+        "samples": len(samples),
+        "load_seconds": round(load_seconds, 3),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "latency_mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "accuracy": round(correct / len(samples), 4),
+        # Accuracy of what zero-shot answers on its own; the rest goes to the Anthropic fallback
+        "confident_accuracy": round(correct_confident / max(1, len(samples) - below_threshold), 4),
+        "fallback_rate": round(below_threshold / len(samples), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--model", default=CLASSIFIER_MODEL)
+    parser.add_argument("--samples", default=DEFAULT_SAMPLES)
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per sample")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    results = []
+    for backend in args.backends:
+        try:
+            results.append(evaluate(backend, args.model, samples, args.repeats))
+        except Exception as e:
+            results.append({"backend": backend, "error": str(e)})
+        print(json.dumps(results[-1]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+'''Concurrency benchmark: /documents latency on its own and while uploads are in progress.
+
+Two phases against a running server:
+  - idle:     only GET /documents?email=..., --rate requests per second for --seconds
+  - uploads:  the same /documents load while --uploaders clients post a generated PDF to /upload_document/
+              back to back
+
+/documents requests are sent on a fixed schedule (open loop) and timed from when they were due, so a
+stalled event loop shows up as latency instead of as fewer requests. Reports p50/p95/p99/max per phase
+and how many uploads finished. Before app/executors.py a single upload blocked the worker's event loop
+for its whole duration and p99 went up to the upload time; now both phases should be about the same.
+
+Usage (from backend/): python -m benchmarks.concurrency_bench --base-url http://localhost:8000 --email bench@example.com
+Run the server with a single worker (uvicorn app.main:app --workers 1) so both loads hit the same event loop.
+Uploads go through the full pipeline, so the server needs its S3, database and Anthropic configuration.'''
+import argparse
+import io
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import requests
+
+
+def make_pdf(pages: int) -> bytes:
+    document = fitz.open()
+    for number in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Invoice INV-{number:05d}\nVendor: Bench Supplies\nTotal: ${number * 10}.00\n"
+                         + "Line item, quantity and amount.\n" * 40)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 1),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 1),
+    }
+
+
+def poll_documents(base_url: str, email: str, rate: float, seconds: float) -> dict:
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    session = requests.Session()
+
+    def one(due: float):
+        nonlocal errors
+        try:
+            status = session.get(f"{base_url}/documents", params={"email": email}, timeout=120).status_code
+        except requests.RequestException:
+            status = None
+        with lock:
+            latencies.append(time.perf_counter() - due)  #from when it was due, not when a thread got to it
+            if status not in (200, 404):
+                errors += 1
+
+    interval = 1 / rate
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        n = 0
+        while (due := started + n * interval) < started + seconds:
+            time.sleep(max(0.0, due - time.perf_counter()))
+            pool.submit(one, due)
+            n += 1
+    return {**percentiles(latencies), "errors": errors}
+
+
+def upload_loop(base_url: str, email: str, pdf: bytes, stop: threading.Event, results: list, worker: int):
+    session = requests.Session()
+    n = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = session.post(f"{base_url}/upload_document/",
+                                    files={"file": (f"bench_{worker}_{n}.pdf", io.BytesIO(pdf), "application/pdf")},
+                                    data={"email": email}, timeout=600)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        results.append({"seconds": time.perf_counter() - started, "ok": ok})
+        n += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", default="bench@example.com")
+    parser.add_argument("--rate", type=float, default=20, help="/documents requests per second")
+    parser.add_argument("--seconds", type=float, default=30, help="duration of each phase")
+    parser.add_argument("--uploaders", type=int, default=4, help="concurrent upload clients in the second phase")
+    parser.add_argument("--pages", type=int, default=30, help="pages of the uploaded PDF")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    base_url = args.base_url.rstrip("/")
+    pdf = make_pdf(args.pages)
+
+    idle = poll_documents(base_url, args.email, args.rate, args.seconds)
+    print(f"idle:    {idle}")
+
+    stop = threading.Event()
+    uploads = []
+    uploaders = [threading.Thread(target=upload_loop, args=(base_url, args.email, pdf, stop, uploads, i), daemon=True)
+                 for i in range(args.uploaders)]
+    for thread in uploaders:
+        thread.start()
+    time.sleep(1)  #let the first uploads get going
+    loaded = poll_documents(base_url, args.email, args.rate, args.seconds)
+    stop.set()
+    for thread in uploaders:
+        thread.join()
+    print(f"uploads: {loaded}")
+
+    results = {
+        "rate_per_second": args.rate,
+        "seconds_per_phase": args.seconds,
+        "uploaders": args.uploaders,
+        "documents_idle": idle,
+        "documents_during_uploads": loaded,
+        "uploads": {
+            **percentiles([u["seconds"] for u in uploads]),
+            "failed": sum(not u["ok"] for u in uploads),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
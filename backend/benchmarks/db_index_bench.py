@@ -0,0 +1,158 @@
+'''Index benchmark: query plans and timings of the per-user queries on a large synthetic table,
+before and after the indexes of migration 1 (app/migrations.py).
+
+Builds invoices and purchase_orders copies with --rows rows each (spread over --users users) in a
+scratch schema, so the app's own tables are never touched, then runs EXPLAIN (ANALYZE, BUFFERS) for:
+  - user_first_page:    /get_key_details first page (WHERE user_email ORDER BY id LIMIT n)
+  - user_keyset_page:   a later page with the keyset cursor (id > last id)
+  - user_offset_page:   the same page with OFFSET, for comparison
+  - user_all_rows:      every row of one user (the old unpaginated /get_key_details)
+  - document_lookup:    get_invoice_by_document (WHERE document_name AND user_email)
+
+Usage (from backend/): python -m benchmarks.db_index_bench --rows 2000000 --users 5000
+Needs DATABASE_URL pointing at a postgres where the user may create schemas. Generating 2M rows takes a minute or two.'''
+import argparse
+import json
+import time
+
+from app.migrations import MIGRATIONS
+from app.models import engine
+
+SCHEMA = "index_bench"
+
+CREATE_TABLES = f"""
+    CREATE TABLE {SCHEMA}.invoices (
+        id SERIAL PRIMARY KEY,
+        created_at TIMESTAMP NOT NULL,
+        date DATE NOT NULL,
+        invoice_number VARCHAR NOT NULL,
+        vendor_name VARCHAR NOT NULL,
+        total_amount TEXT NOT NULL,
+        user_email VARCHAR NOT NULL,
+        document_name VARCHAR NOT NULL
+    );
+    CREATE TABLE {SCHEMA}.purchase_orders (
+        id SERIAL PRIMARY KEY,
+        created_at TIMESTAMP NOT NULL,
+        order_date DATE NOT NULL,
+        purchase_order_number VARCHAR NOT NULL,
+        supplier_name VARCHAR NOT NULL,
+        total_amount TEXT NOT NULL,
+        user_email VARCHAR NOT NULL,
+        document_name VARCHAR NOT NULL
+    );
+"""
+
+# Rows of one user are spread over the whole table, like uploads from many users interleaving over time
+FILL_INVOICES = f"""
+    INSERT INTO {SCHEMA}.invoices (created_at, date, invoice_number, vendor_name, total_amount, user_email, document_name)
+    SELECT now() - (i || ' minutes')::interval, DATE '2020-01-01' + (i %% 1800), 'INV-' || i, 'Vendor ' || (i %% 700),
+           '$' || (i %% 10000) || '.00', 'user' || (i %% %(users)s) || '@example.com', 'invoice_' || i || '.pdf'
+    FROM generate_series(1, %(rows)s) AS i
+"""
+FILL_PURCHASE_ORDERS = f"""
+    INSERT INTO {SCHEMA}.purchase_orders (created_at, order_date, purchase_order_number, supplier_name, total_amount, user_email, document_name)
+    SELECT now() - (i || ' minutes')::interval, DATE '2020-01-01' + (i %% 1800), 'PO-' || i, 'Supplier ' || (i %% 700),
+           '$' || (i %% 10000) || '.00', 'user' || (i %% %(users)s) || '@example.com', 'po_' || i || '.pdf'
+    FROM generate_series(1, %(rows)s) AS i
+"""
+
+
+def queries(users: int, rows: int, page_size: int):
+    email = f"user{users // 2}@example.com"
+    per_user = rows // users
+    # id of roughly the 3rd page of that user, what a client would send back as the cursor
+    cursor_id = (users // 2) + users * page_size * 3
+    document = f"invoice_{(users // 2) + users * (per_user // 2)}.pdf"
+    return {
+        "user_first_page": ("SELECT id, document_name, date, total_amount, vendor_name FROM invoices "
+                            "WHERE user_email = %s AND id > 0 ORDER BY id LIMIT %s", (email, page_size)),
+        "user_keyset_page": ("SELECT id, document_name, date, total_amount, vendor_name FROM invoices "
+                             "WHERE user_email = %s AND id > %s ORDER BY id LIMIT %s", (email, cursor_id, page_size)),
+        "user_offset_page": ("SELECT id, document_name, date, total_amount, vendor_name FROM invoices "
+                             "WHERE user_email = %s ORDER BY id LIMIT %s OFFSET %s", (email, page_size, page_size * 3)),
+        "user_all_rows": ("SELECT document_name, order_date, total_amount, supplier_name FROM purchase_orders "
+                          "WHERE user_email = %s", (email,)),
+        "document_lookup": ("SELECT document_name, date, total_amount, vendor_name FROM invoices "
+                            "WHERE document_name = %s AND user_email = %s", (document, email)),
+    }
+
+
+def explain(cursor, sql: str, params) -> dict:
+    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+    plan = [row[0] for row in cursor.fetchall()]
+    execution_ms = next((float(line.split(":")[1].split()[0]) for line in plan if line.startswith("Execution Time")), None)
+    return {"plan": plan, "execution_ms": execution_ms}
+
+
+def run_all(cursor, label: str, named_queries: dict) -> dict:
+    results = {}
+    for name, (sql, params) in named_queries.items():
+        explain(cursor, sql, params)  #warm the cache so both runs compare plans, not disk reads
+        results[name] = explain(cursor, sql, params)
+        print(f"\n=== {label}: {name} ({results[name]['execution_ms']} ms) ===")
+        print("\n".join(results[name]["plan"]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000, help="rows per table")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schema afterwards")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    pooled = engine.raw_connection()
+    conn = pooled.dbapi_connection  #the psycopg2 connection, autocommit set on the pool's proxy wouldn't reach it
+    conn.rollback()  #the pool's pre-ping may have opened a transaction, autocommit can't be switched inside one
+    conn.autocommit = True  #CREATE INDEX CONCURRENTLY, same as the migration
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+        cursor.execute(f"SET search_path TO {SCHEMA}")
+        cursor.execute(CREATE_TABLES)
+
+        started = time.perf_counter()
+        cursor.execute(FILL_INVOICES, {"rows": args.rows, "users": args.users})
+        cursor.execute(FILL_PURCHASE_ORDERS, {"rows": args.rows, "users": args.users})
+        cursor.execute("ANALYZE invoices; ANALYZE purchase_orders")
+        print(f"Generated 2 x {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        named_queries = queries(args.users, args.rows, args.page_size)
+        before = run_all(cursor, "before indexes", named_queries)
+
+        index_seconds = {}
+        _, _, statements, _ = next(m for m in MIGRATIONS if m[0] == 1)
+        for statement in statements:
+            started = time.perf_counter()
+            cursor.execute(statement)  #unqualified table names resolve to the scratch schema
+            index_seconds[statement.split("IF NOT EXISTS", 1)[1].split()[0]] = round(time.perf_counter() - started, 2)
+        cursor.execute("ANALYZE invoices; ANALYZE purchase_orders")
+
+        after = run_all(cursor, "after indexes", named_queries)
+
+        summary = {
+            "rows_per_table": args.rows,
+            "users": args.users,
+            "index_build_seconds": index_seconds,
+            "execution_ms": {name: {"before": before[name]["execution_ms"], "after": after[name]["execution_ms"]}
+                             for name in named_queries},
+        }
+        print("\n" + json.dumps(summary, indent=2))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({**summary, "plans": {"before": before, "after": after}}, f, indent=2)
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute("RESET search_path")
+        cursor.close()
+        conn.autocommit = False  #back to the pool's default
+        pooled.close()
+
+
+if __name__ == "__main__":
+    main()
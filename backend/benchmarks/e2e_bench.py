@@ -0,0 +1,368 @@
+'''End-to-end benchmark of the whole app, offline: the real FastAPI app under uvicorn with local stand-ins
+for its services (benchmarks/fakes.py): moto S3 (or --s3-endpoint for MinIO), a throwaway Postgres
+(pgserver or initdb/pg_ctl, or --database-url) and a fake Anthropic API with --llm-latency-ms per call.
+The classifier is the real zero-shot model (--classifier-backend, default pytorch, see classifier_backends.py;
+its model is downloaded on first use), --classifier-backend llm sends every document to the fake API
+instead, which measures the pipeline without the model. The answer cache is off.
+
+The corpus is synthetic invoices and purchase orders from documents.make_client_invoice, converted
+with documents.doc_to_pdf (LibreOffice if installed, reportlab otherwise). Every document is different,
+so none are skipped as duplicates. For each corpus size in --corpus-sizes:
+  - upload:   the documents missing to reach that size, --upload-concurrency at a time, async_mode=true,
+              polled on /jobs/{id}: docs per second, end-to-end seconds and the per-stage timings the
+              jobs report (upload_original, extract_text, upload_text, classify, extract_data)
+  - search:   /search_answer/ for the --queries, per route (sql = answered from postgres, llm = fuzzy
+              search + answer) with the llm route's prompt tokens, search_documents alone (in process),
+              GET /documents and /get_key_details
+The server side per-stage timings (/metrics/stages) are included at the end of the run.
+Results are JSON (--output). With --baseline, p50 latencies and docs/s are compared to a previous
+results file and the run exits 1 when any got worse by more than --max-regression (0.25 = 25%).
+
+Needs the benchmark extras on top of requirements.txt: moto, python-docx and pgserver (or a Postgres
+install with initdb/pg_ctl on PATH). The model backends need transformers/torch from requirements.txt.
+
+Usage (from backend/): python -m benchmarks.e2e_bench --corpus-sizes 10 50 100 --output e2e.json
+                       python -m benchmarks.e2e_bench --baseline e2e.json --max-regression 0.25'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, redirect_stdout
+
+import requests
+
+from benchmarks.fakes import FakeAnthropic, free_port, local_postgres, s3_stand_in
+
+EMAIL = "bench@example.com"
+STAGES = ["upload_original", "extract_text", "upload_text", "classify", "extract_data"]
+CLIENTS = ["Elon", "Ada", "Grace", "Linus", "Margaret", "Alan", "Barbara", "Dennis", "Frances", "Ken"]
+PRODUCTS = ["Falcon", "Starship", "Dragon", "Raptor", "Merlin", "Cygnus", "Orion", "Kestrel"]
+DEFAULT_QUERIES = [
+    "How many invoices do I have?",
+    "What is the total amount of my purchase orders?",
+    "How many units of Falcon did Elon order?",
+    "What is the unit price of Starship?",
+    "Which purchase orders are for Raptor?",
+]
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "max_ms": round(ordered[-1] * 1000, 1),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 1),
+    }
+
+
+def make_corpus(count: int, output_dir: str, seed: int) -> list:
+    """
+    Returns [(filename, pdf_path, kind)], alternating invoices and purchase orders.
+    """
+    from documents import make_client_invoice, doc_to_pdf
+
+    rng = random.Random(seed)
+    corpus = []
+    for n in range(count):
+        kind = "invoice" if n % 2 == 0 else "purchase order"
+        name = f"{CLIENTS[n % len(CLIENTS)]}-{n:05d}"
+        number = f"{'INV' if kind == 'invoice' else 'PO'}-{n:05d}"
+        date = f"2024-{1 + n % 12:02d}-{1 + n % 28:02d}"
+        with redirect_stdout(sys.stderr):
+            docx_path = make_client_invoice(name, rng.choice(PRODUCTS), rng.randint(1, 500),
+                                            round(rng.uniform(10, 50000), 2), kind=kind, number=number,
+                                            date=date, output_dir=output_dir)
+            pdf_path = doc_to_pdf(docx_path)
+        corpus.append((os.path.basename(pdf_path), pdf_path, kind))
+    return corpus
+
+
+@contextmanager
+def run_api(port: int):
+    # The app reads its configuration on import, the environment has to be set up before this
+    import uvicorn
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The app failed to start")
+        time.sleep(0.05)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+
+def wait_ready(base_url: str, timeout: float):
+    # The classifier model loads in the background at startup, uploads would otherwise time its load
+    deadline = time.perf_counter() + timeout
+    while True:
+        response = requests.get(f"{base_url}/ready", timeout=30)
+        if response.ok:
+            return
+        classifier = response.json()["components"]["classifier"]
+        if classifier["status"] == "error" or time.perf_counter() > deadline:
+            raise RuntimeError(f"The app isn't ready: {response.json()['components']}")
+        time.sleep(0.5)
+
+
+def upload_documents(base_url: str, documents: list, concurrency: int, timeout: float) -> dict:
+    session = requests.Session()
+    lock = threading.Lock()
+    stage_seconds = {stage: [] for stage in STAGES}
+    totals, failures = [], []
+
+    def one(document):
+        filename, path, _ = document
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            response = session.post(f"{base_url}/upload_document/", data={"email": EMAIL, "async_mode": "true"},
+                                    files={"file": (filename, f, "application/pdf")}, timeout=timeout)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        while True:
+            job = session.get(f"{base_url}/jobs/{job_id}", timeout=timeout).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            if time.perf_counter() - started > timeout:
+                job = {"status": "failed", "error": "timed out", "stages": {}}
+                break
+            time.sleep(0.02)
+        with lock:
+            if job["status"] != "completed":
+                failures.append({"filename": filename, "error": job.get("error")})
+                return
+            totals.append(time.perf_counter() - started)
+            for stage, info in job["stages"].items():
+                if stage in stage_seconds and "seconds" in info:
+                    stage_seconds[stage].append(info["seconds"])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, documents))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "documents": len(documents),
+        "failed": len(failures),
+        "failures": failures[:5],
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(len(totals) / elapsed, 3) if elapsed else None,
+        "end_to_end": percentiles(totals),
+        "stages": {stage: percentiles(seconds) for stage, seconds in stage_seconds.items() if seconds},
+    }
+
+
+def timed(call, repeats: int) -> list:
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def measure_search(base_url: str, queries: list, repeats: int) -> dict:
+    from app.search import search_documents
+
+    session = requests.Session()
+    by_route, statuses, prompt_tokens = {}, {}, []
+    for query in queries:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            response = session.post(f"{base_url}/search_answer/", json={"query": query, "email": EMAIL}, timeout=120)
+            elapsed = time.perf_counter() - started
+            if response.ok:
+                route = response.json().get("route", "unknown")
+                statuses[query] = route
+                usage = response.json().get("usage") or {}
+                if usage.get("prompt_tokens"):
+                    prompt_tokens.append(usage["prompt_tokens"])
+            else:
+                route = f"http_{response.status_code}"
+                statuses[query] = f"{route}: {response.json().get('detail')}"
+            by_route.setdefault(route, []).append(elapsed)
+
+    return {
+        "search_answer": {route: percentiles(samples) for route, samples in by_route.items()},
+        "query_routes": statuses,
+        #input tokens of the llm route's answer prompts, as the API counted them
+        "prompt_tokens": {"count": len(prompt_tokens), "mean": round(statistics.mean(prompt_tokens), 1),
+                          "max": max(prompt_tokens)} if prompt_tokens else {},
+        "search_documents": percentiles([s for query in queries
+                                         for s in timed(lambda: search_documents(query, EMAIL), repeats)]),
+        "documents_list": percentiles(timed(
+            lambda: session.get(f"{base_url}/documents", params={"email": EMAIL}, timeout=60).raise_for_status(),
+            repeats * 4)),
+        "key_details": percentiles(timed(
+            lambda: session.get(f"{base_url}/get_key_details", params={"email": EMAIL}, timeout=60).raise_for_status(),
+            repeats * 4)),
+    }
+
+
+def flatten(results: dict) -> dict:
+    """
+    The metrics compared with --baseline: {name: (value, higher_is_better)}.
+    """
+    metrics = {}
+    for size, run in results["corpus_sizes"].items():
+        upload = run["upload"]
+        if upload.get("docs_per_second"):
+            metrics[f"{size}.upload.docs_per_second"] = (upload["docs_per_second"], True)
+        for stage, stats in upload["stages"].items():
+            metrics[f"{size}.upload.{stage}.p50_ms"] = (stats["p50_ms"], False)
+        for route, stats in run["search"]["search_answer"].items():
+            metrics[f"{size}.search_answer.{route}.p50_ms"] = (stats["p50_ms"], False)
+        for name in ("search_documents", "documents_list", "key_details"):
+            if run["search"][name]:
+                metrics[f"{size}.{name}.p50_ms"] = (run["search"][name]["p50_ms"], False)
+    return metrics
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for name, (value, higher_is_better) in current.items():
+        if name not in previous or not previous[name][0]:
+            continue
+        before = previous[name][0]
+        change = (before - value) / before if higher_is_better else (value - before) / before
+        if change > max_regression:
+            regressions.append({"metric": name, "baseline": before, "current": value, "regression": round(change, 3)})
+    return regressions
+
+
+def configure_environment(workdir: str, database_url: str, llm: FakeAnthropic, classifier_backend: str):
+    os.environ.update({
+        "DATABASE_URL": database_url,
+        "ANTHROPIC_API_KEY": "bench",
+        "ANTHROPIC_BASE_URL": llm.url,
+        "ANTHROPIC_REQUESTS_PER_MINUTE": "100000",  #measure the app, not the client-side rate limit
+        "CLASSIFIER_BACKEND": classifier_backend,
+        "ANSWER_CACHE_BACKEND": "off",
+        "SEARCH_INDEX_DIR": os.path.join(workdir, "search_index"),
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--upload-concurrency", type=int, default=8)
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES)
+    parser.add_argument("--repeats", type=int, default=5, help="times each query is sent per corpus size")
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of Anthropic calls answered 529")
+    parser.add_argument("--classifier-backend", default="pytorch", choices=["pytorch", "quantized", "onnx", "llm"],
+                        help="llm = no local model, every document is classified by the fake API")
+    parser.add_argument("--llm-responses", help="JSON file of fixed replies: {\"classify\"|\"extract\"|\"answer\": text}")
+    parser.add_argument("--database-url", help="use this database instead of a throwaway one")
+    parser.add_argument("--s3-endpoint", help="S3-compatible endpoint (MinIO) instead of moto")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per upload job")
+    parser.add_argument("--verbose", action="store_true", help="show the app's output instead of logging it to a file")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of a previous run to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args()
+
+    responses = None
+    if args.llm_responses:
+        with open(args.llm_responses) as f:
+            responses = json.load(f)
+    sizes = sorted(set(args.corpus_sizes))
+
+    with ExitStack() as stack:
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="e2e-bench-"))
+        print(f"Generating {sizes[-1]} documents...", file=sys.stderr)
+        started = time.perf_counter()
+        corpus = make_corpus(sizes[-1], workdir, args.seed)
+        generation_seconds = time.perf_counter() - started
+
+        database_url = stack.enter_context(local_postgres(args.database_url))
+        llm = stack.enter_context(FakeAnthropic(args.llm_latency_ms, args.llm_jitter_ms, args.llm_error_rate,
+                                                responses=responses, seed=args.seed))
+        configure_environment(workdir, database_url, llm, args.classifier_backend)
+        stack.enter_context(s3_stand_in(args.s3_endpoint))
+
+        log_path = os.path.join(workdir, "app.log")
+        if not args.verbose:
+            #the app prints a lot, keep it out of the results
+            stack.enter_context(redirect_stdout(stack.enter_context(open(log_path, "w"))))
+        base_url = stack.enter_context(run_api(free_port()))
+        print(f"Waiting for the {args.classifier_backend} classifier...", file=sys.stderr)
+        started = time.perf_counter()
+        wait_ready(base_url, args.timeout)
+        ready_seconds = time.perf_counter() - started
+
+        results = {
+            "config": {
+                "corpus_sizes": sizes, "upload_concurrency": args.upload_concurrency, "repeats": args.repeats,
+                "llm_latency_ms": args.llm_latency_ms, "llm_jitter_ms": args.llm_jitter_ms,
+                "llm_error_rate": args.llm_error_rate, "classifier_backend": args.classifier_backend,
+                "s3": args.s3_endpoint or "moto",
+                "database": "external" if args.database_url else "local",
+                "cpu_count": os.cpu_count(),
+            },
+            "corpus_generation_seconds": round(generation_seconds, 2),
+            "ready_seconds": round(ready_seconds, 2),
+            "corpus_sizes": {},
+        }
+        uploaded = 0
+        for size in sizes:
+            print(f"Corpus size {size}: uploading {size - uploaded} documents...", file=sys.stderr)
+            upload = upload_documents(base_url, corpus[uploaded:size], args.upload_concurrency, args.timeout)
+            uploaded = size
+            print(f"Corpus size {size}: searching...", file=sys.stderr)
+            results["corpus_sizes"][str(size)] = {"upload": upload,
+                                                  "search": measure_search(base_url, args.queries, args.repeats)}
+
+        session = requests.Session()
+        results["anthropic"] = {"fake_server": dict(llm.counts),
+                                "client": session.get(f"{base_url}/anthropic/stats", timeout=30).json()}
+        results["executors"] = session.get(f"{base_url}/executors/stats", timeout=30).json()
+        results["stage_metrics"] = session.get(f"{base_url}/metrics/stages", timeout=30).json()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("classifier_backend") != args.classifier_backend:
+            print(f"Warning: the baseline ran with classifier backend {baseline.get('config', {}).get('classifier_backend')}, "
+                  f"this run with {args.classifier_backend}", file=sys.stderr)
+        regressions = compare(results, baseline, args.max_regression)
+        results["regressions"] = regressions
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        for regression in regressions:
+            print(f"Regression: {regression['metric']} {regression['baseline']} -> {regression['current']}",
+                  file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+'''Local stand-ins for the external services, so benchmarks run with no network:
+
+  - FakeAnthropic:   HTTP server speaking the Messages API (JSON and streaming SSE) with a configurable
+                     latency, jitter and overload (529) rate. Answers are canned: classification returns
+                     the document type, extraction returns the JSON the prompts ask for with the fields
+                     read from the document text, anything else gets a short answer. Any of them can be
+                     replaced with fixed text (responses={"classify"|"extract"|"answer": "..."}).
+  - local_postgres:  a throwaway Postgres cluster, from the pgserver package (pip install pgserver, ships
+                     its own binaries) or initdb/pg_ctl on PATH, or an existing database URL.
+  - s3_stand_in:     moto's in-process S3, or any S3-compatible endpoint (MinIO) with the app's bucket created.'''
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AWS_REGION = "us-east-2"
+BUCKET_NAME = "gentlyai"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _message_text(body: dict) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [])
+    return "\n".join(parts)
+
+
+def _field(pattern: str, text: str):
+    match = re.search(pattern, text, re.IGNORECASE)
+    return match.group(1).strip() if match else "None"
+
+
+def canned_extraction(prompt: str) -> str:
+    # The same JSON shapes as utils.extract_*_with_anthropic ask for, filled from the synthetic document
+    amounts = re.findall(r"\d[\d,]*\.\d{2}", prompt)
+    total = amounts[-1] if amounts else "None"
+    party = _field(r"Sincerely,\s*(\S+)", prompt)
+    if "purchase order document" in prompt:
+        return json.dumps({
+            "Purchase Order Number": _field(r"Purchase Order Number:\s*(\S+)", prompt),
+            "Order Date": _field(r"Order Date:\s*(\S+)", prompt),
+            "Total Amount": total,
+            "Supplier Name": party,
+        }, indent=4)
+    return json.dumps({
+        "invoice_number": _field(r"Invoice Number:\s*(\S+)", prompt),
+        "invoice_date": _field(r"Invoice Date:\s*(\S+)", prompt),
+        "total_amount": total,
+        "vendor_name": party,
+    }, indent=4)
+
+
+class FakeAnthropic:
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 50, error_rate: float = 0.0,
+                 stream_chunks: int = 8, responses: dict = None, seed: int = 7):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.responses = responses or {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"classify": 0, "extract": 0, "answer": 0, "overloaded": 0}
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = None
+
+    def _kind(self, body: dict) -> str:
+        system = body.get("system") or ""
+        if "classification expert" in system:
+            return "classify"
+        if "extraction expert" in system:
+            return "extract"
+        return "answer"
+
+    def reply(self, body: dict):
+        """
+        Returns (kind, text) for a Messages API request body.
+        """
+        kind = self._kind(body)
+        text = _message_text(body)
+        if kind in self.responses:
+            return kind, self.responses[kind]
+        if kind == "classify":
+            #capitalized like the real API answers, the classifier has to normalize it
+            return kind, "Purchase Order" if "purchase order" in text[:200].lower() else "Invoice"
+        if kind == "extract":
+            return kind, canned_extraction(text)
+        return kind, ("Based on the provided documents, the requested details are listed in the matching "
+                      "invoice, including the product, the number of units and the total price.")
+
+    def _delay(self) -> float:
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _overloaded(self) -> bool:
+        with self._lock:
+            hit = self._random.random() < self.error_rate
+            if hit:
+                self.counts["overloaded"] += 1
+        return hit
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _event(self, event: str, data: dict):
+                chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.rstrip("/") != "/v1/messages":
+                    self._send(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+                    return
+                if fake._overloaded():
+                    self._send(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+                               {"retry-after": "0"})
+                    return
+
+                kind, text = fake.reply(body)
+                with fake._lock:
+                    fake.counts[kind] += 1
+                input_tokens = max(1, len(_message_text(body) + (body.get("system") or "")) // 4)
+                output_tokens = max(1, len(text) // 4)
+                delay = fake._delay()
+
+                if not body.get("stream"):
+                    time.sleep(delay)
+                    self._send(200, {
+                        "id": f"msg_{uuid.uuid4().hex[:24]}", "type": "message", "role": "assistant",
+                        "model": body.get("model"), "stop_reason": "end_turn",
+                        "content": [{"type": "text", "text": text}],
+                        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+                    })
+                    return
+
+                # Streaming: the latency is time to first token, then the text in stream_chunks deltas
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(delay)
+                self._event("message_start", {"type": "message_start", "message": {
+                    "id": f"msg_{uuid.uuid4().hex[:24]}", "type": "message", "role": "assistant", "content": [],
+                    "model": body.get("model"), "usage": {"input_tokens": input_tokens, "output_tokens": 0}}})
+                self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                    "content_block": {"type": "text", "text": ""}})
+                size = max(1, -(-len(text) // fake.stream_chunks))
+                for start in range(0, len(text), size):
+                    time.sleep(delay / fake.stream_chunks / 4)
+                    self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                        "delta": {"type": "text_delta", "text": text[start:start + size]}})
+                self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                self._event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                              "usage": {"output_tokens": output_tokens}})
+                self._event("message_stop", {"type": "message_stop"})
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-anthropic", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@contextmanager
+def local_postgres(database_url: str = None):
+    """
+    Yields a SQLAlchemy/psycopg2 URL of an empty database, removed afterwards (unless database_url was given).
+    """
+    if database_url:
+        yield database_url
+        return
+
+    try:
+        import pgserver
+    except ImportError:
+        pgserver = None
+
+    with tempfile.TemporaryDirectory(prefix="bench-pg-") as data_dir:
+        if pgserver is not None:
+            server = pgserver.get_server(data_dir, cleanup_mode="stop")
+            try:
+                # postgresql://postgres:@/postgres?host=<socket dir>
+                yield server.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1)
+            finally:
+                server.cleanup()
+            return
+
+        initdb, pg_ctl = shutil.which("initdb"), shutil.which("pg_ctl")
+        if not (initdb and pg_ctl):
+            raise RuntimeError("No local Postgres: pip install pgserver, put initdb/pg_ctl on PATH, "
+                               "or pass --database-url")
+        cluster = os.path.join(data_dir, "data")
+        subprocess.run([initdb, "-D", cluster, "-U", "postgres", "--auth=trust"], check=True,
+                       stdout=subprocess.DEVNULL)
+        # Unix socket only, in the temp dir, so it never clashes with a server already running
+        subprocess.run([pg_ctl, "-D", cluster, "-w", "-l", os.path.join(data_dir, "postgres.log"),
+                        "-o", f"-k {data_dir} -c listen_addresses=''", "start"], check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f"postgresql+psycopg2://postgres@/postgres?host={data_dir}"
+        finally:
+            subprocess.run([pg_ctl, "-D", cluster, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+
+
+@contextmanager
+def s3_stand_in(endpoint_url: str = None):
+    """
+    moto's in-process S3 (default) or an S3-compatible endpoint, with the app's bucket created.
+    Call before the app creates its boto3 client.
+    """
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    import boto3
+
+    if endpoint_url:
+        os.environ["AWS_ENDPOINT_URL_S3"] = endpoint_url
+        client = boto3.client("s3", region_name=AWS_REGION)
+        try:
+            client.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        except client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+        yield client
+        return
+
+    from moto import mock_aws
+    with mock_aws():
+        client = boto3.client("s3", region_name=AWS_REGION)
+        client.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": AWS_REGION})
+        yield client
@@ -0,0 +1,64 @@
+'''Startup benchmark: how long until the API can serve, and how long the classifier takes to load.
+
+Each run is a fresh Python process so nothing is already imported:
+  - import_seconds:          import app.main
+  - first_request_seconds:   first GET / and GET /cache/stats (routes that don't need the classifier)
+  - classifier_load_seconds: loading the zero-shot model (what the background warm-up task does)
+
+Usage (from backend/): python -m benchmarks.startup_bench --runs 3
+Needs the same .env as the app (DATABASE_URL, AWS keys); startup hooks are not run, so no DB is required.'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CHILD = r"""
+import json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+from fastapi.testclient import TestClient
+client = TestClient(app.main.app)  #not used as a context manager, so startup hooks (DB, warm-up) don't run
+first = {}
+for path in ("/", "/cache/stats"):
+    t = time.perf_counter()
+    status = client.get(path).status_code
+    first[path] = {"status": status, "seconds": round(time.perf_counter() - t, 4)}
+
+result = {"import_seconds": round(imported - started, 4), "first_request": first}
+if LOAD_CLASSIFIER:
+    from app.classifier import get_zero_shot_classifier
+    t = time.perf_counter()
+    get_zero_shot_classifier()
+    result["classifier_load_seconds"] = round(time.perf_counter() - t, 4)
+print(json.dumps(result))
+"""
+
+
+def run_once(load_classifier: bool) -> dict:
+    code = f"LOAD_CLASSIFIER = {load_classifier}\n{CHILD}"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--skip-classifier", action="store_true", help="don't measure the model load")
+    args = parser.parse_args()
+
+    runs = [run_once(not args.skip_classifier) for _ in range(args.runs)]
+    summary = {
+        "runs": runs,
+        "import_seconds_median": statistics.median(r["import_seconds"] for r in runs),
+        "first_request_seconds_median": statistics.median(r["first_request"]["/"]["seconds"] for r in runs),
+    }
+    if not args.skip_classifier:
+        summary["classifier_load_seconds_median"] = statistics.median(r["classifier_load_seconds"] for r in runs)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
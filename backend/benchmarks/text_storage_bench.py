@@ -0,0 +1,108 @@
+'''Extracted-text storage benchmark: stored size and bytes transferred per read for each encoding
+of app/text_encoding.py (none = the old plain .txt objects, gzip, zstd when zstandard is installed).
+
+Pages come from --pdf files (extracted with the app's own extraction), or by default from the labeled
+sample texts in benchmarks/data, --samples-per-page of them per page with their numbers varied. For every encoding:
+  - stored_bytes / compression_ratio of the text object, sidecar_bytes
+  - full_read_bytes:   what get_s3_file_content downloads for the whole text
+  - one_page_bytes:    what a single-page range GET downloads, averaged over the pages
+  - encode/decode milliseconds
+No S3 access, the numbers are the object and range sizes S3 would serve.
+
+Usage (from backend/): python -m benchmarks.text_storage_bench [--pdf a.pdf b.pdf] [--pages 50]'''
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+from app.text_encoding import encode_pages, decode_body, content_encoding_header, page_ranges, split_range
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(__file__), "data", "classifier_samples.jsonl")
+
+
+def sample_pages(count: int, per_page: int) -> list:
+    with open(DEFAULT_SAMPLES, "r", encoding="utf-8") as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    # per_page samples make one page (a few KB, like a real one), with different numbers every time
+    # so repeated samples don't compress unrealistically well
+    pages = []
+    for n in range(count):
+        blocks = [re.sub(r"\d", lambda m: str((int(m.group()) + n + i) % 10), texts[(n * per_page + i) % len(texts)])
+                  for i in range(per_page)]
+        pages.append("\n".join(blocks) + "\n")
+    return pages
+
+
+def pdf_pages(paths: list) -> list:
+    from app.utils import extract_pages_from_pdf
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pages.extend(extract_pages_from_pdf(f.read(), parallel=False))
+    return pages
+
+
+def measure(pages: list, encoding: str) -> dict:
+    started = time.perf_counter()
+    body, sidecar = encode_pages(pages, encoding)
+    encode_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    text = decode_body(body, content_encoding_header(encoding)).decode("utf-8")
+    decode_ms = (time.perf_counter() - started) * 1000
+    assert text == "".join(pages)
+
+    one_page = []
+    for number in range(1, len(pages) + 1):
+        (first, last, start, end), = page_ranges(sidecar, [number])
+        assert split_range(sidecar, first, last, body[start:end])[number] == pages[number - 1]
+        one_page.append(end - start)
+
+    return {
+        "stored_bytes": len(body),
+        "compression_ratio": round(len(body) / sidecar["raw_bytes"], 4),
+        "sidecar_bytes": len(json.dumps(sidecar)),
+        "full_read_bytes": len(body),
+        "one_page_bytes": round(statistics.mean(one_page)),
+        "encode_ms": round(encode_ms, 2),
+        "decode_ms": round(decode_ms, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", nargs="*", help="PDFs to take the pages from instead of the sample texts")
+    parser.add_argument("--pages", type=int, default=50, help="pages built from the sample texts")
+    parser.add_argument("--samples-per-page", type=int, default=10)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    pages = pdf_pages(args.pdf) if args.pdf else sample_pages(args.pages, args.samples_per_page)
+    encodings = ["none", "gzip"]
+    try:
+        import zstandard  # noqa: F401
+        encodings.append("zstd")
+    except ImportError:
+        print("zstandard is not installed, skipping zstd", file=sys.stderr)
+
+    results = {
+        "pages": len(pages),
+        "raw_bytes": sum(len(page.encode("utf-8")) for page in pages),
+        "encodings": {encoding: measure(pages, encoding) for encoding in encodings},
+    }
+    plain = results["encodings"]["none"]["full_read_bytes"]
+    for encoding, stats in results["encodings"].items():
+        stats["full_read_savings"] = round(1 - stats["full_read_bytes"] / plain, 4)
+        stats["one_page_savings"] = round(1 - stats["one_page_bytes"] / plain, 4)  #vs downloading the plain text
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
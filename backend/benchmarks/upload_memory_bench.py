@@ -0,0 +1,197 @@
+'''Upload memory benchmark: peak memory of one large PDF going through the upload stages
+(hash, S3 upload of the original, text extraction), old in-memory path vs the streaming path.
+
+  - bytes:      what /upload_document/ used to do, await file.read() into one bytes object, hashlib over it,
+                one io.BytesIO copy for the S3 upload and another for PyMuPDF
+  - streaming:  app/uploads.py, the spooled file is hashed in chunks, uploaded as a multipart upload from a
+                pread reader and opened by PyMuPDF through a read-only mmap, upload and extraction in parallel
+
+Each mode runs in a fresh Python process on the same generated PDF (text pages plus an incompressible
+attachment to reach --size-mb, like the image data of a scan) and reports:
+  - peak_rss_delta_mb:   high-water RSS of the process (VmHWM) minus the RSS after imports
+  - tracemalloc_peak_mb: peak of Python heap allocations during the upload
+  - seconds
+
+Usage (from backend/): python -m benchmarks.upload_memory_bench --size-mb 200 [--s3 sink|moto|aws]
+  sink (default): a local S3 endpoint in its own process that answers the PUT/multipart calls and discards
+                  the bytes, so only the app's memory is measured
+  moto:           S3 mocked in-process, moto's own copy of the stored object is counted too
+  aws:            the real bucket (AWS keys in .env), objects are written under benchmarks/ and deleted'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+
+import fitz
+
+CHILD = r"""
+import hashlib, io, json, os, shutil, tempfile, threading, time, tracemalloc
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://bench@localhost/bench")  #engine is created lazily, no DB needed
+
+def rss_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+
+def run():
+    from app import s3_utils
+    from app.uploads import open_upload
+    from app.utils import extract_pages_from_pdf
+    if S3_MODE == "moto":
+        s3_utils.s3_client.create_bucket(Bucket=s3_utils.BUCKET_NAME,
+                                         CreateBucketConfiguration={"LocationConstraint": s3_utils.AWS_REGION})
+
+    # What starlette hands to the endpoint: the request body spooled to a temporary file
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with open(PDF_PATH, "rb") as f:
+        shutil.copyfileobj(f, spooled)
+    spooled.seek(0)
+
+    key = f"benchmarks/upload_memory_{MODE}.pdf"
+    baseline = rss_mb("VmRSS")
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    if MODE == "bytes":
+        file_content = spooled.read()
+        file_hash = hashlib.sha256(file_content).hexdigest()
+        s3_utils.s3_client.upload_fileobj(io.BytesIO(file_content), s3_utils.BUCKET_NAME, key)
+        pages = extract_pages_from_pdf(io.BytesIO(file_content), parallel=False)
+    else:
+        source = open_upload(spooled)
+        file_hash = source.sha256()
+        upload = threading.Thread(target=s3_utils.upload_file_to_s3, args=(source.reader(), key))
+        upload.start()
+        with source.buffer() as buffer:
+            pages = extract_pages_from_pdf(buffer, parallel=False)
+        upload.join()
+        source.close()
+
+    seconds = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    s3_utils.s3_client.delete_object(Bucket=s3_utils.BUCKET_NAME, Key=key)
+    print(json.dumps({
+        "mode": MODE,
+        "pages": len(pages),
+        "content_hash": file_hash[:12],
+        "peak_rss_delta_mb": round(rss_mb("VmHWM") - baseline, 1),
+        "tracemalloc_peak_mb": round(traced_peak / 1024 / 1024, 1),
+        "seconds": round(seconds, 3),
+    }))
+
+if S3_MODE == "moto":
+    from moto import mock_aws
+    with mock_aws():
+        run()
+else:
+    run()
+"""
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    # Just enough of the S3 API for PutObject, multipart uploads and DeleteObject, bodies are read and dropped
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _drain(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        self._drain()
+        self._reply(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def do_POST(self):
+        self._drain()
+        if self.path.endswith("?uploads") or "?uploads&" in self.path or "&uploads" in self.path:
+            body = (f"<InitiateMultipartUploadResult><UploadId>{uuid.uuid4().hex}</UploadId>"
+                    "</InitiateMultipartUploadResult>")
+        else:
+            body = f'<CompleteMultipartUploadResult><ETag>"{uuid.uuid4().hex}-1"</ETag></CompleteMultipartUploadResult>'
+        self._reply(200, body.encode(), {"Content-Type": "application/xml"})
+
+    def do_DELETE(self):
+        self._drain()
+        self._reply(204)
+
+
+def serve_sink(port: int):
+    ThreadingHTTPServer(("127.0.0.1", port), SinkHandler).serve_forever()
+
+
+def make_pdf(path: str, size_mb: int, pages: int):
+    document = fitz.open()
+    for number in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Page {number + 1}\n" + "Invoice line item, quantity and amount. " * 20)
+    document.embfile_add("scan", os.urandom(size_mb * 1024 * 1024))
+    document.save(path)
+    document.close()
+
+
+def run_once(mode: str, pdf_path: str, s3_mode: str, env: dict) -> dict:
+    code = f"MODE = {mode!r}\nPDF_PATH = {pdf_path!r}\nS3_MODE = {s3_mode!r}\n{CHILD}"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=40, help="keep under PDF_PARALLEL_MIN_PAGES to stay in-process")
+    parser.add_argument("--s3", choices=("sink", "moto", "aws"), default="sink")
+    parser.add_argument("--sink-port", type=int, default=9555)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    sink = None
+    if args.s3 == "sink":
+        sink = Process(target=serve_sink, args=(args.sink_port,), daemon=True)
+        sink.start()
+        env.update({"AWS_ENDPOINT_URL_S3": f"http://127.0.0.1:{args.sink_port}",
+                    "AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench"})
+    elif args.s3 == "moto":
+        env.update({"AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench"})
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            pdf_path = os.path.join(directory, "large.pdf")
+            make_pdf(pdf_path, args.size_mb, args.pages)
+            results = {
+                "file_mb": round(os.path.getsize(pdf_path) / 1024 / 1024, 1),
+                "s3": args.s3,
+                "modes": {mode: run_once(mode, pdf_path, args.s3, env) for mode in ("bytes", "streaming")},
+            }
+    finally:
+        if sink is not None:
+            sink.terminate()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
 import os
+import shutil
 import subprocess
 from docx import Document
 
-def make_client_invoice(name, product, unit, price):
+MAC_SOFFICE = "/Applications/LibreOffice.app/Contents/MacOS/soffice"
+
+def make_client_invoice(name, product, unit, price, kind="invoice", number=None, date=None, output_dir="."):
+    # kind is "invoice" or "purchase order", number/date add the header lines the extraction looks for
     document = Document()
-    document.add_heading('Invoice', 0)
+    document.add_heading(kind.title(), 0)
+
+    if number:
+        document.add_paragraph(f"{kind.title()} Number: {number}")
+    if date:
+        document.add_paragraph(f"{'Invoice' if kind == 'invoice' else 'Order'} Date: {date}")
 
     # Greeting
     p1 = document.add_paragraph('Dear ')
@@ -12,7 +21,7 @@ def make_client_invoice(name, product, unit, price):
     p1.add_run(',')
 
     # Body
-    p2 = document.add_paragraph("Please find the attached invoice for you: ")
+    p2 = document.add_paragraph(f"Please find the attached {kind} for you: ")
     p2.add_run(str(unit)).bold = True
     p2.add_run(' units of ')
     p2.add_run(product).bold = True
@@ -41,23 +50,69 @@ def make_client_invoice(name, product, unit, price):
     document.add_paragraph("Sincerely,")
     document.add_paragraph("Jay")
 
-    docx_path = f"{name}.docx"
+    docx_path = os.path.join(output_dir, f"{name}.docx")
     document.save(docx_path)
     return docx_path
 
-def doc_to_pdf_mac(docx_path):
+def find_soffice():
+    # LibreOffice on PATH (Linux, Windows with it on PATH, Homebrew), or the macOS app bundle
+    for candidate in ("soffice", "libreoffice"):
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return MAC_SOFFICE if os.path.exists(MAC_SOFFICE) else None
+
+def docx_to_pdf_reportlab(docx_path, pdf_path):
+    # Fallback without LibreOffice: lays out the paragraphs and tables of the docx in order.
+    # Not a faithful rendering, but the PDF has the same text for extraction.
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph as PdfParagraph, Spacer, Table as PdfTable, TableStyle
+    from xml.sax.saxutils import escape
+
+    styles = getSampleStyleSheet()
+    source = Document(docx_path)
+    story = []
+    for element in source.element.body.iterchildren():
+        if element.tag.endswith("}p"):
+            paragraph = Paragraph(element, source)
+            if not paragraph.text.strip():
+                story.append(Spacer(1, 8))
+                continue
+            style = styles["Title"] if paragraph.style.name in ("Title", "Heading 1") else styles["Normal"]
+            story.append(PdfParagraph(escape(paragraph.text), style))
+        elif element.tag.endswith("}tbl"):
+            rows = [[cell.text for cell in row.cells] for row in Table(element, source).rows]
+            table = PdfTable(rows)
+            table.setStyle(TableStyle([("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+                                       ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold")]))
+            story.append(table)
+    SimpleDocTemplate(pdf_path, pagesize=A4).build(story)
+
+def doc_to_pdf(docx_path, output_dir=None):
+    # Converts with LibreOffice when it is installed, with reportlab otherwise. Returns the PDF path.
     docx_path = os.path.abspath(docx_path)
-    output_dir = os.path.dirname(docx_path)
-    subprocess.run([
-        "/Applications/LibreOffice.app/Contents/MacOS/soffice",
-        "--headless",
-        "--convert-to", "pdf",
-        "--outdir", output_dir,
-        docx_path
-    ], check=True)
-    print(f"PDF saved to: {docx_path.replace('.docx', '.pdf')}")
+    output_dir = os.path.abspath(output_dir or os.path.dirname(docx_path))
+    pdf_path = os.path.join(output_dir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf")
+
+    soffice = find_soffice()
+    if soffice:
+        subprocess.run([
+            soffice,
+            "--headless",
+            "--convert-to", "pdf",
+            "--outdir", output_dir,
+            docx_path
+        ], check=True, stdout=subprocess.DEVNULL)
+    else:
+        docx_to_pdf_reportlab(docx_path, pdf_path)
+    print(f"PDF saved to: {pdf_path}")
+    return pdf_path
 
 # Example usage
 if __name__ == "__main__":
     docx_file = make_client_invoice("Elon", "Falcon", 10, 12500000)
-    doc_to_pdf_mac(docx_file)
\ No newline at end of file
+    doc_to_pdf(docx_file)
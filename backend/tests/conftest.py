@@ -0,0 +1,13 @@
+'''Unit tests for the pure logic of the backend, no database, S3 or Anthropic needed.
+
+The app reads its configuration on import, so the environment is set here before any app module is
+imported. The engine is created but never connected; tests that touch the database or S3 replace the
+functions they call with monkeypatch.
+
+Run from backend/: python -m pytest'''
+import os
+
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://test@127.0.0.1:1/test")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
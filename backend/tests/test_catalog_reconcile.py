@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from app import catalog_reconcile
+
+
+def test_split_document_key():
+    assert catalog_reconcile.split_document_key("documents/a@example.com_x_y.pdf") == ("a@example.com", "x_y.pdf")
+    assert catalog_reconcile.split_document_key("documents/no-email.pdf") is None
+
+
+def test_backfilled_users_get_their_index_rebuilt(monkeypatch):
+    objects = {
+        "documents/": [{"Key": f"documents/{email}_{name}", "Size": 1, "LastModified": datetime(2024, 1, 1)}
+                       for email, name in (("a@example.com", "x.pdf"), ("b@example.com", "y.pdf"))],
+        "extractedtexts/": [{"Key": "extractedtexts/a@example.com_x.pdf.txt"}],
+    }
+    saved, rebuilt = [], []
+    monkeypatch.setattr(catalog_reconcile, "list_s3_objects", lambda prefix: objects[prefix])
+    monkeypatch.setattr(catalog_reconcile, "save_documents_bulk",
+                        lambda batch: saved.extend(batch) or ["a@example.com"])  #b's entry already existed
+    monkeypatch.setattr(catalog_reconcile, "backfill_document_details", lambda: 0)
+    monkeypatch.setattr(catalog_reconcile, "rebuild_index", rebuilt.append)
+
+    stats = catalog_reconcile.reconcile()
+    assert [entry["text_s3_key"] for entry in saved] == ["extractedtexts/a@example.com_x.pdf.txt", None]
+    assert (stats["inserted"], stats["indexes_rebuilt"]) == (1, 1)
+    assert rebuilt == ["a@example.com"]
+
+    rebuilt.clear()
+    assert catalog_reconcile.reconcile(dry_run=True)["indexes_rebuilt"] == 0
+    assert rebuilt == []
@@ -0,0 +1,58 @@
+import numpy as np
+
+from app.chunker import chunk_text, page_for_offset, page_offsets
+from app.search import extract_relevant_passages
+
+
+def test_page_offsets_and_lookup():
+    starts = page_offsets(["abc", "", "de"])
+    assert starts == [0, 3, 3]
+    assert [page_for_offset(starts, offset) for offset in (0, 2, 3, 4)] == [1, 1, 3, 3]
+    assert page_for_offset([], 5) is None
+
+
+def test_chunks_are_whole_lines_that_cover_the_text():
+    lines = [f"line {n} " + "x" * (n % 7) for n in range(60)]
+    text = "\n".join(lines)
+    chunks = chunk_text(text, size=80, overlap=20)
+
+    assert chunks[0]["start"] == 0 and chunks[-1]["end"] == len(text)
+    for chunk in chunks:
+        assert text[chunk["start"]:chunk["end"]] == "\n".join(lines[chunk["line_start"]:chunk["line_end"]])
+        assert chunk["end"] - chunk["start"] < 80 + max(map(len, lines))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk["line_start"] > previous["line_start"]  #always moves forward
+        assert chunk["line_start"] <= previous["line_end"]   #no line is skipped
+        assert chunk["start"] < previous["end"]             #consecutive windows overlap
+
+
+def test_window_ends_with_the_line_that_reaches_the_size():
+    text = "short\n" + "y" * 500 + "\nend"
+    chunks = chunk_text(text, size=100, overlap=20)
+    assert [(chunk["line_start"], chunk["line_end"]) for chunk in chunks] == [(0, 2), (2, 3)]
+    assert [(chunk["line_start"], chunk["line_end"]) for chunk in chunk_text("a\nb\nc", size=1)] == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_chunks_record_the_pages_they_span():
+    pages = ["page one\n", "page two\n", "page three"]
+    text = "".join(pages)
+    chunks = chunk_text(text, page_offsets(pages), size=1, overlap=0)
+    assert [(chunk["page_start"], chunk["page_end"]) for chunk in chunks] == [(1, 1), (2, 2), (3, 3)]
+    chunks = chunk_text(text, page_offsets(pages), size=12, overlap=0)
+    assert [(chunk["page_start"], chunk["page_end"]) for chunk in chunks] == [(1, 2), (3, 3)]
+    assert chunk_text(text, size=1000)[0]["page_start"] is None
+
+
+def test_empty_text_has_one_empty_chunk():
+    assert chunk_text("") == [{"start": 0, "end": 0, "line_start": 0, "line_end": 1,
+                               "page_start": None, "page_end": None}]
+
+
+def test_extract_relevant_passages_keeps_the_best_chunks():
+    text = "\n".join(["a", "b", "c", "d"])
+    chunks = chunk_text(text, size=1, overlap=0)  #one line each
+    line_scores = np.array([10, 90, 60, 90], dtype=np.uint8)
+
+    passages = extract_relevant_passages(text, chunks, line_scores, top_k=2)
+    assert [(passage["text"], passage["score"]) for passage in passages] == [("b", 90), ("d", 90)]
+    assert extract_relevant_passages(text, chunks, np.zeros(4, dtype=np.uint8)) == []
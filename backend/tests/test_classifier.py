@@ -0,0 +1,35 @@
+import pytest
+
+from app import classifier
+
+
+@pytest.mark.parametrize("reply, label", [
+    ("Invoice", "invoice"),
+    ("Purchase Order", "purchase order"),
+    ("  PURCHASE ORDER.\n", "purchase order"),
+    ("purchase orders", "purchase order"),
+    ('"Contract"', "contract"),
+    ("Receipt", "other"),
+    ("", "other"),
+])
+def test_normalize_label(reply, label):
+    assert classifier.normalize_label(reply) == label
+
+
+def test_llm_reply_is_mapped_onto_the_candidate_labels(monkeypatch):
+    monkeypatch.setattr(classifier, "ANTHROPIC_API_KEY", "test")
+    monkeypatch.setattr(classifier.anthropic_client, "messages",
+                        lambda **kwargs: {"content": [{"type": "text", "text": "Purchase Order"}]})
+    monkeypatch.setattr(classifier, "LLM_ONLY", True)
+    assert classifier.classify_document("PO-1 from Globex") == "purchase order"
+
+
+def test_llm_failures_are_not_labels(monkeypatch):
+    def fail(**kwargs):
+        raise RuntimeError("overloaded")
+
+    monkeypatch.setattr(classifier, "ANTHROPIC_API_KEY", "test")
+    monkeypatch.setattr(classifier.anthropic_client, "messages", fail)
+    assert classifier.anthropic_fallback_classification("text") == "Error"
+    monkeypatch.setattr(classifier, "ANTHROPIC_API_KEY", None)
+    assert classifier.anthropic_fallback_classification("text") == "No API key found"
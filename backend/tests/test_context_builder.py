@@ -0,0 +1,75 @@
+from app.context_builder import (_merged_text, build_answer_context, count_tokens, pack_passages,
+                                 record_prompt_tokens)
+
+
+def passage(text, start, score, page=None):
+    return {"text": text, "start": start, "end": start + len(text), "score": score, "page_start": page, "page_end": page}
+
+
+def result(document_name, score, *passages):
+    return {"document_name": document_name, "score": score, "passages": list(passages)}
+
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+    assert count_tokens("total due") == 2
+    assert count_tokens("INV-20240042") == 1 + 1 + 3    #word, dash, digits in runs of three
+    assert count_tokens("internationalization") == 3   #one extra token per 8 letters
+
+
+def test_merged_text_sends_the_overlap_once():
+    text = "abcdefghij"
+    assert _merged_text([(4, 9, text[4:9]), (0, 6, text[0:6])]) == "abcdefghi"
+    assert _merged_text([(0, 4, text[0:4]), (4, 8, text[4:8])]) == "abcdefgh"   #touching
+    assert _merged_text([(0, 8, text[0:8]), (2, 5, text[2:5])]) == "abcdefgh"   #contained
+
+
+def test_overlapping_passages_are_merged():
+    text = "one two three four five six"
+    spans, usage = pack_passages([result("a.txt", 90, passage(text[0:13], 0, 90, 1), passage(text[8:23], 8, 80, 2))])
+    assert [(span["text"], span["page_start"], span["page_end"], span["score"]) for span in spans] == [
+        (text[0:23], 1, 2, 90)]
+    assert (usage["passages_packed"], usage["passages_merged"]) == (1, 1)
+
+
+def test_contained_passage_is_a_duplicate():
+    spans, usage = pack_passages([result("a.txt", 90, passage("one two three", 0, 90), passage("two", 4, 70))])
+    assert len(spans) == 1
+    assert usage["passages_duplicate"] == 1
+
+
+def test_passages_that_do_not_fit_are_dropped_best_first():
+    results = [result("a.txt", 90, passage("alpha " * 10, 0, 60)),
+               result("b.txt", 80, passage("beta " * 10, 0, 95))]
+    spans, usage = pack_passages(results, budget=25)
+    assert [span["document_name"] for span in spans] == ["b.txt"]
+    assert usage["passages_dropped"] == 1
+    assert usage["context_tokens"] <= 25
+
+
+def test_best_passage_is_truncated_rather_than_sending_nothing():
+    spans, usage = pack_passages([result("a.txt", 90, passage("word " * 200, 0, 90))], budget=30)
+    assert usage["truncated"] is True
+    assert 0 < spans[0]["tokens"] <= 30
+    assert spans[0]["end"] == len(spans[0]["text"])
+
+
+def test_build_answer_context_tags_sources_in_prompt_order():
+    results = [result("a.txt", 70, passage("Total amount 42", 100, 70, 3), passage("Vendor Acme", 0, 60, 1)),
+               result("b.txt", 90, passage("Invoice INV-7", 0, 90))]
+    context = build_answer_context("what is the total?", results)
+
+    assert [(source["tag"], source["document_name"], source["start"]) for source in context["sources"]] == [
+        ("S1", "b.txt", 0), ("S2", "a.txt", 0), ("S3", "a.txt", 100)]
+    prompt = context["prompt"]
+    assert prompt.index("[S1] Document: b.txt\nInvoice INV-7") < prompt.index("[S2] Document: a.txt (page 1)")
+    assert "[S3] Document: a.txt (page 3)\nTotal amount 42" in prompt
+    assert prompt.endswith("Question: what is the total?\nAnswer:")
+    assert context["usage"]["prompt_tokens_estimated"] == count_tokens(prompt)
+
+
+def test_record_prompt_tokens_prefers_the_api_count():
+    usage = {"prompt_tokens_estimated": 120}
+    assert record_prompt_tokens(usage, {"input_tokens": 131, "output_tokens": 9}) == {
+        "prompt_tokens_estimated": 120, "prompt_tokens": 131, "output_tokens": 9}
+    assert record_prompt_tokens(usage) == usage
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+from app import database
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append(sql.split(" (")[0] if params else sql)
+        if params is not None and params[0] in self.conn.bad:
+            raise ValueError(f"bad row {params[0]}")
+        if params is not None:
+            self.conn.inserted.append(params)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.statements = []
+        self.inserted = []
+        self.commits = self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.inserted = []
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # execute_values fails the whole batch when any row is bad, like one multi-row INSERT would
+    def execute_values(cursor, sql, rows, page_size=None):
+        for row in rows:
+            if row[0] in cursor.conn.bad:
+                raise ValueError("batch failed")
+        cursor.conn.inserted.extend(rows)
+
+    conn = FakeConnection()
+    monkeypatch.setattr(database, "connect_db", lambda: conn)
+    monkeypatch.setattr(database, "execute_values", execute_values)
+    return conn
+
+
+def records(*names):
+    return [{"document_name": name} for name in names]
+
+
+def test_batch_is_inserted_in_one_transaction(db):
+    rows = [("a", 1), ("b", 2)]
+    results = database._insert_bulk("invoices", ("name", "n"), rows, records("a.pdf", "b.pdf"))
+
+    assert [(r["index"], r["document_name"], r["ok"], r["error"]) for r in results] == [
+        (0, "a.pdf", True, None), (1, "b.pdf", True, None)]
+    assert db.inserted == rows
+    assert (db.commits, db.rollbacks, db.closed) == (1, 0, True)
+
+
+def test_failed_batch_is_retried_row_by_row(db):
+    db.bad = {"b"}
+    rows = [("a", 1), ("b", 2), ("c", 3)]
+    results = database._insert_bulk("invoices", ("name", "n"), rows, records("a.pdf", "b.pdf", "c.pdf"))
+
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert results[1]["error"] == "bad row b"
+    assert db.inserted == [("a", 1), ("c", 3)]
+    assert db.statements.count("SAVEPOINT bulk_row") == 3
+    assert db.statements.count("ROLLBACK TO SAVEPOINT bulk_row") == 1
+    assert (db.commits, db.rollbacks, db.closed) == (1, 1, True)
+
+
+def test_no_connection_fails_every_record(monkeypatch):
+    monkeypatch.setattr(database, "connect_db", lambda: None)
+    results = database._insert_bulk("invoices", ("name",), [("a",), ("b",)], records("a.pdf", "b.pdf"))
+    assert [(r["ok"], r["error"]) for r in results] == [(False, "Unable to connect to the database")] * 2
+
+
+def test_no_rows_needs_no_connection(monkeypatch):
+    monkeypatch.setattr(database, "connect_db", lambda: pytest.fail("connected for nothing"))
+    assert database._insert_bulk("invoices", ("name",), [], []) == []
+
+
+def test_batch_writer_flushes_when_full(db):
+    writer = database.BatchWriter(max_batch=2, max_wait=3600)
+    writer.add("invoice", {"document_name": "a.pdf", "invoice_number": "1"})
+    assert db.commits == 0
+    writer.add("purchase order", {"document_name": "b.pdf", "purchase_order_number": "2"})
+    assert db.commits == 2  #one transaction per table
+    assert [r["document_name"] for r in writer.results] == ["a.pdf", "b.pdf"]
+    assert writer.flush() == []
+
+
+def test_batch_writer_flushes_a_lone_row_once_it_is_old(db):
+    writer = database.BatchWriter(max_batch=100, max_wait=0.05)
+    writer.add("invoice", {"document_name": "a.pdf", "invoice_number": "1"})
+    assert db.commits == 0
+    deadline = time.monotonic() + 5
+    while not writer.results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [r["document_name"] for r in writer.results] == ["a.pdf"]
+    assert db.commits == 1
+    assert writer.flush() == []
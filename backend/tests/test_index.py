@@ -0,0 +1,168 @@
+import json
+
+import pytest
+
+from app import index
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(index, "INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(index, "_loaded", {})
+    monkeypatch.setattr(index, "_user_locks", {})
+    monkeypatch.setattr(index, "get_s3_documents", lambda email: [])
+    return tmp_path
+
+
+def build(*docs):
+    # docs are (doc_name, text), versions in order
+    records = [{**index.document_record(name, text), "version": n} for n, (name, text) in enumerate(docs, 1)]
+    return index.UserIndex("a@example.com").with_documents(records)
+
+
+def test_trigrams_are_per_token_with_word_boundaries():
+    assert index.trigrams("Ab") == {" ab", "ab "}
+    assert index.trigrams("to be") == {" to", "to ", " be", "be "}
+    assert index.trigrams("!!") == set()
+
+
+def test_candidates_returns_matching_lines_per_document():
+    user_index = build(("a.txt", "Invoice Number: INV-1\nTotal Amount: 42.00"),
+                       ("b.txt", "Purchase Order\nSupplier: Globex"))
+    assert user_index.candidates("invoice number") == {"a.txt": [0]}
+    assert user_index.candidates("supplier globex") == {"b.txt": [1]}
+    assert user_index.candidates("?!") == {}
+
+
+def test_candidates_tolerates_typos():
+    user_index = build(("a.txt", "Vendor: Starship Industries"))
+    assert user_index.candidates("starshp industries") == {"a.txt": [0]}
+
+
+def test_candidates_needs_enough_trigram_overlap(monkeypatch):
+    user_index = build(("a.txt", "falcon"))
+    monkeypatch.setattr(index, "MIN_TRIGRAM_OVERLAP", 1.0)
+    assert user_index.candidates("falcon raptor") == {}
+    monkeypatch.setattr(index, "MIN_TRIGRAM_OVERLAP", 0.3)
+    assert user_index.candidates("falcon raptor") == {"a.txt": [0]}
+
+
+def test_with_documents_leaves_the_snapshot_untouched():
+    before = build(("a.txt", "old falcon line"))
+    after = before.with_documents([{**index.document_record("a.txt", "new raptor line"), "version": 2},
+                                   {**index.document_record("b.txt", "falcon again"), "version": 3}])
+
+    assert before.candidates("falcon") == {"a.txt": [0]}
+    assert before.get_lines("a.txt") == ["old falcon line"]
+    assert (before.version, sorted(before.docs)) == (1, ["a.txt"])
+
+    # The re-uploaded document only matches on its new text
+    assert after.candidates("falcon") == {"b.txt": [0]}
+    assert after.candidates("raptor") == {"a.txt": [0]}
+    assert after.version == 3
+
+
+def test_segments_stay_logarithmic_and_drop_replaced_documents():
+    user_index = build(("a.txt", "first"))
+    for n in range(2, 65):
+        user_index = user_index.with_documents([{**index.document_record(f"{n % 8}.txt", f"text {n} falcon"),
+                                                 "version": n}])
+    assert len(user_index.segments) <= 7
+    assert sorted(user_index.candidates("falcon")) == sorted(f"{n}.txt" for n in range(8))
+    # Older entries of a re-uploaded document may linger until merged, but only one of them is live
+    for doc_name in user_index.docs:
+        assert sum(user_index._live(doc_name, versions) for _, versions in user_index.segments
+                   if doc_name in versions) == 1
+
+
+def test_records_round_trip():
+    user_index = build(("a.txt", "Invoice INV-1\ntotal 5"), ("b.txt", "order 7"))
+    rebuilt = index.UserIndex("a@example.com").with_documents(user_index.records())
+    assert rebuilt.docs == user_index.docs
+    for query in ("invoice", "total 5", "order"):
+        assert rebuilt.candidates(query) == user_index.candidates(query)
+
+
+def test_index_document_appends_and_reloads(index_dir):
+    index.index_document("a@example.com", "a.txt", "Invoice falcon", [0])
+    index.index_document("a@example.com", "b.txt", "Purchase order", [0])
+    index.index_document("a@example.com", "a.txt", "Invoice raptor", [0])
+
+    log = [json.loads(line) for line in open(f"{index._user_path('a@example.com')}.jsonl")]
+    assert [record["doc"] for record in log] == ["a.txt", "b.txt", "a.txt"]
+
+    index._loaded.clear()  #as a new process would
+    reloaded = index.load_index("a@example.com")
+    assert reloaded.version == 3
+    assert reloaded.get_lines("a.txt") == ["Invoice raptor"]
+    assert reloaded.candidates("falcon") == {}
+
+
+def test_reader_picks_up_lines_appended_by_another_worker(index_dir):
+    index.index_document("a@example.com", "a.txt", "falcon")
+    snapshot = index.load_index("a@example.com")
+    record = {**index.document_record("b.txt", "falcon two"), "version": 2}
+    with open(f"{index._user_path('a@example.com')}.jsonl", "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.write('{"doc": "half a line')  #still being written, not read yet
+
+    current = index.load_index("a@example.com")
+    assert sorted(current.docs) == ["a.txt", "b.txt"]
+    assert sorted(snapshot.docs) == ["a.txt"]
+
+
+def test_log_is_compacted_once_mostly_superseded(index_dir, monkeypatch):
+    monkeypatch.setattr(index, "COMPACT_MIN_LINES", 4)
+    for n in range(10):
+        index.index_document("a@example.com", "a.txt", f"version {n}")
+    lines = open(f"{index._user_path('a@example.com')}.jsonl").read().splitlines()
+    assert len(lines) <= 4
+    index._loaded.clear()
+    assert index.load_index("a@example.com").get_lines("a.txt") == ["version 9"]
+
+
+def test_legacy_single_file_index_is_converted(index_dir):
+    legacy = {"email": "a@example.com", "version": 4,
+              "docs": {"a.txt": {"lines": ["falcon"]}, "b.txt": {"lines": ["raptor"]}},
+              "postings": {gram: {"a.txt": [0]} for gram in index.trigrams("falcon")}}
+    legacy["postings"].update({gram: {"b.txt": [0]} for gram in index.trigrams("raptor")})
+    path = f"{index._user_path('a@example.com')}.json"
+    with open(path, "w") as f:
+        json.dump(legacy, f)
+
+    user_index = index.load_index("a@example.com")
+    assert user_index.version == 4
+    assert user_index.candidates("falcon") == {"a.txt": [0]}
+    assert user_index.get_chunks("b.txt")[0]["page_start"] is None
+    assert not (index_dir / path.split("/")[-1]).exists()
+
+
+def test_missing_index_is_backfilled_from_s3(index_dir, monkeypatch):
+    texts = {"a@example.com_x.pdf.txt": "Invoice falcon", "a@example.com_empty.pdf.txt": "  "}
+    monkeypatch.setattr(index, "get_s3_documents", lambda email: list(texts))
+    monkeypatch.setattr(index, "get_s3_file_content", lambda key: texts[key.split("/")[-1]])
+
+    user_index = index.get_or_build_index("a@example.com")
+    assert sorted(user_index.docs) == ["a@example.com_x.pdf.txt"]
+    assert index.get_index_version("a@example.com") == 1
+
+
+def test_rebuild_picks_up_documents_catalogued_later(index_dir, monkeypatch):
+    texts = {}
+    monkeypatch.setattr(index, "get_s3_documents", lambda email: list(texts))
+    monkeypatch.setattr(index, "get_s3_file_content", lambda key: texts[key.split("/")[-1]])
+
+    #searched before catalog_reconcile backfilled the older documents
+    assert index.get_or_build_index("a@example.com").docs == {}
+    index.index_document("a@example.com", "a@example.com_new.pdf.txt", "uploaded meanwhile")
+    old_version = index.get_index_version("a@example.com")
+
+    texts.update({"a@example.com_old.pdf.txt": "Invoice falcon", "a@example.com_older.pdf.txt": "Order raptor"})
+    index.rebuild_index("a@example.com")
+    index._loaded.clear()  #as the server process would, the log was replaced
+
+    user_index = index.load_index("a@example.com")
+    assert sorted(user_index.docs) == ["a@example.com_new.pdf.txt", "a@example.com_old.pdf.txt",
+                                       "a@example.com_older.pdf.txt"]
+    assert user_index.candidates("falcon") == {"a@example.com_old.pdf.txt": [0]}
+    assert user_index.version > old_version
@@ -0,0 +1,198 @@
+import re
+
+import fitz
+import pytest
+
+from app import ingest
+from app.text_encoding import sidecar_key
+
+
+def make_pdf(*pages) -> bytes:
+    document = fitz.open()
+    for text in pages:
+        document.new_page().insert_text((72, 72), text)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    # Everything past the pipeline itself is faked: S3 and the content records are dicts,
+    # the classifier says invoice and the LLM reads the invoice number off the text
+    calls = {"uploaded": [], "deleted": [], "indexed": [], "catalogued": [], "remembered": [], "linked": []}
+    objects, records, associations = {}, {}, set()
+    calls["objects"], calls["index_text"] = objects, {}
+
+    def upload(file_data, s3_key, extra_args=None):
+        objects[s3_key] = file_data.read()
+        calls["uploaded"].append(s3_key)
+        return s3_key
+
+    def store_text(text_s3_key, pages):
+        objects[text_s3_key] = "".join(pages).encode()
+        objects[sidecar_key(text_s3_key)] = b"{}"
+        calls["uploaded"].extend([text_s3_key, sidecar_key(text_s3_key)])
+
+    def copy(source, dest):
+        objects[dest] = objects[source]
+
+    def copy_text(source, dest):
+        copy(source, dest)
+        copy(sidecar_key(source), sidecar_key(dest))
+
+    def extract_data(text, doc_type, email, filename, writer=None):
+        number = re.search(r"INV-\d+", text)
+        return {"invoice_number": number and number.group(0), "total_amount": "10", "email": email,
+                "document_name": filename}
+
+    def index(email, doc_name, text, page_starts):
+        calls["indexed"].append(doc_name)
+        calls["index_text"][doc_name] = text
+
+    def save_record(file_hash, doc_s3_key, text_s3_key, doc_type, extracted_data, page_starts):
+        calls["remembered"].append((file_hash, doc_s3_key, text_s3_key, doc_type, extracted_data, page_starts))
+        records[file_hash] = {"content_hash": file_hash, "doc_s3_key": doc_s3_key, "text_s3_key": text_s3_key,
+                              "document_type": doc_type, "extracted_data": extracted_data, "page_starts": page_starts}
+
+    def associate(file_hash, email, filename):
+        calls["linked"].append(email)
+        new = (file_hash, email, filename) not in associations
+        associations.add((file_hash, email, filename))
+        return new
+
+    def delete(keys):
+        calls["deleted"].extend(keys)
+        for key in keys:
+            objects.pop(key, None)
+
+    monkeypatch.setattr(ingest, "get_content_record", records.get)
+    monkeypatch.setattr(ingest, "upload_file_to_s3", upload)
+    monkeypatch.setattr(ingest, "store_extracted_text", store_text)
+    monkeypatch.setattr(ingest, "copy_s3_object", copy)
+    monkeypatch.setattr(ingest, "copy_extracted_text", copy_text)
+    monkeypatch.setattr(ingest, "get_s3_file_content", lambda key: objects[key].decode())
+    monkeypatch.setattr(ingest, "classify_document", lambda text: "invoice")
+    monkeypatch.setattr(ingest, "extract_data_based_on_type", extract_data)
+    monkeypatch.setattr(ingest, "store_extracted_data", lambda extracted_data, doc_type, writer=None: None)
+    monkeypatch.setattr(ingest, "delete_s3_objects", delete)
+    monkeypatch.setattr(ingest, "index_document", index)
+    monkeypatch.setattr(ingest, "save_document", lambda entry: calls["catalogued"].append(entry))
+    monkeypatch.setattr(ingest, "save_content_record", save_record)
+    monkeypatch.setattr(ingest, "add_content_association", associate)
+    return calls
+
+
+def test_process_document_runs_every_stage(pipeline):
+    events = []
+    response = ingest.process_document(make_pdf("Invoice INV-1", "Total 10"), "a.pdf", "u@example.com",
+                                       on_stage=lambda stage, status, seconds=None: events.append((stage, status)))
+
+    assert response["document_type"] == "invoice"
+    assert response["extracted_data"]["invoice_number"] == "INV-1"
+    assert response["cache_hit"] is False
+    for stage in ("upload_original", "extract_text", "upload_text", "classify", "extract_data"):
+        assert [status for name, status in events if name == stage] == ["running", "completed"]
+    assert sorted(pipeline["uploaded"]) == sorted(["documents/u@example.com_a.pdf", "extractedtexts/u@example.com_a.pdf.txt",
+                                                   sidecar_key("extractedtexts/u@example.com_a.pdf.txt")])
+    assert pipeline["indexed"] == ["u@example.com_a.pdf.txt"]
+    assert pipeline["catalogued"][0]["page_count"] == 2
+    assert pipeline["deleted"] == []
+
+
+def test_failed_stage_deletes_what_was_uploaded(pipeline, monkeypatch):
+    def classify(text):
+        raise RuntimeError("classifier down")
+
+    monkeypatch.setattr(ingest, "classify_document", classify)
+    events = []
+    with pytest.raises(RuntimeError):
+        ingest.process_document(make_pdf("Invoice"), "a.pdf", "u@example.com",
+                                on_stage=lambda stage, status, seconds=None: events.append((stage, status)))
+
+    assert ("classify", "failed") in events
+    assert sorted(pipeline["deleted"]) == sorted(pipeline["uploaded"])
+    assert pipeline["indexed"] == pipeline["catalogued"] == pipeline["remembered"] == []
+
+
+def test_stages_that_never_ran_are_not_deleted(pipeline, monkeypatch):
+    def extract_pages(source):
+        raise ValueError("not a PDF")
+
+    monkeypatch.setattr(ingest, "_extract_pages", extract_pages)
+    with pytest.raises(ValueError):
+        ingest.process_document(b"not a pdf", "a.pdf", "u@example.com")
+    assert pipeline["deleted"] == ["documents/u@example.com_a.pdf"]
+
+
+def test_is_reusable():
+    assert ingest.is_reusable("invoice", {"invoice_number": "INV-1", "email": "u@example.com"})
+    assert ingest.is_reusable("other", {})
+    assert not ingest.is_reusable("invoice", {"invoice_number": "None", "total_amount": None, "email": "u@example.com"})
+    assert not ingest.is_reusable("purchase order", None)
+    for failure in ingest.CLASSIFICATION_FAILURES:
+        assert not ingest.is_reusable(failure, {})
+
+
+@pytest.mark.parametrize("doc_type, extracted_data, pages", [
+    ("Error", {}, ["text"]),
+    ("invoice", {"invoice_number": None, "email": "u@example.com"}, ["text"]),
+    ("other", {}, ["  ", "\n"]),
+])
+def test_failed_results_are_not_remembered(pipeline, doc_type, extracted_data, pages):
+    ingest._remember("hash", "doc", "text", doc_type, extracted_data, pages, "u@example.com", "a.pdf")
+    assert pipeline["remembered"] == pipeline["linked"] == []
+
+
+def test_successful_result_is_remembered_under_content_keys(pipeline):
+    pipeline["objects"].update({"doc": b"%PDF", "text": b"abc", sidecar_key("text"): b"{}"})
+    ingest._remember("hash", "doc", "text", "invoice", {"invoice_number": "INV-1", "email": "u@example.com",
+                                                        "document_name": "a.pdf"}, ["ab", "c"], "u@example.com", "a.pdf")
+    assert pipeline["remembered"] == [("hash", "content/hash", "content/hash.txt", "invoice", {"invoice_number": "INV-1"}, [0, 2])]
+    assert pipeline["objects"]["content/hash"] == b"%PDF"
+    assert pipeline["objects"][sidecar_key("content/hash.txt")] == b"{}"
+    assert pipeline["linked"] == ["u@example.com"]
+
+
+def test_known_content_is_reused(pipeline):
+    pdf = make_pdf("Invoice INV-1")
+    ingest.process_document(pdf, "a.pdf", "v@example.com")
+    uploaded = len(pipeline["uploaded"])
+
+    response = ingest.process_document(pdf, "b.pdf", "u@example.com")
+    assert response["cache_hit"] is True
+    assert response["extracted_data"] == {"invoice_number": "INV-1", "total_amount": "10", "email": "u@example.com",
+                                          "document_name": "b.pdf"}
+    assert len(pipeline["uploaded"]) == uploaded
+    assert pipeline["objects"]["documents/u@example.com_b.pdf"] == pdf
+    assert pipeline["indexed"][-1] == "u@example.com_b.pdf.txt"
+
+
+def test_reuse_survives_the_name_being_overwritten(pipeline):
+    first, second = make_pdf("Invoice INV-1"), make_pdf("Invoice INV-2")
+    ingest.process_document(first, "a.pdf", "u@example.com")
+    ingest.process_document(second, "a.pdf", "u@example.com")  #different bytes, same keys
+
+    response = ingest.process_document(first, "c.pdf", "v@example.com")
+    assert response["cache_hit"] is True
+    assert response["extracted_data"]["invoice_number"] == "INV-1"
+    assert pipeline["objects"]["documents/v@example.com_c.pdf"] == first
+    assert "INV-1" in pipeline["objects"]["extractedtexts/v@example.com_c.pdf.txt"].decode()
+    assert "INV-1" in pipeline["index_text"]["v@example.com_c.pdf.txt"]
+
+
+def known_record(doc_type, extracted_data, doc_s3_key="content/hash"):
+    return {"content_hash": "hash", "doc_s3_key": doc_s3_key, "text_s3_key": f"{doc_s3_key}.txt",
+            "document_type": doc_type, "extracted_data": extracted_data, "page_starts": [0]}
+
+
+@pytest.mark.parametrize("record", [
+    known_record("Error", {}),                                                       #saved before failures were filtered out
+    known_record("invoice", {"invoice_number": "INV-1"}, "documents/v@example.com_a.pdf"),  #saved before content keys
+])
+def test_stale_record_is_processed_again_and_replaced(pipeline, monkeypatch, record):
+    monkeypatch.setattr(ingest, "get_content_record", lambda file_hash: record)
+    response = ingest.process_document(make_pdf("Invoice INV-1"), "b.pdf", "u@example.com")
+    assert response["cache_hit"] is False
+    assert response["document_type"] == "invoice"
+    assert pipeline["remembered"][0][1] == ingest.content_keys(response["content_hash"])[0]
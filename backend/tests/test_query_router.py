@@ -0,0 +1,127 @@
+from datetime import date
+
+import pytest
+
+from app import query_router
+from app.query_router import parse_query
+
+
+def intent_of(query):
+    intent = parse_query(query)
+    return intent and {key: value for key, value in intent.items() if value is not None}
+
+
+def test_lookup_by_number():
+    assert intent_of("what is the total of invoice INV-0042?") == {
+        "table": "invoices", "aggregate": "lookup", "number": "INV-0042"}
+    assert intent_of("who is the supplier on PO #7781") == {
+        "table": "purchase_orders", "aggregate": "lookup", "number": "7781"}
+
+
+def test_count_with_party_and_year():
+    assert intent_of("how many invoices from Acme in 2024?") == {
+        "table": "invoices", "aggregate": "count", "party": "Acme",
+        "date_from": date(2024, 1, 1), "date_to": date(2025, 1, 1)}
+
+
+def test_sum_since_month():
+    assert intent_of("total spent on purchase orders from Globex since March 2024") == {
+        "table": "purchase_orders", "aggregate": "sum", "party": "Globex", "date_from": date(2024, 3, 1)}
+
+
+def test_list_between_dates():
+    assert intent_of("show invoices from Acme between 2024-01-01 and 2024-06-30") == {
+        "table": "invoices", "aggregate": "list", "party": "Acme",
+        "date_from": date(2024, 1, 1), "date_to": date(2024, 7, 1)}
+
+
+@pytest.mark.parametrize("query", [
+    "what does the contract say about penalties?",          #neither kind
+    "compare invoices and purchase orders from Acme",       #both kinds
+    "what is the payment method on invoice INV-0042?",      #a field that wasn't extracted
+    "show invoices",                                        #a list needs a filter
+    "what is the total of the last invoice from Acme?",     #ordering
+    "how much is the average invoice from Acme",            #statistics other than count/sum
+    "which invoices mention late fees from 2023",           #conditions on the text
+    "show all invoices with tax over 100 from Acme",        #amount comparison on a field we don't extract
+    "what is the due date on invoice INV-0042?",            #due date isn't extracted
+    "what did invoice INV-0042 cost?",
+])
+def test_unsupported_questions_go_to_full_text_search(query):
+    assert parse_query(query) is None
+
+
+def test_payments_without_a_kind_are_invoices(monkeypatch):
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return cls(2025, 2, 10)
+
+    monkeypatch.setattr(query_router, "date", Today)
+    assert intent_of("how much did we pay Acme in March") == {
+        "table": "invoices", "aggregate": "sum", "party": "Acme",
+        "date_from": date(2024, 3, 1), "date_to": date(2024, 4, 1)}  #the latest March
+    assert intent_of("how much did we pay on purchase orders from Globex") == {
+        "table": "purchase_orders", "aggregate": "sum", "party": "Globex"}
+
+
+def test_numbers_for_a_party_are_listed():
+    assert intent_of("PO number for supplier Globex") == {
+        "table": "purchase_orders", "aggregate": "list", "party": "Globex"}
+
+
+def test_unknown_dates_are_ignored():
+    assert intent_of("how many invoices in Smarch 2024?") == {"table": "invoices", "aggregate": "count"}
+    assert intent_of("how many invoices dated 2024-13-01") == {"table": "invoices", "aggregate": "count"}
+
+
+@pytest.fixture
+def structured(monkeypatch):
+    calls = []
+
+    def query_structured(table, aggregate, email, **filters):
+        calls.append((table, aggregate, email, filters))
+        return structured.result
+
+    monkeypatch.setattr(query_router, "query_structured", query_structured)
+    monkeypatch.setattr(query_router, "QUERY_ROUTER_ENABLED", True)
+    structured.calls = calls
+    return structured
+
+
+def test_answer_count(structured):
+    structured.result = {"count": 3}
+    response = query_router.answer_with_sql("how many invoices from Acme?", "u@example.com")
+    assert response["answer"] == "You have 3 invoices from vendors matching 'Acme'."
+    assert response["intent"] == "count"
+    table, aggregate, email, filters = structured.calls[0]
+    assert (table, aggregate, email, filters["party"]) == ("invoices", "count", "u@example.com", "Acme")
+
+
+def test_answer_sum_reports_rows_without_a_total(structured):
+    structured.result = {"count": 2, "with_amount": 1, "total": 1234.5}
+    response = query_router.answer_with_sql("total spent on purchase orders in 2024", "u@example.com")
+    assert response["answer"] == ("The 2 purchase orders dated 2024-01-01 to 2024-12-31 add up to 1,234.50. "
+                                  "(1 without a readable total is not included.)")
+
+
+def test_answer_lookup_cites_documents(structured):
+    structured.result = [{"number": "INV-1", "document_name": "a.pdf", "date": "2024-01-02", "party": "Acme",
+                          "total_amount": "10.00"}]
+    response = query_router.answer_with_sql("what is the total of invoice INV-1", "u@example.com")
+    assert response["answer"] == "Invoice INV-1 (a.pdf): dated 2024-01-02, vendor Acme, total 10.00"
+    assert response["source_documents"] == ["a.pdf"]
+
+
+@pytest.mark.parametrize("result", [[], {"count": 0, "with_amount": 0, "total": 0}])
+def test_no_rows_falls_back(structured, result):
+    structured.result = result
+    before = query_router.get_router_stats()["sql_no_rows"]
+    assert query_router.answer_with_sql("how many invoices from Acme?", "u@example.com") is None
+    assert query_router.get_router_stats()["sql_no_rows"] == before + 1
+
+
+def test_disabled_router_never_queries(structured, monkeypatch):
+    monkeypatch.setattr(query_router, "QUERY_ROUTER_ENABLED", False)
+    assert query_router.answer_with_sql("how many invoices from Acme?", "u@example.com") is None
+    assert structured.calls == []
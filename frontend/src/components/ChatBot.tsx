@@ -24,17 +24,49 @@ const ChatBot: React.FC<ChatBotProps> = ({ email }) => {
     setLoading(true);
 
     try {
-      const response = await fetch('http://localhost:8000/search_answer/', {
+      // Streams the answer: sources arrive first, then the answer text as it is written
+      const response = await fetch('http://localhost:8000/search_answer/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ query, email })
       });
 
-      const data = await response.json();
+      if (!response.ok || !response.body) {
+        setMessages([...newMessages, { type: 'bot', text: 'No answer found.' }]);
+        return;
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let answer = '';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = raw.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+
+          if (event === 'delta') {
+            answer += payload.text;
+            setLoading(false);
+            setMessages([...newMessages, { type: 'bot', text: answer }]);
+          } else if (event === 'error') {
+            answer = answer || payload.detail;
+            setMessages([...newMessages, { type: 'bot', text: answer }]);
+          }
+        }
+      }
 
-      if (response.ok) {
-        setMessages([...newMessages, { type: 'bot', text: data.answer }]);
-      } else {
+      if (!answer) {
         setMessages([...newMessages, { type: 'bot', text: 'No answer found.' }]);
       }
     } catch (error) {